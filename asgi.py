@@ -0,0 +1,15 @@
+"""
+Asynchronous Server Gateway Interface (ASGI) entry point
+
+Serves the same API as wsgi.py with async handlers, for example with:
+    hypercorn asgi:app
+"""
+import os
+from service.aio import create_app
+
+PORT = int(os.getenv("PORT", "8000"))
+
+app = create_app()
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=PORT)
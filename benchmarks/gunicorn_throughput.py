@@ -0,0 +1,163 @@
+"""
+Throughput of the service under different gunicorn worker models
+
+Starts gunicorn with gunicorn.conf.py once per worker model, seeds a
+shopcart, and drives GET requests at it from concurrent keep-alive
+clients for a fixed time. Reports requests per second and latency
+percentiles for each model so they can be compared on the same machine.
+
+Usage:
+    DATABASE_URI=postgresql+psycopg://... python benchmarks/gunicorn_throughput.py \
+        --model sync:4:1 --model gthread:2:4 --model gevent:2:1
+"""
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_model(text):
+    """Parses worker_class:workers:threads into a tuple"""
+    worker_class, workers, threads = text.split(":")
+    return worker_class, int(workers), int(threads)
+
+
+def request(conn, method, path, body=None):
+    """Sends one request on a keep-alive connection and returns the status and body"""
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+    conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = conn.getresponse()
+    return response.status, response.read()
+
+
+def start_server(model, port):
+    """Starts gunicorn with one worker model and waits until it answers"""
+    worker_class, workers, threads = model
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        GUNICORN_WORKER_CLASS=worker_class,
+        GUNICORN_WORKERS=str(workers),
+        GUNICORN_THREADS=str(threads),
+        GUNICORN_LOG_LEVEL="warning",
+    )
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, "-m", "gunicorn", "wsgi:app"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            if request(conn, "GET", "/health")[0] == 200:
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"gunicorn did not start with {model}")
+
+
+def seed(port, items):
+    """Creates a shopcart holding a number of items and returns its path"""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    _, body = request(conn, "POST", "/shopcarts", {"user_id": "benchmark", "items": []})
+    shopcart_id = json.loads(body)["id"]
+    rows = [
+        {
+            "cart_id": shopcart_id,
+            "product_name": f"product {count}",
+            "product_id": count,
+            "product_price": "9.99",
+            "quantity": 1,
+        }
+        for count in range(items)
+    ]
+    request(conn, "POST", f"/shopcarts/{shopcart_id}/items", rows)
+    return f"/shopcarts/{shopcart_id}"
+
+
+def drive(port, path, clients, duration):
+    """Sends requests from concurrent clients for a duration and returns the latencies"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    stop = time.monotonic() + duration
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        mine, failed = [], 0
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            try:
+                code, _ = request(conn, "GET", path)
+            except (OSError, http.client.HTTPException):
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                code = 0
+            if code == 200:
+                mine.append(time.perf_counter() - start)
+            else:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), sum(errors)
+
+
+def percentile(latencies, fraction):
+    """Returns a percentile of sorted latencies in milliseconds"""
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000
+
+
+def main():
+    """Runs the comparison and prints one row per worker model"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--model", action="append", type=parse_model,
+                        help="worker_class:workers:threads, may be repeated")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per model")
+    parser.add_argument("--items", type=int, default=20, help="items in the shopcart")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    models = args.model or [("sync", 4, 1), ("gthread", 2, 4), ("gevent", 2, 1)]
+
+    print(f"{'model':<20} {'req/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'errors':>8}")
+    for model in models:
+        if model[0] == "gevent" and importlib.util.find_spec("gevent") is None:
+            print(f"{':'.join(map(str, model)):<20} skipped, gevent is not installed")
+            continue
+        server = start_server(model, args.port)
+        try:
+            path = seed(args.port, args.items)
+            drive(args.port, path, args.clients, 1)  # warm up
+            latencies, errors = drive(args.port, path, args.clients, args.duration)
+        finally:
+            server.terminate()
+            server.wait()
+        print(
+            f"{':'.join(map(str, model)):<20} {len(latencies) / args.duration:>10.1f} "
+            f"{percentile(latencies, 0.50):>10.2f} {percentile(latencies, 0.95):>10.2f} "
+            f"{percentile(latencies, 0.99):>10.2f} {errors:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
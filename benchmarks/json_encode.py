@@ -0,0 +1,67 @@
+"""
+Encode time of the JSON responses
+
+Serializes shopcarts with many items, then encodes them into a response
+with Flask's JSON provider and with the orjson provider. Reports the
+milliseconds per response for each and checks that the bodies are the
+same bytes. No database is needed.
+
+Usage:
+    python benchmarks/json_encode.py --items 100 1000 10000 --repeat 20
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timezone
+from time import perf_counter
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from service.common.json_provider import FastJSONProvider  # noqa: E402 pylint: disable=wrong-import-position
+from service.models import Shopcart  # noqa: E402 pylint: disable=wrong-import-position
+from tests.factories import ItemFactory  # noqa: E402 pylint: disable=wrong-import-position
+
+
+def large_cart(size):
+    """Returns the serialized form of a shopcart with the given number of items"""
+    now = datetime.now(timezone.utc)
+    items = ItemFactory.build_batch(size, cart_id=1)
+    shopcart = Shopcart(id=1, user_id="bench", creation_date=now, last_updated=now, items=items)
+    shopcart.item_count = sum(item.quantity for item in items)
+    return shopcart.serialize()
+
+
+def per_response(provider, payload, repeat):
+    """Returns the milliseconds one response takes on average, and its body"""
+    body = provider.response(payload).get_data()
+    start = perf_counter()
+    for _ in range(repeat):
+        provider.response(payload)
+    return (perf_counter() - start) / repeat * 1000, body
+
+
+def main():
+    """Runs the measurements and prints them"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, nargs="+", default=[100, 1000, 10000], help="items per shopcart")
+    parser.add_argument("--repeat", type=int, default=20, help="responses encoded per measurement")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    providers = (DefaultJSONProvider(app), FastJSONProvider(app))
+    print(f"{'items':>8} {'bytes':>10} {'flask ms':>10} {'orjson ms':>10} {'speedup':>8}")
+    with app.app_context():
+        for size in args.items:
+            payload = large_cart(size)
+            (slow, expected), (fast, body) = (
+                per_response(provider, payload, args.repeat) for provider in providers
+            )
+            if body != expected:
+                sys.exit(f"The bodies for {size} items differ")
+            print(f"{size:>8} {len(body):>10} {slow:>10.3f} {fast:>10.3f} {slow / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
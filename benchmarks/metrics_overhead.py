@@ -0,0 +1,84 @@
+"""
+Per-request overhead of the Prometheus metrics
+
+Times the metrics hooks of a request and of a SQL statement on their own,
+then sends GET /health through the Flask test client with the metrics
+enabled and disabled. Reports microseconds per request for each, so the
+cost of the metrics can be checked against the time of a whole request.
+
+Usage:
+    DATABASE_URI=postgresql+psycopg://... python benchmarks/metrics_overhead.py --requests 20000
+"""
+import argparse
+import os
+import sys
+from time import perf_counter
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wsgi import app  # noqa: E402 pylint: disable=wrong-import-position
+from service.common import metrics  # noqa: E402 pylint: disable=wrong-import-position
+
+
+def per_call(function, count):
+    """Returns the microseconds one call of a function takes on average"""
+    start = perf_counter()
+    for _ in range(count):
+        function()
+    return (perf_counter() - start) / count * 1_000_000
+
+
+def request_hooks(count):
+    """Times the hooks that run around every request"""
+    response = app.response_class("", 200)
+
+    def hooks():
+        metrics.start_timer()
+        metrics.record_request(response)
+
+    with app.test_request_context("/shopcarts"):
+        return per_call(hooks, count)
+
+
+def statement_hooks(count):
+    """Times the hooks that run around every SQL statement"""
+    conn = SimpleNamespace(info={})
+
+    def hooks():
+        metrics.start_statement(conn, None, None, None, None, False)
+        metrics.end_statement(conn, None, None, None, None, False)
+
+    with app.test_request_context("/shopcarts"):
+        metrics.start_timer()
+        return per_call(hooks, count)
+
+
+def whole_request(count, enabled):
+    """Times GET /health through the test client"""
+    app.config["METRICS_ENABLED"] = enabled
+    client = app.test_client()
+    client.get("/health")  # warm up
+    return per_call(lambda: client.get("/health"), count)
+
+
+def main():
+    """Runs the measurements and prints them"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=20000, help="iterations of each measurement")
+    args = parser.parse_args()
+
+    hooks = request_hooks(args.requests)
+    statement = statement_hooks(args.requests)
+    disabled = whole_request(args.requests, False)
+    enabled = whole_request(args.requests, True)
+    print(f"{'measurement':<32} {'us':>10}")
+    print(f"{'request hooks':<32} {hooks:>10.2f}")
+    print(f"{'statement hooks':<32} {statement:>10.2f}")
+    print(f"{'GET /health, metrics disabled':<32} {disabled:>10.2f}")
+    print(f"{'GET /health, metrics enabled':<32} {enabled:>10.2f}")
+    print(f"{'overhead per request':<32} {enabled - disabled:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Startup time of a worker
+
+Starts a new interpreter a number of times, and in each one times the import
+of wsgi.py, which creates the app and checks the schema, and the first
+request to /health through the Flask test client. The schema check is also
+timed on its own against the db.create_all it replaced, each on a new
+connection, as a worker makes them when it boots. Reports the median,
+minimum and maximum of each in milliseconds.
+
+Usage:
+    DATABASE_URI=postgresql+psycopg://... python benchmarks/startup.py --runs 20
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs in a new interpreter, so nothing is imported or connected beforehand
+WORKER = """
+import json
+from time import perf_counter
+
+start = perf_counter()
+import wsgi
+imported = perf_counter()
+wsgi.app.test_client().get("/health")
+served = perf_counter()
+
+from service.common import migrations
+from service.models import db
+
+with wsgi.app.app_context():
+    db.engine.dispose()
+    before = perf_counter()
+    migrations.probe(db.engine)
+    probed = perf_counter()
+    db.engine.dispose()
+    db.create_all()
+    created = perf_counter()
+
+print(json.dumps({
+    "import": imported - start,
+    "first request": served - imported,
+    "import to first request": served - start,
+    "schema probe": probed - before,
+    "create_all": created - probed,
+}))
+"""
+
+
+def run_worker():
+    """Starts one interpreter and returns its timings in seconds"""
+    env = dict(os.environ, GUNICORN_LOG_LEVEL="warning", METRICS_ENABLED="false")
+    output = subprocess.run(
+        [sys.executable, "-c", WORKER], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    """Runs the workers and prints one row per phase"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=10, help="interpreters to start")
+    args = parser.parse_args()
+
+    run_worker()  # warm up the file system cache and the database
+    runs = [run_worker() for _ in range(args.runs)]
+
+    print(f"{'phase':<26} {'median ms':>10} {'min ms':>10} {'max ms':>10}")
+    for phase in runs[0]:
+        samples = [run[phase] * 1000 for run in runs]
+        print(f"{phase:<26} {statistics.median(samples):>10.2f} {min(samples):>10.2f} {max(samples):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""
+Benchmark suite for the models, serialization and routes
+
+Builds a dataset with tests/factories.py at each scale. A scale is a number
+of items, not shopcarts, and the items go ten to a shopcart, so the default
+scales of 10, 1,000 and 100,000 items make 1, 100 and 10,000 shopcarts. It
+then times Shopcart.serialize, Item.deserialize, every finder of the Item
+model and every route through the Flask test client.
+Each case is run repeatedly and reported as p50/p95/p99 in milliseconds,
+plus the peak and retained memory of one more run under tracemalloc.
+
+The results are written to a JSON baseline. With --compare the suite runs
+again and flags every case that got slower or allocates more than the
+baseline by more than --threshold, and exits with 1 if there are any.
+
+The data is added to the database in DATABASE_URI under user_ids starting
+with "benchmark-" and removed again afterwards.
+
+Usage:
+    DATABASE_URI=postgresql+psycopg://... python benchmarks/suite.py \
+        --scales 10,1000,100000 --output baseline.json
+    DATABASE_URI=postgresql+psycopg://... python benchmarks/suite.py \
+        --compare baseline.json --threshold 0.25
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tracemalloc
+from datetime import datetime, timezone
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from wsgi import app  # noqa: E402
+from service.models import db, Shopcart, Item  # noqa: E402
+from tests.factories import ItemFactory  # noqa: E402
+
+USER_PREFIX = "benchmark-"
+CART_SIZE = 10
+BATCH_SIZE = 100
+INSERT_CHUNK = 10000
+# differences below these are noise, whatever the threshold
+NOISE_MS = 0.05
+NOISE_KIB = 4
+
+
+######################################################################
+# Datasets
+######################################################################
+class Dataset:  # pylint: disable=too-few-public-methods
+    """The items of one scale in shopcarts of CART_SIZE, and the rows the cases use"""
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.user_id = f"{USER_PREFIX}{scale}"
+        self.items = [item.serialize() for item in ItemFactory.build_batch(scale)]
+        carts = [self.items[start:start + CART_SIZE] for start in range(0, scale, CART_SIZE)]
+        cart_ids = db.session.scalars(
+            db.insert(Shopcart).returning(Shopcart.id, sort_by_parameter_order=True),
+            [
+                {
+                    "user_id": self.user_id,
+                    "total_price": sum(row["product_price"] * row["quantity"] for row in rows),
+                    "item_count": len(rows),
+                }
+                for rows in carts
+            ],
+        ).all()
+        for cart_id, rows in zip(cart_ids, carts):
+            for row in rows:
+                row["cart_id"] = cart_id
+                del row["id"]
+        for start in range(0, scale, INSERT_CHUNK):
+            db.session.execute(db.insert(Item), self.items[start:start + INSERT_CHUNK])
+        db.session.commit()
+
+        self.cart_id = cart_ids[0]
+        self.item = db.session.scalars(
+            db.select(Item).where(Item.cart_id == self.cart_id).limit(1)
+        ).one()
+        db.session.remove()
+
+
+def remove_datasets():
+    """Deletes every shopcart the benchmarks added, with its items"""
+    db.session.execute(db.delete(Shopcart).where(Shopcart.user_id.startswith(USER_PREFIX)))
+    db.session.commit()
+    db.session.remove()
+
+
+######################################################################
+# Cases
+######################################################################
+def model_cases(dataset):
+    """Returns the cases of the models as (name, run, setup)"""
+    carts = Shopcart.eager_query().filter(Shopcart.user_id == dataset.user_id).all()
+    item = dataset.item
+    return [
+        ("Shopcart.serialize", lambda: [cart.serialize() for cart in carts], None),
+        ("Item.deserialize", lambda: [Item().deserialize(row) for row in dataset.items], None),
+        ("Item.find", lambda: Item.find(item.id), db.session.remove),
+        ("Item.all", lambda: Item.all(dataset.cart_id).all(), db.session.remove),
+        ("Item.find_by_product_id", lambda: Item.find_by_product_id(item.product_id).all(), db.session.remove),
+        ("Item.find_by_quantity", lambda: Item.find_by_quantity(item.quantity).all(), db.session.remove),
+        (
+            "Item.find_by_quantity_and_product_id",
+            lambda: Item.find_by_quantity_and_product_id(item.product_id, item.quantity).all(),
+            db.session.remove,
+        ),
+    ]
+
+
+def route_cases(client, dataset):  # pylint: disable=too-many-locals
+    """Returns the cases of the routes as (name, run, setup)"""
+    user_id = dataset.user_id
+    cart_url = f"/shopcarts/{dataset.cart_id}"
+    item_url = f"{cart_url}/items/{dataset.item.id}"
+    # the routes take the shopcart from the URL, not from the body
+    item = dict(dataset.items[0])
+    etag = client.get(cart_url).headers["ETag"]
+
+    def new_cart():
+        return client.post("/shopcarts", json={"user_id": user_id, "items": []}).get_json()["id"]
+
+    scratch_url = f"/shopcarts/{new_cart()}"
+
+    def new_item():
+        return client.post(f"{scratch_url}/items", json=item).get_json()["id"]
+
+    def full_cart():
+        cart_id = new_cart()
+        client.post(f"/shopcarts/{cart_id}/items", json=[item] * CART_SIZE)
+        return cart_id
+
+    # a streamed body is only read with buffered=True
+    return [
+        ("GET /", lambda: client.get("/"), None),
+        ("GET /health", lambda: client.get("/health"), None),
+        ("GET /shopcarts", lambda: client.get("/shopcarts"), None),
+        ("GET /shopcarts?user_id", lambda: client.get(f"/shopcarts?user_id={user_id}"), None),
+        (
+            "GET /shopcarts?user_id&stream",
+            lambda: client.get(f"/shopcarts?user_id={user_id}&stream=true", buffered=True),
+            None,
+        ),
+        ("POST /shopcarts", lambda: client.post("/shopcarts", json={"user_id": user_id, "items": []}), None),
+        ("GET /shopcarts/<id>", lambda: client.get(cart_url), None),
+        ("GET /shopcarts/<id> not modified", lambda: client.get(cart_url, headers={"If-None-Match": etag}), None),
+        ("PUT /shopcarts/<id>", lambda: client.put(cart_url, json={"user_id": user_id, "items": []}), None),
+        ("DELETE /shopcarts/<id>", lambda cart_id: client.delete(f"/shopcarts/{cart_id}"), new_cart),
+        ("GET /shopcarts/<id>/items", lambda: client.get(f"{cart_url}/items"), None),
+        ("GET /shopcarts/<id>/items?stream", lambda: client.get(f"{cart_url}/items?stream=true", buffered=True), None),
+        (
+            "GET /shopcarts/<id>/items?product_id",
+            lambda: client.get(f"{cart_url}/items?product_id={dataset.item.product_id}"),
+            None,
+        ),
+        ("POST /shopcarts/<id>/items", lambda: client.post(f"{scratch_url}/items", json=item), None),
+        (
+            f"POST /shopcarts/<id>/items x{BATCH_SIZE}",
+            lambda: client.post(f"{scratch_url}/items", json=[item] * BATCH_SIZE),
+            None,
+        ),
+        ("DELETE /shopcarts/<id>/clear", lambda cart_id: client.delete(f"/shopcarts/{cart_id}/clear"), full_cart),
+        ("GET /shopcarts/<id>/items/<item_id>", lambda: client.get(item_url), None),
+        ("PUT /shopcarts/<id>/items/<item_id>", lambda: client.put(item_url, json=item), None),
+        ("PUT .../increment", lambda: client.put(f"{item_url}/increment"), None),
+        # every decrement is matched by an increment first, so it never goes below zero
+        ("PUT .../decrement", lambda _: client.put(f"{item_url}/decrement"), lambda: client.put(f"{item_url}/increment")),
+        (
+            "DELETE /shopcarts/<id>/items/<item_id>",
+            lambda item_id: client.delete(f"{scratch_url}/items/{item_id}"),
+            new_item,
+        ),
+    ]
+
+
+######################################################################
+# Measurements
+######################################################################
+def percentile(samples, fraction):
+    """Returns a percentile of sorted samples"""
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def call(run, setup):
+    """Runs the setup of a case, untimed, and returns the timed call"""
+    if setup is None:
+        return run
+    argument = setup()
+    return run if argument is None else lambda: run(argument)
+
+
+def measure(run, setup, args):
+    """Times a case until it has enough samples or used up its time"""
+    samples = []
+    spent = 0.0
+    while len(samples) < args.min_samples or (
+        len(samples) < args.max_samples and spent < args.seconds
+    ):
+        timed = call(run, setup)
+        start = perf_counter()
+        timed()
+        elapsed = perf_counter() - start
+        samples.append(elapsed * 1000)
+        spent += elapsed
+
+    timed = call(run, setup)
+    tracemalloc.start()
+    timed()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    samples.sort()
+    return {
+        "samples": len(samples),
+        "p50_ms": round(percentile(samples, 0.50), 4),
+        "p95_ms": round(percentile(samples, 0.95), 4),
+        "p99_ms": round(percentile(samples, 0.99), 4),
+        "peak_kib": round(peak / 1024, 1),
+        "retained_kib": round(retained / 1024, 1),
+    }
+
+
+def run_suite(args):
+    """Runs every case at every scale and returns the results"""
+    client = app.test_client()
+    results = {}
+    for scale in args.scales:
+        print(f"{scale} items: building the dataset", file=sys.stderr)
+        dataset = Dataset(scale)
+        try:
+            results[str(scale)] = {}
+            for name, run, setup in model_cases(dataset) + route_cases(client, dataset):
+                results[str(scale)][name] = measure(run, setup, args)
+                print(f"{scale} items: {name}", file=sys.stderr)
+        finally:
+            remove_datasets()
+    return {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        # the scales are numbers of items, in shopcarts of cart_size items
+        "scales": args.scales,
+        "cart_size": CART_SIZE,
+        "results": results,
+    }
+
+
+######################################################################
+# Reports
+######################################################################
+def print_results(report):
+    """Prints one row per case and scale, in numbers of items"""
+    print(f"{'items':>7} {'case':<42} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak KiB':>9}")
+    for scale, cases in report["results"].items():
+        for name, result in cases.items():
+            print(
+                f"{scale:>7} {name:<42} {result['p50_ms']:>9.3f} {result['p95_ms']:>9.3f} "
+                f"{result['p99_ms']:>9.3f} {result['peak_kib']:>9.1f}"
+            )
+
+
+def regressions(baseline, report, threshold):
+    """Returns a line for every case that is worse than the baseline"""
+    found = []
+    for scale, cases in report["results"].items():
+        for name, result in cases.items():
+            before = baseline["results"].get(scale, {}).get(name)
+            if before is None:
+                continue
+            for key, noise in [("p50_ms", NOISE_MS), ("p95_ms", NOISE_MS), ("peak_kib", NOISE_KIB)]:
+                old, new = before[key], result[key]
+                if new > old * (1 + threshold) and new - old > noise:
+                    change = (new / old - 1) * 100 if old else float("inf")
+                    found.append(f"{scale:>7} {name:<42} {key:<9} {old:>10} -> {new:<10} (+{change:.0f}%)")
+    return found
+
+
+def parse_scales(text):
+    """Parses a comma separated list of scales"""
+    return [int(scale) for scale in text.split(",")]
+
+
+def main():
+    """Runs the suite and saves or compares the results"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scales", type=parse_scales, default=[10, 1000, 100000],
+                        help="numbers of items, comma separated")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare the results with this JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="fraction by which a case may be worse than the baseline")
+    parser.add_argument("--min-samples", type=int, default=5)
+    parser.add_argument("--max-samples", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=2.0, help="time spent on each case")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        args.scales = [scale for scale in args.scales if str(scale) in baseline["results"]]
+
+    app.logger.setLevel(logging.WARNING)
+    with app.app_context():
+        report = run_suite(args)
+    print_results(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    if baseline is None:
+        return 0
+
+    found = regressions(baseline, report, args.threshold)
+    print(f"\n{len(found)} regressions beyond {args.threshold:.0%} of {args.compare}")
+    for line in found:
+        print(line)
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
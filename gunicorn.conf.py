@@ -0,0 +1,94 @@
+"""
+Gunicorn configuration
+
+Loaded automatically by gunicorn from the working directory. Every setting
+can be overridden with an environment variable so the same image can be
+tuned per deployment without rebuilding it.
+"""
+import gc
+import glob
+import multiprocessing
+import os
+
+TRUE_VALUES = ("true", "1", "yes")
+
+# sync is one request per process, gthread adds a thread pool to each
+# process and gevent runs many requests on green threads (pip install gevent)
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(os.getenv("GUNICORN_WORKERS", str(multiprocessing.cpu_count() * 2 + 1)))
+# every thread may hold a database connection, so keep threads within
+# DB_POOL_SIZE + DB_MAX_OVERFLOW
+threads = int(os.getenv("GUNICORN_THREADS", "4" if worker_class == "gthread" else "1"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "100"))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+
+# import the app once in the master so the workers share its memory
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in TRUE_VALUES
+gc_freeze = os.getenv("GUNICORN_GC_FREEZE", "true").lower() in TRUE_VALUES
+
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None
+
+# where the workers keep their Prometheus metrics so /metrics can add them up
+metrics_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+
+######################################################################
+# Server hooks
+######################################################################
+def on_starting(server):
+    """Clears the metrics files left behind by the previous run"""
+    if not metrics_dir:
+        return
+    os.makedirs(metrics_dir, exist_ok=True)
+    for name in glob.glob(os.path.join(metrics_dir, "*.db")):
+        os.remove(name)
+    server.log.info("Collecting the metrics of all workers in %s", metrics_dir)
+
+
+def when_ready(server):
+    """Freezes the objects of the preloaded app before the workers are forked"""
+    server.log.info(
+        "Starting %d %s workers with %d threads each", workers, worker_class, threads
+    )
+    if preload_app and gc_freeze:
+        # objects moved to the permanent generation are never touched by the
+        # collector, so the pages holding them stay shared with the workers
+        gc.collect()
+        gc.freeze()
+        server.log.info("Froze %d objects before forking", gc.get_freeze_count())
+
+
+def post_fork(server, worker):
+    """Gives every worker its own database connections and log writer"""
+    if not preload_app:
+        return
+    # pylint: disable=import-outside-toplevel
+    from service.models import db
+    from service.common import log_handlers, pool_stats
+
+    # connections the master opened while loading the app belong to it, so
+    # forget them without closing them and let the worker open its own
+    with server.app.wsgi().app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    pool_stats.reset_counters()
+    # the thread that writes the logs stayed behind in the master
+    log_handlers.restart_logging(server.app.wsgi())
+    server.log.info("Worker %s disposed of the inherited connection pool", worker.pid)
+
+
+def child_exit(_server, worker):
+    """Stops adding the live gauges of a worker that is gone"""
+    if not metrics_dir:
+        return
+    from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+
+    multiprocess.mark_process_dead(worker.pid, metrics_dir)
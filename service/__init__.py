@@ -16,12 +16,13 @@
 Package: service
 Package for the application models and service routes
 This module creates and configures the Flask app and sets up the logging
-and SQL database
+and SQL database. The app only checks the version of the database schema
+when it starts, and `flask db-migrate` brings the schema up to date
 """
 import sys
 from flask import Flask
 from service import config
-from service.common import log_handlers
+from service.common import log_handlers, json_provider, compression
 
 
 ############################################################
@@ -32,6 +33,9 @@ def create_app():
     # Create Flask application
     app = Flask(__name__)
     app.config.from_object(config)
+    json_provider.init_json(app)
+    # registered first so that it runs after every other after_request hook
+    compression.init_compression(app)
 
     # Initialize Plugins
     # pylint: disable=import-outside-toplevel
@@ -43,10 +47,22 @@ def create_app():
         # Dependencies require we import the routes AFTER the Flask app is created
         # pylint: disable=wrong-import-position, wrong-import-order, unused-import
         from service import routes  # noqa: F401 E402
-        from service.common import error_handlers, cli_commands  # noqa: F401, E402
+        # after_request hooks run in reverse order, so replicas hands out the
+        # consistency token only after unit_of_work has committed, and metrics
+        # times the whole request, the commit included
+        from service.common import error_handlers, cli_commands, metrics  # noqa: F401, E402
+        from service.common import replicas, unit_of_work, pool_stats  # noqa: F401, E402
+        from service.common import migrations  # noqa: E402
 
         try:
-            db.create_all()
+            migrations.check_schema(app)
+        except migrations.SchemaError as error:
+            # the flask CLI loads the app too, and db-migrate has to be able
+            # to run on the schema it is going to migrate
+            if not migrations.changing_schema():
+                app.logger.critical("%s: Cannot continue", error)
+                sys.exit(4)
+            app.logger.warning("%s", error)
         except Exception as error:  # pylint: disable=broad-except
             app.logger.critical("%s: Cannot continue", error)
             # gunicorn requires exit code 4 to stop spawning workers when they die
@@ -0,0 +1,55 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Package: service.aio
+ASGI variant of the service
+
+This package serves the same REST API as the Flask app with async handlers
+over SQLAlchemy's async engine and psycopg's async driver. A request that is
+waiting on the database gives up its worker to other requests, so a single
+process can hold thousands of requests in flight on a few connections.
+"""
+from quart import Quart
+from service import config
+from service.common import log_handlers, json_provider, compression
+from .database import adb
+
+
+def create_app():
+    """Initialize the ASGI application."""
+    app = Quart(__name__, static_folder="../static")
+    app.config.from_object(config)
+    json_provider.init_json(app)
+
+    adb.init_app(app)
+
+    # pylint: disable=import-outside-toplevel
+    from .routes import api
+    from .error_handlers import errors
+
+    app.register_blueprint(api)
+    app.register_blueprint(errors)
+
+    @app.after_serving
+    async def close_database():
+        """Closes the connections of the pool when the server stops"""
+        await adb.engine.dispose()
+
+    app.asgi_app = compression.CompressionMiddleware(app.asgi_app, app.config)
+
+    log_handlers.init_logging(app, "hypercorn.error")
+    app.logger.info("ASGI service initialized!")
+    return app
@@ -0,0 +1,85 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Module: database
+
+The async engine and sessions used by the ASGI service
+
+A request can set g.unit_of_work to a session of its own. Every session and
+transaction of the request then uses it, and what they change is only
+flushed, to be committed by whoever set it
+"""
+from contextlib import asynccontextmanager
+from quart import g, has_app_context
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm.exc import StaleDataError
+from service.models import DataValidationError, StaleVersionError
+
+
+class AsyncDatabase:
+    """Holds the async engine of an app and makes sessions on it"""
+
+    def __init__(self):
+        self.engine = None
+        self.sessions = None
+
+    def init_app(self, app):
+        """Creates the async engine from the configuration of an app"""
+        self.engine = create_async_engine(
+            app.config["SQLALCHEMY_DATABASE_URI"],
+            **app.config["SQLALCHEMY_ENGINE_OPTIONS"],
+        )
+        # objects stay readable after the commit, reloading them would block
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+
+    @staticmethod
+    def unit_of_work():
+        """Returns the session of the unit of work of the request, or None"""
+        return g.get("unit_of_work") if has_app_context() else None
+
+    @asynccontextmanager
+    async def session(self):
+        """Opens a session, or joins the unit of work of the request"""
+        unit = self.unit_of_work()
+        if unit is not None:
+            yield unit
+            return
+        async with self.sessions() as session:
+            yield session
+
+    @asynccontextmanager
+    async def transaction(self):
+        """
+        Opens a session whose changes are committed when the block ends, or
+        rolled back if it raises, with the same errors as the sync models.
+        In a unit of work the changes are only flushed
+        """
+        unit = self.unit_of_work()
+        try:
+            if unit is not None:
+                yield unit
+                await unit.flush()
+                return
+            async with self.sessions() as session, session.begin():
+                yield session
+        except StaleDataError as error:
+            raise StaleVersionError(error) from error
+        except DBAPIError as error:
+            raise DataValidationError(error) from error
+
+
+adb = AsyncDatabase()
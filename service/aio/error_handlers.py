@@ -0,0 +1,65 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Module: error_handlers
+
+Returns errors from the ASGI service in the same JSON as the Flask app
+"""
+from quart import Blueprint, current_app, jsonify
+from werkzeug.exceptions import HTTPException
+from service.common import status
+from service.models import DataValidationError, StaleVersionError
+
+errors = Blueprint("errors", __name__)
+
+# the error names used by service.common.error_handlers
+ERROR_NAMES = {
+    status.HTTP_400_BAD_REQUEST: "Bad Request",
+    status.HTTP_404_NOT_FOUND: "Not Found",
+    status.HTTP_405_METHOD_NOT_ALLOWED: "Method not Allowed",
+    status.HTTP_409_CONFLICT: "Conflict",
+    status.HTTP_412_PRECONDITION_FAILED: "Precondition Failed",
+    status.HTTP_415_UNSUPPORTED_MEDIA_TYPE: "Unsupported media type",
+    status.HTTP_422_UNPROCESSABLE_ENTITY: "Unprocessable Entity",
+    status.HTTP_500_INTERNAL_SERVER_ERROR: "Internal Server Error",
+}
+
+
+def error_response(code, message):
+    """Logs an error and returns it as JSON"""
+    if code >= status.HTTP_500_INTERNAL_SERVER_ERROR:
+        current_app.logger.error(message)
+    else:
+        current_app.logger.warning(message)
+    return jsonify(status=code, error=ERROR_NAMES.get(code, "Error"), message=message), code
+
+
+@errors.app_errorhandler(DataValidationError)
+async def request_validation_error(error):
+    """Handles Value Errors from bad data"""
+    return error_response(status.HTTP_400_BAD_REQUEST, str(error))
+
+
+@errors.app_errorhandler(StaleVersionError)
+async def request_stale_version_error(error):
+    """Handles writes to a record that was changed since it was read"""
+    return error_response(status.HTTP_412_PRECONDITION_FAILED, str(error))
+
+
+@errors.app_errorhandler(HTTPException)
+async def http_error(error):
+    """Handles every HTTP error raised by abort() or the router"""
+    return error_response(error.code, str(error))
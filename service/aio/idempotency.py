@@ -0,0 +1,97 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Module: idempotency
+
+Idempotency-Key support for the async routes, with the same table and rules
+as service.common.idempotency. The claim is committed in a transaction of
+its own. The route then runs in a unit of work, and what it changed is
+committed in one transaction with its stored response.
+"""
+from functools import wraps
+from quart import current_app as app, g, request
+from service.common.idempotency import HEADER, check_key, fingerprint, replay, stored, succeeded
+from service.models import IdempotencyKey
+from .database import adb
+
+
+async def release(claim_id):
+    """Gives up a claim"""
+    async with adb.transaction() as session:
+        await session.execute(IdempotencyKey.release_statement(claim_id))
+
+
+async def respond(claim_id, function, *args, **kwargs):
+    """Runs a route and stores a successful response in the transaction of its changes"""
+    async with adb.sessions() as session:
+        g.unit_of_work = session
+        try:
+            response = await app.make_response(await function(*args, **kwargs))
+            if succeeded(response):
+                store = IdempotencyKey.store_statement(
+                    claim_id, stored(response, await response.get_data()), app.config["IDEMPOTENCY_TTL"]
+                )
+                await session.execute(store)
+                await session.commit()
+        finally:
+            g.pop("unit_of_work", None)
+    return response
+
+
+def idempotent(owner):
+    """
+    Makes an async route answer the retries of a request that has an
+    Idempotency-Key with the response to the first one
+
+    Args:
+        owner (coroutine function): returns the user the request acts for
+            from the arguments of the route, or None to run the route as it is
+    """
+
+    def decorator(function):
+        @wraps(function)
+        async def wrapper(*args, **kwargs):
+            key = request.headers.get(HEADER)
+            if key is None:
+                return await function(*args, **kwargs)
+            check_key(key)
+            user_id = await owner(**kwargs)
+            if not user_id:
+                return await function(*args, **kwargs)
+            user_id = str(user_id)
+
+            request_fingerprint = fingerprint(request.method, request.full_path, await request.get_data())
+            claim = IdempotencyKey.claim_statement(key, user_id, request_fingerprint, app.config["IDEMPOTENCY_LEASE"])
+            async with adb.transaction() as session:
+                claim_id = await session.scalar(claim)
+            if claim_id is None:
+                app.logger.info("Replaying the response for %s %r", HEADER, key)
+                async with adb.session() as session:
+                    claim = await session.scalar(IdempotencyKey.find_statement(key, user_id))
+                return replay(claim, request_fingerprint, app.response_class)
+
+            try:
+                response = await respond(claim_id, function, *args, **kwargs)
+            except Exception:
+                await release(claim_id)
+                raise
+            if not succeeded(response):
+                await release(claim_id)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,574 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Shopcart Store Service, async handlers
+
+The same REST API as service.routes, served by Quart. Every handler awaits
+the database, so a worker serves other requests while it waits. Each request
+that writes runs in one transaction that is committed when it succeeds.
+"""
+# pylint: disable=duplicate-code
+import os
+from functools import partial
+from quart import Blueprint, abort, current_app as app, jsonify, request, send_from_directory, url_for
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from service.common import assets, fieldsets, status
+from service.common.cursors import encode_cursor, decode_cursor
+from service.common.json_provider import COMPACT
+from service.models import Shopcart, Item
+from service.models.shopcart import FIELDS
+from .database import adb
+from .idempotency import idempotent
+
+api = Blueprint("api", __name__)
+
+
+######################################################################
+# GET INDEX
+######################################################################
+@api.route("/")
+async def index():
+    """Root URL response"""
+    app.logger.info("Request for the index page to be returned.")
+    if not os.path.isfile(os.path.join(app.config["ASSETS_FOLDER"], assets.INDEX)):
+        return await app.send_static_file("index.html")
+    return await send_asset(assets.INDEX, immutable=False)
+
+
+@api.route("/assets/<path:file_name>")
+async def get_asset(file_name):
+    """Returns a built static file, compressed ahead of time when the client accepts it"""
+    return await send_asset(file_name)
+
+
+async def send_asset(file_name, immutable=True):
+    """Sends the copy of a built file in the encoding the client prefers"""
+    folder = app.config["ASSETS_FOLDER"]
+    name, encoding = assets.locate(folder, file_name, request.headers.get("Accept-Encoding"))
+    response = await send_from_directory(folder, name, mimetype=assets.mimetype(file_name))
+    return assets.tag(response, encoding, immutable)
+
+
+######################################################################
+# HEALTH ENDPOINT FOR K3 CLUSTER
+######################################################################
+@api.route("/health")
+async def health():
+    """Health endpoint"""
+    return jsonify(message=status.HTTP_200_OK), status.HTTP_200_OK
+
+
+######################################################################
+# THE USERS THAT OWN THE IDEMPOTENCY KEYS
+######################################################################
+async def shopcart_owner():
+    """Returns the user of the Shopcart being created, who owns its Idempotency-Key"""
+    data = await request.get_json(silent=True)
+    return data.get("user_id") if isinstance(data, dict) else None
+
+
+async def item_owner(shopcart_id):
+    """Returns the user of a Shopcart, who owns the Idempotency-Keys of the Items added to it"""
+    async with adb.session() as session:
+        return await session.scalar(select(Shopcart.user_id).where(Shopcart.id == shopcart_id))
+
+
+######################################################################
+#  R E S T   A P I   E N D P O I N T S
+######################################################################
+
+
+######################################################################
+# CREATE A NEW SHOPCART
+######################################################################
+@api.route("/shopcarts", methods=["POST"])
+@idempotent(shopcart_owner)
+async def create_shopcarts():
+    """Creates a Shopcart"""
+    app.logger.info("Request to create a shopcart")
+    check_content_type("application/json")
+
+    shopcart = Shopcart().deserialize(await request.get_json())
+    async with adb.transaction() as session:
+        session.add(shopcart)
+    async with adb.session() as session:
+        shopcart = await find_shopcart(session, shopcart.id)
+    location_url = url_for("api.get_shopcarts", shopcart_id=shopcart.id, _external=True)
+
+    app.logger.info("Shopcart with ID: %d created.", shopcart.id)
+    return (
+        jsonify(shopcart.serialize()),
+        status.HTTP_201_CREATED,
+        {"Location": location_url},
+    )
+
+
+######################################################################
+# READ A SHOPCART
+######################################################################
+@api.route("/shopcarts/<int:shopcart_id>", methods=["GET"])
+async def get_shopcarts(shopcart_id):
+    """Retrieve a single Shopcart"""
+    app.logger.info("Request for shopcart with id: %s", shopcart_id)
+    fields = requested_fields()
+
+    async with adb.session() as session:
+        # answer a client that already has this version without loading the items
+        response = await not_modified(session, Shopcart, shopcart_id, fields)
+        if response:
+            return response
+        # the items are only loaded when they are asked for
+        shopcart = await session.get(
+            Shopcart, shopcart_id, options=Shopcart.load_options(fields)
+        )
+    if not shopcart:
+        error(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{shopcart_id}' was not found.")
+
+    response = with_etag(jsonify(shopcart.serialize(fields)), shopcart.version, fields)
+    return response, status.HTTP_200_OK
+
+
+######################################################################
+# DELETE A Shopcart
+######################################################################
+@api.route("/shopcarts/<int:shopcart_id>", methods=["DELETE"])
+async def delete_shopcarts(shopcart_id):
+    """Delete a Shopcart"""
+    app.logger.info("Request to delete shopcart with id: %d", shopcart_id)
+
+    async with adb.transaction() as session:
+        shopcart = await session.get(Shopcart, shopcart_id)
+        check_if_match(shopcart.version if shopcart else None)
+        if shopcart:
+            await session.delete(shopcart)
+
+    app.logger.info("Shopcart with ID: %d delete complete.", shopcart_id)
+    return "", status.HTTP_204_NO_CONTENT
+
+
+######################################################################
+# DELETE AN ITEM
+######################################################################
+@api.route("/shopcarts/<int:shopcart_id>/items/<int:item_id>", methods=["DELETE"])
+async def delete_items(shopcart_id, item_id):
+    """Delete an Item"""
+    app.logger.info("Request to delete Item %s for Shopcart id: %s", item_id, shopcart_id)
+
+    async with adb.transaction() as session:
+        item = await session.get(Item, item_id)
+        check_if_match(item.version if item else None)
+        if item:
+            await session.delete(item)
+    return "", status.HTTP_204_NO_CONTENT
+
+
+######################################################################
+# LIST ALL SHOPCARTS
+######################################################################
+@api.route("/shopcarts", methods=["GET"])
+async def list_shopcarts():
+    """Returns all Shopcarts"""
+    app.logger.info("Request for shopcart list")
+
+    user_id = request.args.get("user_id")
+    fields = requested_fields()
+    if "limit" in request.args or "after" in request.args:
+        return await list_shopcarts_page(user_id, fields)
+    if is_streaming():
+        return stream_json(
+            Shopcart.rows_statement(user_id, fields=fields),
+            partial(Shopcart.serialize_rows, fields=fields),
+        )
+
+    # the Shopcarts are built from plain rows and never enter the session
+    async with adb.session() as session:
+        rows = await session.execute(Shopcart.rows_statement(user_id, fields=fields))
+        results = list(Shopcart.serialize_rows(rows, fields))
+    app.logger.info("Returning %d shopcarts", len(results))
+    return jsonify(results), status.HTTP_200_OK
+
+
+async def list_shopcarts_page(user_id, fields):
+    """Returns one page of Shopcarts and a Link header to the next one"""
+    limit = get_page_size()
+    after = get_cursor()
+
+    # Fetch one extra Shopcart so we know if there is another page without a COUNT
+    statement = Shopcart.rows_statement(user_id, after=after, limit=limit + 1, fields=fields)
+    async with adb.session() as session:
+        shopcarts = list(Shopcart.serialize_rows(await session.execute(statement), fields))
+    results = shopcarts[:limit]
+
+    headers = {}
+    if len(shopcarts) > limit:
+        next_url = url_for(
+            "api.list_shopcarts",
+            user_id=user_id,
+            limit=limit,
+            after=encode_cursor(shopcarts[limit - 1]["id"]),
+            include=request.args.get("include"),
+            fields=request.args.get("fields"),
+            _external=True,
+        )
+        headers["Link"] = f'<{next_url}>; rel="next"'
+
+    app.logger.info("Returning page of %d shopcarts", len(results))
+    return jsonify(results), status.HTTP_200_OK, headers
+
+
+######################################################################
+# UPDATE AN EXISTING SHOPCART
+######################################################################
+@api.route("/shopcarts/<int:shopcart_id>", methods=["PUT"])
+async def update_shopcarts(shopcart_id):
+    """Update a Shopcart"""
+    app.logger.info("Request to update shopcart with id: %d", shopcart_id)
+    check_content_type("application/json")
+    data = await request.get_json()
+
+    async with adb.transaction() as session:
+        shopcart = await session.get(
+            Shopcart, shopcart_id, options=[selectinload(Shopcart.items)]
+        )
+        if not shopcart:
+            error(status.HTTP_404_NOT_FOUND, f"Shopcart with id: '{shopcart_id}' was not found.")
+        check_if_match(shopcart.version)
+        shopcart.deserialize(data)
+    async with adb.session() as session:
+        shopcart = await find_shopcart(session, shopcart_id)
+
+    app.logger.info("Shopcart with ID: %d updated.", shopcart.id)
+    response = with_etag(jsonify(shopcart.serialize()), shopcart.version)
+    return response, status.HTTP_200_OK
+
+
+######################################################################
+# ADD AN ITEM TO A SHOPCART
+######################################################################
+@api.route("/shopcarts/<int:shopcart_id>/items", methods=["POST"])
+@idempotent(item_owner)
+async def create_item(shopcart_id):
+    """Create one Item, or a list of Items with one INSERT, in a Shopcart"""
+    app.logger.info("Request to create an Item for Shopcart with id: %s", shopcart_id)
+    check_content_type("application/json")
+    data = await request.get_json()
+
+    batch = isinstance(data, list)
+    if batch and not 0 < len(data) <= app.config["MAX_BATCH_SIZE"]:
+        error(
+            status.HTTP_400_BAD_REQUEST,
+            f"A batch must hold between 1 and {app.config['MAX_BATCH_SIZE']} items",
+        )
+    items = [Item().deserialize(row) for row in data] if batch else [Item().deserialize(data)]
+
+    async with adb.transaction() as session:
+        if not await session.get(Shopcart, shopcart_id):
+            error(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{shopcart_id}' was not found.")
+        insert, rows, totals = Shopcart.insert_items(shopcart_id, items)
+        items = (await session.scalars(insert, rows)).all()
+        await session.execute(totals)
+
+    app.logger.info("Added %d items to Shopcart with id: %s", len(items), shopcart_id)
+    if batch:
+        return jsonify([item.serialize() for item in items]), status.HTTP_201_CREATED
+    return jsonify(items[0].serialize()), status.HTTP_201_CREATED
+
+
+######################################################################
+# RETRIEVE AN ITEM FROM A SHOPCART
+######################################################################
+@api.route("/shopcarts/<int:shopcart_id>/items/<int:item_id>", methods=["GET"])
+async def get_item(shopcart_id, item_id):
+    """Get an Item"""
+    app.logger.info("Request to retrieve Item with id: %d for Shopcart id: %d", item_id, shopcart_id)
+
+    async with adb.session() as session:
+        response = await not_modified(session, Item, item_id)
+        if response:
+            return response
+        item = await session.get(Item, item_id)
+    if not item:
+        error(status.HTTP_404_NOT_FOUND, f"Item with id '{item_id}' was not found.")
+
+    return with_etag(jsonify(item.serialize()), item.version), status.HTTP_200_OK
+
+
+######################################################################
+# UPDATE AN EXISTING ITEM IN THE SHOPCART
+######################################################################
+@api.route("/shopcarts/<int:shopcart_id>/items/<int:item_id>", methods=["PUT"])
+async def update_shopcarts_item(shopcart_id, item_id):
+    """Update an item in a Shopcart"""
+    app.logger.info("Request to update item with id %d in a shopcart with id: %d", item_id, shopcart_id)
+    check_content_type("application/json")
+    data = await request.get_json()
+
+    async with adb.transaction() as session:
+        if not await session.get(Shopcart, shopcart_id):
+            error(status.HTTP_404_NOT_FOUND, f"Shopcart with id: '{shopcart_id}' was not found.")
+        item = await session.get(Item, item_id)
+        if not item:
+            error(
+                status.HTTP_404_NOT_FOUND,
+                f"Item with id: '{item_id}' was not found in shopcart with id: '{shopcart_id}'",
+            )
+        check_if_match(item.version)
+        item.deserialize(data)
+    async with adb.session() as session:
+        item = await session.get(Item, item_id)
+
+    app.logger.info("Item with id %d in shopcart with id %d updated.", item_id, shopcart_id)
+    return with_etag(jsonify(item.serialize()), item.version), status.HTTP_200_OK
+
+
+######################################################################
+# LIST ITEMS IN A SHOPCART
+######################################################################
+@api.route("/shopcarts/<int:shopcart_id>/items", methods=["GET"])
+async def list_items(shopcart_id):
+    """Returns all of the Items (and filters them if necessary) for a Shopcart"""
+    app.logger.info("Request for all Items for Shopcart with id: %s", shopcart_id)
+
+    # the same filters as the finders of the Item model
+    product_id = request.args.get("product_id")
+    quantity = request.args.get("quantity")
+    query = select(*Item.row_columns())
+    if product_id:
+        query = query.where(Item.product_id == int(product_id))
+    if quantity:
+        query = query.where(Item.quantity == int(quantity))
+    if not product_id and not quantity:
+        query = query.where(Item.cart_id == shopcart_id)
+
+    async with adb.session() as session:
+        if not await session.get(Shopcart, shopcart_id):
+            error(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{shopcart_id}' was not found.")
+        if is_streaming():
+            return stream_json(query.order_by(Item.id), Item.serialize_rows)
+        results = list(Item.serialize_rows(await session.execute(query)))
+
+    return jsonify(results), status.HTTP_200_OK
+
+
+######################################################################
+# CLEAR ALL ITEMS IN A SHOPCART
+######################################################################
+@api.route("/shopcarts/<int:shopcart_id>/clear", methods=["DELETE"])
+async def clear_shopcart(shopcart_id):
+    """Clear all Items in a Shopcart with one DELETE"""
+    app.logger.info("Request to clear all Items in Shopcart id: %s", shopcart_id)
+
+    reset, remove = Shopcart.clear_statements(shopcart_id, if_match_versions())
+    async with adb.transaction() as session:
+        if not (await session.execute(reset)).first():
+            # a Shopcart that exists was not at the version of If-Match
+            check_if_match(await session.scalar(select(Shopcart.version).where(Shopcart.id == shopcart_id)))
+            error(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{shopcart_id}' was not found.")
+        await session.execute(remove)
+
+    app.logger.info("Shopcart with ID: %d cleared.", shopcart_id)
+    return "", status.HTTP_204_NO_CONTENT
+
+
+######################################################################
+# CHANGE THE QUANTITY OF AN ITEM IN A SHOPCART
+######################################################################
+@api.route("/shopcarts/<int:shopcart_id>/items/<int:item_id>/increment", methods=["PUT"])
+async def increment_item_quantity(shopcart_id, item_id):
+    """Increment the quantity of an item by one, or by ?step="""
+    app.logger.info("Request to increment the quantity of item with id %d", item_id)
+    return await adjust_item_quantity(shopcart_id, item_id, get_step())
+
+
+@api.route("/shopcarts/<int:shopcart_id>/items/<int:item_id>/decrement", methods=["PUT"])
+async def decrement_item_quantity(shopcart_id, item_id):
+    """Decrement the quantity of an item by one, or by ?step=, but not below zero"""
+    app.logger.info("Request to decrement the quantity of item with id %d", item_id)
+    return await adjust_item_quantity(shopcart_id, item_id, -get_step())
+
+
+async def adjust_item_quantity(shopcart_id, item_id, step):
+    """Changes the quantity of an item with a single UPDATE and returns it"""
+    async with adb.transaction() as session:
+        statement = Shopcart.quantity_statement(shopcart_id, item_id, step, if_match_versions())
+        item = (await session.execute(statement)).scalar_one_or_none()
+        if not item:
+            # only the failure path pays for a second query to find out why
+            item = await session.get(Item, item_id)
+            found = item is not None and item.cart_id == shopcart_id
+            check_if_match(item.version if found else None)
+            if not found:
+                error(
+                    status.HTTP_404_NOT_FOUND,
+                    f"Item with id: '{item_id}' was not found in shopcart with id: '{shopcart_id}'",
+                )
+            error(
+                status.HTTP_409_CONFLICT,
+                f"Quantity of item with id: '{item_id}' cannot go below zero",
+            )
+
+    app.logger.info("Item with id %d in shopcart with id %d updated.", item_id, shopcart_id)
+    return jsonify(item.serialize()), status.HTTP_200_OK
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+
+
+async def find_shopcart(session, shopcart_id):
+    """Loads a Shopcart as it is stored now, with all of its Items"""
+    return await session.get(
+        Shopcart,
+        shopcart_id,
+        options=[selectinload(Shopcart.items)],
+        populate_existing=True,
+    )
+
+
+def check_content_type(content_type):
+    """Checks that the media type is correct"""
+    if request.headers.get("Content-Type") != content_type:
+        error(
+            status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            f"Content-Type must be {content_type}",
+        )
+
+
+def get_page_size():
+    """Returns the ?limit= query parameter bounded by the configured maximum"""
+    limit = request.args.get("limit", app.config["DEFAULT_PAGE_SIZE"])
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= app.config["MAX_PAGE_SIZE"]:
+        error(
+            status.HTTP_400_BAD_REQUEST,
+            f"limit must be an integer between 1 and {app.config['MAX_PAGE_SIZE']}",
+        )
+    return limit
+
+
+def requested_fields():
+    """Returns the keys of a Shopcart selected by ?include= and ?fields="""
+    return fieldsets.requested_fields(request.args.get("include"), request.args.get("fields"))
+
+
+def get_cursor():
+    """Returns the id decoded from the ?after= query parameter, if there is one"""
+    if "after" not in request.args:
+        return None
+    after = decode_cursor(request.args["after"])
+    if after is None:
+        error(status.HTTP_400_BAD_REQUEST, f"Invalid cursor '{request.args['after']}'")
+    return after
+
+
+def get_step():
+    """Returns the ?step= query parameter as a positive integer"""
+    step = request.args.get("step", "1")
+    try:
+        step = int(step)
+    except ValueError:
+        step = 0
+    if step < 1:
+        error(status.HTTP_400_BAD_REQUEST, "step must be a positive integer")
+    return step
+
+
+def is_streaming():
+    """Returns True if the client asked for a streamed response with ?stream=true"""
+    return request.args.get("stream", "").lower() in ("true", "1", "yes")
+
+
+def stream_json(statement, serialize):
+    """
+    Streams the results of a statement as a JSON array from a server side
+    cursor, STREAM_BATCH_SIZE rows at a time turned into dictionaries by serialize
+    """
+    batch_size = app.config["STREAM_BATCH_SIZE"]
+    # the same compact JSON that jsonify writes, so the bytes match too
+    dumps = partial(app.json.dumps, separators=COMPACT)
+
+    async def generate():
+        async with adb.session() as session:
+            result = await session.stream(statement.execution_options(yield_per=batch_size))
+            yield "["
+            count = 0
+            last = {}
+            async for rows in result.partitions():
+                for element in serialize(rows):
+                    # a Shopcart whose Items run over into the next batch comes
+                    # out of it again with the rest of them
+                    if last.get("id") == element["id"]:
+                        last["items"].extend(element["items"])
+                        continue
+                    if last:
+                        yield ("," if count else "") + dumps(last)
+                        count += 1
+                    last = element
+            if last:
+                yield ("," if count else "") + dumps(last)
+            yield "]\n"
+
+    return app.response_class(generate(), mimetype="application/json")
+
+
+async def not_modified(session, model, by_id, fields=FIELDS):
+    """
+    Returns a 304 Not Modified response if the If-None-Match header holds the
+    ETag of the current version of a record in the representation of the
+    given fields, or None if the record must be sent in full
+    """
+    if not request.if_none_match:
+        return None
+    version = await session.scalar(select(model.version).where(model.id == by_id))
+    if version is None or not request.if_none_match.contains_weak(fieldsets.etag(version, fields)):
+        return None
+    response = app.response_class("", status=status.HTTP_304_NOT_MODIFIED)
+    return with_etag(response, version, fields)
+
+
+def check_if_match(version):
+    """Aborts with 412 Precondition Failed if If-Match does not hold the current version"""
+    if not request.if_match:
+        return
+    if version is None or not fieldsets.version_matches(request.if_match, version):
+        error(
+            status.HTTP_412_PRECONDITION_FAILED,
+            f"The resource is no longer at version {request.if_match.to_header()}",
+        )
+
+
+def if_match_versions():
+    """Returns the versions the If-Match header accepts, or None for any"""
+    return fieldsets.matched_versions(request.if_match)
+
+
+def with_etag(response, version, fields=FIELDS):
+    """Tags a response with the version of its record and asks clients to revalidate it"""
+    response.set_etag(fieldsets.etag(version, fields))
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def error(status_code, reason):
+    """Logs the error and then aborts"""
+    app.logger.error(reason)
+    abort(status_code, reason)
@@ -0,0 +1,170 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Module: assets
+
+Builds the static files into ASSETS_FOLDER ahead of time, and helps the
+routes serve them from there.
+
+Every file is copied under a name that holds a digest of its content, such
+as js/rest_api.3f2a9c1b.js. A new version of a file gets a new name, so the
+files can be cached for a year and never revalidated. The references in
+index.html are rewritten to those names. index.html itself keeps its name
+and is revalidated on every request.
+
+Each file also gets a .gz and a .br copy, compressed at the highest level,
+when that is smaller. The routes send the copy the client accepts, so the
+static files are never compressed again on a request.
+
+Build them with:
+    python -m service.common.assets
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+from werkzeug.security import safe_join
+from service import config
+from service.common import compression
+
+# the file extension of each encoding
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+# a year, the longest max-age that caches are asked to keep
+MAX_AGE = 365 * 24 * 60 * 60
+MANIFEST = "manifest.json"
+INDEX = "index.html"
+# the references to the static files in index.html
+STATIC_REFERENCE = re.compile(r"""(["'])static/([^"']+)\1""")
+
+
+def hashed_name(path, data):
+    """Returns the name of a file with a digest of its content before the extension"""
+    root, extension = os.path.splitext(path)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:8]}{extension}"
+
+
+def write(output, name, data):
+    """Writes a file and its compressed copies that are smaller than it"""
+    path = os.path.join(output, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(data)
+    if not compression.compressible(mimetypes.guess_type(name)[0]):
+        return
+    copies = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if compression.brotli is not None:
+        copies["br"] = compression.brotli.compress(data, quality=11)
+    for encoding, compressed in copies.items():
+        if len(compressed) < len(data):
+            with open(path + SUFFIXES[encoding], "wb") as file:
+                file.write(compressed)
+
+
+def build(static_folder, output):
+    """
+    Builds the files of static_folder into output
+
+    Returns the manifest, which maps the path of every file to its hashed path
+    """
+    shutil.rmtree(output, ignore_errors=True)
+    manifest = {}
+    for folder, _, files in os.walk(static_folder):
+        for file_name in sorted(files):
+            path = os.path.relpath(os.path.join(folder, file_name), static_folder).replace(os.sep, "/")
+            if path == INDEX:
+                continue
+            with open(os.path.join(folder, file_name), "rb") as file:
+                data = file.read()
+            manifest[path] = hashed_name(path, data)
+            write(output, manifest[path], data)
+
+    index = os.path.join(static_folder, INDEX)
+    if os.path.exists(index):
+        with open(index, encoding="utf-8") as file:
+            html = file.read()
+
+        def reference(match):
+            quote, path = match.groups()
+            if path not in manifest:
+                return match.group()
+            return f"{quote}assets/{manifest[path]}{quote}"
+
+        write(output, INDEX, STATIC_REFERENCE.sub(reference, html).encode("utf-8"))
+
+    with open(os.path.join(output, MANIFEST), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    return manifest
+
+
+######################################################################
+# Serving
+######################################################################
+def locate(folder, file_name, accept_encoding):
+    """
+    Returns the name of the copy of a built file to send, and its encoding,
+    which is None for the file as it is
+    """
+    path = safe_join(folder, file_name)
+    encodings = [
+        encoding for encoding, suffix in SUFFIXES.items()
+        if path is not None and os.path.isfile(path + suffix)
+    ]
+    encoding = compression.negotiate(accept_encoding, encodings)
+    if encoding is None:
+        return file_name, None
+    return file_name + SUFFIXES[encoding], encoding
+
+
+def mimetype(file_name):
+    """Returns the type of a file from its name"""
+    return mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+
+
+def tag(response, encoding, immutable=True):
+    """Sets the headers of a response that sends a built file"""
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    # the name of the compressed copy is no business of the client
+    response.headers.pop("Content-Disposition", None)
+    response.headers.pop("Expires", None)
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    if immutable:
+        response.cache_control.pop("no-cache", None)
+        response.cache_control.max_age = MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.max_age = None
+        response.cache_control.no_cache = True
+    return response
+
+
+def main():
+    """Builds the static files from the command line"""
+    parser = argparse.ArgumentParser(description="Builds the static files with hashed names")
+    parser.add_argument("--static", default=os.path.join(os.path.dirname(config.__file__), "static"))
+    parser.add_argument("--output", default=config.ASSETS_FOLDER)
+    args = parser.parse_args()
+    manifest = build(args.static, args.output)
+    print(f"Built {len(manifest)} files into {args.output}")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
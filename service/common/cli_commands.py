@@ -16,8 +16,11 @@
 """
 Flask CLI Command Extensions
 """
+import click
 from flask import current_app as app  # Import Flask application
+from service.models import IdempotencyKey, Shopcart
 from service.models.persistent_base import db
+from service.common import migrations
 
 
 ######################################################################
@@ -32,5 +35,66 @@ def db_create():
     production. ;-)
     """
     db.drop_all()
-    db.create_all()
-    db.session.commit()
+    migrations.migrate(db.engine)
+
+
+######################################################################
+# Command to bring the schema up to date
+# Usage:
+#   flask db-migrate
+######################################################################
+@app.cli.command("db-migrate")
+def db_migrate():
+    """
+    Runs the migrations that the database schema is missing. Run it
+    before starting the workers of a release that needs a newer schema.
+    """
+    versions = migrations.migrate(db.engine)
+    if versions:
+        click.echo(f"Migrated the schema to version {versions[-1]}")
+    else:
+        click.echo(f"The schema is up to date at version {migrations.probe(db.engine)}")
+
+
+######################################################################
+# Command to check the stored shopcart totals for drift
+# Usage:
+#   flask db-totals [--fix]
+######################################################################
+@app.cli.command("db-totals")
+@click.option("--fix", is_flag=True, help="Rewrite the totals that have drifted.")
+def db_totals(fix):
+    """
+    Re-derives the stored Shopcart totals from their Items and reports
+    any Shopcart that has drifted. Exits with 1 on drift unless --fix is
+    given, in which case the drifted totals are rewritten.
+    """
+    drift = Shopcart.find_total_drift()
+    for row in drift:
+        click.echo(
+            f"Shopcart {row.id}: total_price {row.total_price} != {row.derived_total}, "
+            f"item_count {row.item_count} != {row.derived_count}"
+        )
+    if fix:
+        count = Shopcart.recalculate_totals()
+        click.echo(f"Corrected the totals of {count} shopcarts")
+    elif drift:
+        raise click.exceptions.Exit(1)
+    else:
+        click.echo("All shopcart totals are correct")
+
+
+######################################################################
+# Command to delete the Idempotency-Keys that have expired
+# Usage:
+#   flask idempotency-purge
+######################################################################
+@app.cli.command("idempotency-purge")
+def idempotency_purge():
+    """
+    Deletes the Idempotency-Keys whose stored responses or claims have
+    expired. Expired keys are reclaimed when they are used again, so this
+    only keeps the table small.
+    """
+    count = IdempotencyKey.purge()
+    click.echo(f"Deleted {count} expired idempotency keys")
@@ -0,0 +1,202 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Module: compression
+
+Compresses the responses with the best encoding in COMPRESS_ENCODINGS that
+the client accepts, brotli ("br") or gzip. Bodies under COMPRESS_MIN_SIZE
+bytes are sent as they are, because compressing them saves less than it
+costs. Streamed responses go through an incremental encoder, so they stay
+streamed and their memory stays bounded.
+
+A compressed body is a different representation, so its ETag is made weak,
+the way nginx does it. If-None-Match is compared weakly, so the tag keeps
+working for conditional reads.
+
+The Flask app compresses in an after_request hook. The ASGI app wraps its
+asgi_app in CompressionMiddleware.
+"""
+import zlib
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# the types of the bodies worth compressing
+COMPRESSIBLE = ("text/", "application/json", "application/javascript", "image/svg+xml")
+# statuses that have no body, or a body that must not be changed
+UNTOUCHED = (204, 206, 304)
+
+
+def supported(encodings):
+    """Returns the encodings of a comma separated list that can be used here"""
+    names = [name.strip() for name in encodings.split(",") if name.strip()]
+    return [name for name in names if name == "gzip" or (name == "br" and brotli is not None)]
+
+
+def negotiate(accept_encoding, encodings):
+    """Returns the encoding the client prefers out of the given ones, or None"""
+    if not accept_encoding or not encodings:
+        return None
+    return parse_accept_header(accept_encoding).best_match(encodings)
+
+
+def compressible(content_type):
+    """Returns True for the content types that are worth compressing"""
+    return bool(content_type) and content_type.startswith(COMPRESSIBLE)
+
+
+class Encoder:
+    """Compresses a body in one go, or a piece at a time"""
+
+    def __init__(self, encoding, config):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=config["COMPRESS_BROTLI_QUALITY"])
+            self.compress = self.compressor.process
+        else:
+            # wbits=31 writes the gzip header and trailer
+            self.compressor = zlib.compressobj(config["COMPRESS_GZIP_LEVEL"], zlib.DEFLATED, 31)
+            self.compress = self.compressor.compress
+
+    def finish(self):
+        """Returns the rest of the compressed body"""
+        if self.encoding == "br":
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+    def encode(self, data):
+        """Returns the whole body compressed"""
+        return self.compress(data) + self.finish()
+
+    def stream(self, chunks):
+        """Yields the compressed pieces of a body given as pieces"""
+        for chunk in chunks:
+            data = self.compress(chunk)
+            if data:
+                yield data
+        yield self.finish()
+
+
+def weaken(etag):
+    """Returns the weak form of an ETag"""
+    return etag if etag.startswith("W/") else f"W/{etag}"
+
+
+######################################################################
+# Flask
+######################################################################
+def init_compression(app):
+    """Compresses the responses of a Flask app"""
+    encodings = supported(app.config["COMPRESS_ENCODINGS"])
+    if not encodings:
+        return
+    # pylint: disable=import-outside-toplevel
+    from flask import request
+
+    @app.after_request
+    def compress_response(response):
+        """Compresses a response with the encoding the client prefers"""
+        if (
+            response.direct_passthrough
+            or response.status_code in UNTOUCHED
+            or "Content-Encoding" in response.headers
+            or not compressible(response.mimetype)
+        ):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = negotiate(request.headers.get("Accept-Encoding"), encodings)
+        if not encoding:
+            return response
+        encoder = Encoder(encoding, app.config)
+        if response.is_streamed:
+            response.response = encoder.stream(response.iter_encoded())
+            response.headers.pop("Content-Length", None)
+        elif response.content_length >= app.config["COMPRESS_MIN_SIZE"]:
+            response.set_data(encoder.encode(response.get_data()))
+        else:
+            return response
+        response.headers["Content-Encoding"] = encoding
+        if "ETag" in response.headers:
+            response.headers["ETag"] = weaken(response.headers["ETag"])
+        return response
+
+
+######################################################################
+# ASGI
+######################################################################
+class CompressionMiddleware:  # pylint: disable=too-few-public-methods
+    """ASGI middleware that compresses the responses of an app"""
+
+    def __init__(self, app, config):
+        self.app = app
+        self.config = config
+        self.encodings = supported(config["COMPRESS_ENCODINGS"])
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+        accept = dict(scope["headers"]).get(b"accept-encoding", b"").decode("latin-1")
+        await self.app(scope, receive, CompressingSend(send, negotiate(accept, self.encodings), self.config))
+
+
+class CompressingSend:  # pylint: disable=too-few-public-methods
+    """Compresses the body messages of one response on their way to the server"""
+
+    def __init__(self, send, encoding, config):
+        self.send = send
+        self.encoding = encoding
+        self.config = config
+        self.encoder = None
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            await self.send(self._start(message))
+        elif message["type"] != "http.response.body" or self.encoder is None:
+            await self.send(message)
+        else:
+            more_body = message.get("more_body", False)
+            data = self.encoder.compress(message.get("body", b""))
+            if not more_body:
+                data += self.encoder.finish()
+            if data or not more_body:
+                await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+    def _start(self, message):
+        """Returns the start of the response, compressed if its body is worth it"""
+        headers = [(name.lower(), value) for name, value in message["headers"]]
+        first = dict(reversed(headers))
+        if (
+            message["status"] in UNTOUCHED
+            or b"content-encoding" in first
+            or not compressible(first.get(b"content-type", b"").decode("latin-1"))
+        ):
+            return message
+        headers = [(name, value) for name, value in headers if name != b"vary"]
+        headers.append((b"vary", b", ".join(filter(None, [first.get(b"vary"), b"Accept-Encoding"]))))
+        # a body without a length is streamed, and is compressed whatever its size
+        length = int(first.get(b"content-length", self.config["COMPRESS_MIN_SIZE"]))
+        if self.encoding and length >= self.config["COMPRESS_MIN_SIZE"]:
+            self.encoder = Encoder(self.encoding, self.config)
+            headers = [
+                (name, weaken(value.decode("latin-1")).encode("latin-1") if name == b"etag" else value)
+                for name, value in headers if name != b"content-length"
+            ]
+            headers.append((b"content-encoding", self.encoding.encode("latin-1")))
+        return {**message, "headers": headers}
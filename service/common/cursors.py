@@ -0,0 +1,43 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Module: cursors
+
+Opaque cursors for keyset pagination. A cursor holds the id of the last row
+on a page, encoded so that clients do not build or depend on it.
+"""
+import base64
+
+
+def encode_cursor(last_id):
+    """Encodes the id of the last row on a page into an opaque cursor"""
+    token = base64.urlsafe_b64encode(f"id:{last_id}".encode("utf-8"))
+    return token.decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Decodes an opaque cursor back into the id of the last row on a page
+
+    Returns None if the cursor is not one that encode_cursor made
+    """
+    try:
+        token = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        prefix, last_id = token.decode("utf-8").split(":")
+        if prefix == "id":
+            return int(last_id)
+    except (ValueError, UnicodeDecodeError):
+        pass
+    return None
@@ -18,7 +18,7 @@ Module: error_handlers
 """
 from flask import jsonify
 from flask import current_app as app  # Import Flask application
-from service.models.persistent_base import DataValidationError
+from service.models.persistent_base import DataValidationError, StaleVersionError
 from . import status
 
 
@@ -31,6 +31,12 @@ def request_validation_error(error):
     return bad_request(error)
 
 
+@app.errorhandler(StaleVersionError)
+def request_stale_version_error(error):
+    """Handles writes to a record that was changed since it was read"""
+    return precondition_failed(error)
+
+
 @app.errorhandler(status.HTTP_400_BAD_REQUEST)
 def bad_request(error):
     """Handles bad requests with 400_BAD_REQUEST"""
@@ -70,6 +76,32 @@ def method_not_supported(error):
     )
 
 
+@app.errorhandler(status.HTTP_409_CONFLICT)
+def resource_conflict(error):
+    """Handles resource conflicts with 409_CONFLICT"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(status=status.HTTP_409_CONFLICT, error="Conflict", message=message),
+        status.HTTP_409_CONFLICT,
+    )
+
+
+@app.errorhandler(status.HTTP_412_PRECONDITION_FAILED)
+def precondition_failed(error):
+    """Handles writes to stale versions with 412_PRECONDITION_FAILED"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_412_PRECONDITION_FAILED,
+            error="Precondition Failed",
+            message=message,
+        ),
+        status.HTTP_412_PRECONDITION_FAILED,
+    )
+
+
 @app.errorhandler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 def mediatype_not_supported(error):
     """Handles unsupported media requests with 415_UNSUPPORTED_MEDIA_TYPE"""
@@ -85,6 +117,21 @@ def mediatype_not_supported(error):
     )
 
 
+@app.errorhandler(status.HTTP_422_UNPROCESSABLE_ENTITY)
+def unprocessable_entity(error):
+    """Handles requests that cannot be carried out with 422_UNPROCESSABLE_ENTITY"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            error="Unprocessable Entity",
+            message=message,
+        ),
+        status.HTTP_422_UNPROCESSABLE_ENTITY,
+    )
+
+
 @app.errorhandler(status.HTTP_500_INTERNAL_SERVER_ERROR)
 def internal_server_error(error):
     """Handles unexpected server error with 500_SERVER_ERROR"""
@@ -0,0 +1,88 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Module: fieldsets
+
+Sparse fieldsets for the Shopcart representations. ?include= picks how much
+of a Shopcart is sent:
+- items: every key, with the Items (the default)
+- summary: the stored totals and no Items
+- none: only the Shopcart's own columns
+
+?fields= narrows that down to a comma separated list of keys. The id is
+always sent. The result decides both the columns that are selected and
+whether the Items are read at all.
+
+Every representation but the full one has an ETag of its own. The ETag is
+the version followed by a digest of the keys, so that a cache never answers
+one representation with another. A compressed response carries the weak
+form of the ETag, which matches the version all the same.
+"""
+import zlib
+from service.models.shopcart import FIELDS
+from service.models.persistent_base import DataValidationError
+
+INCLUDE = {
+    "items": FIELDS,
+    "summary": tuple(field for field in FIELDS if field != "items"),
+    "none": ("id", "user_id", "creation_date", "last_updated"),
+}
+
+
+def requested_fields(include=None, fields=None):
+    """
+    Returns the keys of Shopcart.serialize() asked for by ?include= and
+    ?fields=, in the order of FIELDS
+
+    Raises a DataValidationError for an unknown include or field
+    """
+    preset = INCLUDE.get(include or "items")
+    if preset is None:
+        raise DataValidationError(
+            f"Invalid include '{include}', expected one of: {', '.join(INCLUDE)}"
+        )
+    if not fields:
+        return preset
+    wanted = {field.strip() for field in fields.split(",")} - {""}
+    unknown = wanted.difference(FIELDS)
+    if unknown:
+        raise DataValidationError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(field for field in preset if field == "id" or field in wanted)
+
+
+def etag(version, fields=FIELDS):
+    """Returns the ETag of a representation of a record at a version"""
+    if fields == FIELDS:
+        return str(version)
+    return f"{version}-{zlib.crc32(','.join(fields).encode()):08x}"
+
+
+def matched_versions(etags):
+    """
+    Returns the versions that the If-Match ETags are of, for the WHERE of an
+    UPDATE, or None when there is no If-Match or it is *
+    """
+    if not etags or etags.star_tag:
+        return None
+    tags = {tag.split("-", 1)[0] for tag in etags.as_set(include_weak=True)}
+    return sorted(int(tag) for tag in tags if tag.isdigit())
+
+
+def version_matches(etags, version):
+    """Returns True if any of the ETags is of a representation of the given version"""
+    if etags.star_tag:
+        return True
+    return any(tag.split("-", 1)[0] == str(version) for tag in etags.as_set(include_weak=True))
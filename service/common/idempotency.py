@@ -0,0 +1,148 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Module: idempotency
+
+Makes a POST safe to retry. A client sends an Idempotency-Key header with a
+value of its own, such as a UUID, and sends the same key again when it
+retries after a timeout. The first request claims the key for its user with
+an INSERT into the idempotency_key table. Its response is stored there once
+it succeeds, and every retry is answered with that response without running
+the route again.
+
+The claim rests on a unique constraint on (key, user_id). Of two requests
+that arrive together, only one can insert it. The other one is told to wait
+with 409 Conflict, and never takes a lock. Reusing a key for a different
+request is refused with 422 Unprocessable Entity.
+
+A claim expires IDEMPOTENCY_LEASE seconds after it is made if no response
+is stored, so a request that died does not block its key forever. A stored
+response expires after IDEMPOTENCY_TTL seconds. Expired keys can be claimed
+again, and `flask idempotency-purge` deletes them.
+
+A keyed request runs as a unit of work, whatever DB_COMMIT_MODE says. What
+the route changed and the response it stored are committed together, so a
+worker that dies in between leaves neither, and the retry that comes once
+the lease has expired creates nothing twice.
+
+Only successful responses are stored. A request that failed changed nothing,
+so its claim is released and the retry runs the route again. That includes
+a request whose final commit failed.
+"""
+import hashlib
+from functools import wraps
+from flask import abort, g, request
+from flask import current_app as app
+from service.models import DataValidationError, IdempotencyKey, db
+from . import status
+
+HEADER = "Idempotency-Key"
+# tells the client that the response is the stored one
+REPLAYED = "Idempotent-Replayed"
+# the headers of a response that are stored along with its body
+STORED_HEADERS = ("Content-Type", "Location", "ETag")
+MAX_KEY_LENGTH = 255
+
+
+def check_key(key):
+    """Raises a DataValidationError for a key that cannot be stored"""
+    if not 0 < len(key) <= MAX_KEY_LENGTH:
+        raise DataValidationError(f"{HEADER} must be between 1 and {MAX_KEY_LENGTH} characters")
+
+
+def fingerprint(method, path, body):
+    """Returns a digest of a request, to tell whether a key is reused for another one"""
+    digest = hashlib.sha256(f"{method} {path}\n".encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def stored(response, body):
+    """Returns the status, headers and body of a response to store"""
+    headers = {name: response.headers[name] for name in STORED_HEADERS if name in response.headers}
+    return response.status_code, headers, body
+
+
+def succeeded(response):
+    """Returns True for the responses that are stored"""
+    return 200 <= response.status_code < 300
+
+
+def replay(claim, request_fingerprint, response_class):
+    """
+    Returns the stored response of a claim, or aborts when there is none to
+    send for this request
+    """
+    if claim is not None and claim.fingerprint != request_fingerprint:
+        abort(status.HTTP_422_UNPROCESSABLE_ENTITY, f"The {HEADER} was used for a different request")
+    if claim is None or claim.status is None:
+        abort(status.HTTP_409_CONFLICT, f"A request with this {HEADER} is still being processed")
+    response = response_class(claim.body, status=claim.status, headers=claim.headers)
+    response.headers[REPLAYED] = "true"
+    return response
+
+
+######################################################################
+# Flask
+######################################################################
+def idempotent(owner):
+    """
+    Makes a route answer the retries of a request that has an Idempotency-Key
+    with the response to the first one
+
+    Args:
+        owner (function): returns the user the request acts for from the
+            arguments of the route, or None to run the route as it is
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(HEADER)
+            if key is None:
+                return function(*args, **kwargs)
+            check_key(key)
+            user_id = owner(**kwargs)
+            if not user_id:
+                return function(*args, **kwargs)
+            user_id = str(user_id)
+
+            request_fingerprint = fingerprint(request.method, request.full_path, request.get_data())
+            claim_id = IdempotencyKey.claim(key, user_id, request_fingerprint, app.config["IDEMPOTENCY_LEASE"])
+            if claim_id is None:
+                app.logger.info("Replaying the response for %s %r", HEADER, key)
+                claim = IdempotencyKey.find_claim(key, user_id)
+                return replay(claim, request_fingerprint, app.response_class)
+
+            # the models only flush, and the changes of the route are committed
+            # here with the stored response, so that a failed commit still
+            # releases the claim
+            g.unit_of_work = True
+            try:
+                response = app.make_response(function(*args, **kwargs))
+                if succeeded(response):
+                    IdempotencyKey.store(claim_id, stored(response, response.get_data()), app.config["IDEMPOTENCY_TTL"])
+                    db.session.commit()
+            except Exception:
+                IdempotencyKey.release(claim_id)
+                raise
+            if not succeeded(response):
+                IdempotencyKey.release(claim_id)
+            return response
+
+        return wrapper
+
+    return decorator
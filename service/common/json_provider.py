@@ -0,0 +1,94 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Module: json_provider
+
+A JSON provider that encodes responses with orjson. Flask's provider leaves
+every Decimal and datetime to a Python fallback that json.dumps calls once
+per value. orjson walks the whole response in C and only calls back for
+those values.
+
+The output is byte for byte what Flask's provider writes:
+- keys are sorted
+- non-ASCII characters are written as \\u escapes
+- datetimes are written as HTTP dates
+- Decimals and UUIDs are written as strings
+- dataclasses are written like the dicts of their fields
+
+Anything orjson refuses, such as integers wider than 64 bits or keys that
+are not strings, is encoded again by Flask's provider. Two cases still
+differ. NaN and Infinity become null. Floats under 1e-4 or from 1e16 up are
+written with orjson's exponent notation. Money is kept in Decimals, so the
+service does not send such floats.
+
+The ASGI app takes the same provider. Quart uses Flask's JSON providers.
+"""
+import re
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+COMPACT = (",", ":")
+# characters that json.dumps escapes with ensure_ascii and orjson writes as is
+NOT_ASCII = re.compile("[\x7f-\U0010ffff]")
+
+
+def _escape(match):
+    """Returns the \\u escape of a character, as a surrogate pair beyond the BMP"""
+    code = ord(match.group())
+    if code < 0x10000:
+        return f"\\u{code:04x}"
+    code -= 0x10000
+    return f"\\u{0xd800 | code >> 10:04x}\\u{0xdc00 | code & 0x3ff:04x}"
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Encodes compact JSON with orjson, and everything else like Flask does"""
+
+    def encode(self, obj):
+        """Returns the compact JSON of an object as bytes"""
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            data = orjson.dumps(obj, default=self.default, option=option)
+        except orjson.JSONEncodeError:
+            return super().dumps(obj, separators=COMPACT).encode()
+        if self.ensure_ascii and (not data.isascii() or b"\x7f" in data):
+            data = NOT_ASCII.sub(_escape, data.decode()).encode()
+        return data
+
+    def dumps(self, obj, **kwargs):
+        """Serializes data as JSON to a string, with orjson when it is compact"""
+        if kwargs == {"separators": COMPACT}:
+            return self.encode(obj).decode()
+        return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        """Returns a response with the compact JSON of the arguments"""
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.encode(obj) + b"\n", mimetype=self.mimetype)
+
+
+def init_json(app):
+    """Encodes the JSON responses of an app with orjson when FAST_JSON is set"""
+    if app.config["FAST_JSON"] and orjson is not None:
+        app.json = FastJSONProvider(app)
@@ -19,18 +19,186 @@ Log Handlers
 
 This module contains utility functions to set up logging
 consistently
+
+A request only puts its log records on a queue. A listener thread takes them
+off and writes them with the handlers of the server, so a slow stream never
+holds up a request. The records are written as one JSON object per line, or
+as text with LOG_FORMAT=text.
+
+The records of each route can be thinned out:
+- LOG_ROUTE_LEVELS gives a route a level of its own, above or below the
+  level of the server, such as list_shopcarts=WARNING
+- LOG_ROUTE_SAMPLING keeps the records of only a share of the requests to
+  a route, such as get_shopcarts=0.1. The choice is made once per request,
+  so a request that is kept is kept whole. Warnings and errors are always
+  kept.
 """
+import atexit
+import copy
+import importlib
+import json
 import logging
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s"
+TEXT_DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+# the request attributes that the route filter adds to every record
+REQUEST_FIELDS = ("endpoint", "method", "path")
+
+
+class LogConfigError(ValueError):
+    """Used when LOG_ROUTE_LEVELS or LOG_ROUTE_SAMPLING cannot be understood"""
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as one line of JSON"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        for field in REQUEST_FIELDS:
+            if getattr(record, field, None) is not None:
+                entry[field] = getattr(record, field)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RecordQueueHandler(QueueHandler):
+    """
+    Puts records on the queue with their message and traceback rendered, and
+    leaves the formatting to the handlers of the listener
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RouteFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """Tags records with their request, and drops the ones of a route that are not wanted"""
+
+    def __init__(self, context, level, levels, sampling):
+        super().__init__()
+        self.context = context
+        self.level = level
+        self.levels = levels
+        self.sampling = sampling
+
+    def filter(self, record):
+        if not self.context.has_request_context():
+            return record.levelno >= self.level
+        request = self.context.request
+        record.endpoint = request.endpoint
+        record.method = request.method
+        record.path = request.path
+        if record.levelno < self.levels.get(request.endpoint, self.level):
+            return False
+        if record.levelno >= logging.WARNING:
+            return True
+        return self._sampled(request.endpoint)
+
+    def _sampled(self, endpoint):
+        """Returns whether the records of the current request are kept"""
+        rate = self.sampling.get(endpoint)
+        if rate is None:
+            return True
+        g = self.context.g
+        if "log_sampled" not in g:
+            g.log_sampled = random.random() < rate
+        return g.log_sampled
+
+
+def route_levels(levels):
+    """Returns the numeric levels of a map of endpoints to level names"""
+    numbers = {}
+    for endpoint, name in levels.items():
+        # an unknown name comes back as the string "Level NAME"
+        numbers[endpoint] = logging.getLevelName(str(name).upper())
+        if not isinstance(numbers[endpoint], int):
+            raise LogConfigError(f"LOG_ROUTE_LEVELS: {name!r} of {endpoint} is not a log level")
+    return numbers
+
+
+def route_sampling(rates):
+    """Returns the rates of a map of endpoints to sampling rates between 0 and 1"""
+    numbers = {}
+    for endpoint, rate in rates.items():
+        try:
+            numbers[endpoint] = float(rate)
+        except ValueError:
+            numbers[endpoint] = None
+        if numbers[endpoint] is None or not 0 <= numbers[endpoint] <= 1:
+            raise LogConfigError(f"LOG_ROUTE_SAMPLING: {rate!r} of {endpoint} is not a rate between 0 and 1")
+    return numbers
 
 
 def init_logging(app, logger_name: str):
     """Set up logging for production"""
     app.logger.propagate = False
     gunicorn_logger = logging.getLogger(logger_name)
-    app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
+    handlers = list(gunicorn_logger.handlers)
     # Make all log formats consistent
-    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
-    for handler in app.logger.handlers:
+    if app.config["LOG_FORMAT"] == "json":
+        formatter = JSONFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT, TEXT_DATE_FORMAT)
+    for handler in handlers:
         handler.setFormatter(formatter)
+
+    if app.config["LOG_QUEUE"] and handlers:
+        queue = SimpleQueue()
+        app.logger.handlers = [RecordQueueHandler(queue)]
+        app.extensions["log_listener"] = QueueListener(queue, *handlers, respect_handler_level=True)
+        app.extensions["log_listener"].start()
+        atexit.register(stop_logging, app)
+    else:
+        app.logger.handlers = handlers
+
+    # the logger lets through the lowest level of any route, and the filter
+    # holds every route to its own level
+    level = gunicorn_logger.getEffectiveLevel()
+    levels = route_levels(app.config["LOG_ROUTE_LEVELS"])
+    app.logger.setLevel(min([level, *levels.values()]))
+    # the request globals of the app's framework, flask or quart
+    context = importlib.import_module(type(app).__module__.split(".")[0])
+    sampling = route_sampling(app.config["LOG_ROUTE_SAMPLING"])
+    app.logger.filters = [RouteFilter(context, level, levels, sampling)]
     app.logger.info("Logging handler established")
+
+
+def restart_logging(app):
+    """
+    Starts the listener again in a forked worker, which does not inherit the
+    thread of the parent, on a queue of its own
+    """
+    listener = app.extensions.get("log_listener")
+    if listener is None:
+        return
+    queue = SimpleQueue()
+    for handler in app.logger.handlers:
+        handler.queue = queue
+    app.extensions["log_listener"] = QueueListener(queue, *listener.handlers, respect_handler_level=True)
+    app.extensions["log_listener"].start()
+
+
+def stop_logging(app):
+    """Writes out the records still on the queue and stops the listener"""
+    listener = app.extensions.pop("log_listener", None)
+    if listener is not None:
+        listener.stop()
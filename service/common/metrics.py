@@ -0,0 +1,180 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Module: metrics
+
+Prometheus metrics served at /metrics. Every request is counted by route
+and status and timed into a latency histogram, along with the number of SQL
+statements it ran and the time it spent in them. The connection pool reports
+the connections in use and the checkouts that saturated it.
+
+When PROMETHEUS_MULTIPROC_DIR is set, prometheus_client keeps the values in
+files in that directory and /metrics adds up the files of all of the gunicorn
+workers, so any worker can answer the scrape for the whole service.
+"""
+import os
+from time import perf_counter
+from flask import g, request, has_request_context
+from flask import current_app as app  # Import Flask application
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from service.models.persistent_base import db
+from .pool_stats import pool_limit
+
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+REQUESTS = Counter(
+    "http_requests", "Requests answered", ["method", "route", "status"]
+)
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time to answer a request", ["method", "route"]
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements run by a request", ["route"], buckets=QUERY_BUCKETS
+)
+REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_duration_seconds", "Time a request spent running SQL", ["route"]
+)
+POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out", "Connections checked out of the pool", multiprocess_mode="livesum"
+)
+POOL_LIMIT = Gauge(
+    "db_pool_limit", "Most connections the pool hands out", multiprocess_mode="livesum"
+)
+POOL_SATURATED = Counter(
+    "db_pool_saturated", "Checkouts that left no connection for the next request"
+)
+
+
+# the labelled metrics of every method, route and status seen so far, looked
+# up once per request instead of once per metric
+_children = {}
+
+
+def children(method, route, status_code):
+    """Returns the labelled metrics a request is recorded in"""
+    key = (method, route, status_code)
+    found = _children.get(key)
+    if found is None:
+        found = _children[key] = (
+            REQUESTS.labels(method, route, status_code),
+            REQUEST_SECONDS.labels(method, route),
+            REQUEST_QUERIES.labels(route),
+            REQUEST_DB_SECONDS.labels(route),
+        )
+    return found
+
+
+def registry():
+    """Returns the registry to collect, merging the workers in multiprocess mode"""
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if not path:
+        return REGISTRY
+    merged = CollectorRegistry()
+    multiprocess.MultiProcessCollector(merged, path=path)
+    return merged
+
+
+######################################################################
+# Time the requests
+######################################################################
+@app.before_request
+def start_timer():
+    """Starts timing the request and counting its SQL"""
+    if app.config["METRICS_ENABLED"]:
+        # start time, SQL statements and seconds spent in them
+        g.request_metrics = [perf_counter(), 0, 0.0]
+
+
+@app.after_request
+def record_request(response):
+    """Records the count, latency and SQL of the request"""
+    tally = g.pop("request_metrics", None)
+    if tally is None:
+        return response
+    start, queries, seconds = tally
+    # the URL rule keeps the number of labels small, whatever the URLs
+    rule = request.url_rule
+    requests, latency, statements, sql_seconds = children(
+        request.method, rule.rule if rule else "<unmatched>", response.status_code
+    )
+    requests.inc()
+    latency.observe(perf_counter() - start)
+    statements.observe(queries)
+    sql_seconds.observe(seconds)
+    return response
+
+
+######################################################################
+# Time the SQL statements of every engine, replicas included
+######################################################################
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement(conn, _cursor, _statement, _parameters, _context, _executemany):
+    """Notes when a statement of a request started"""
+    if has_request_context():
+        conn.info.setdefault("statement_start", []).append(perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def end_statement(conn, _cursor, _statement, _parameters, _context, _executemany):
+    """Adds a statement and its time to the request that ran it"""
+    starts = conn.info.get("statement_start")
+    if not starts:
+        return
+    elapsed = perf_counter() - starts.pop()
+    tally = g.get("request_metrics") if has_request_context() else None
+    if tally is not None:
+        tally[1] += 1
+        tally[2] += elapsed
+
+
+######################################################################
+# Watch the connection pool
+######################################################################
+@event.listens_for(db.engine, "checkout")
+def track_checkout(_dbapi_connection, _connection_record, _connection_proxy):
+    """Updates the connections in use and counts saturating checkouts"""
+    checked_out = db.engine.pool.checkedout()
+    limit = pool_limit(db.engine.pool)
+    POOL_CHECKED_OUT.set(checked_out)
+    POOL_LIMIT.set(limit or 0)
+    if limit is not None and checked_out >= limit:
+        POOL_SATURATED.inc()
+
+
+@event.listens_for(db.engine, "checkin")
+def track_checkin(_dbapi_connection, _connection_record):
+    """Updates the connections in use"""
+    POOL_CHECKED_OUT.set(db.engine.pool.checkedout())
+
+
+######################################################################
+# GET /metrics
+######################################################################
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Returns the metrics in the Prometheus text format"""
+    return generate_latest(registry()), 200, {"Content-Type": CONTENT_TYPE_LATEST}
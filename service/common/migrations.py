@@ -0,0 +1,239 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Module: migrations
+
+Versions the database schema. The schema_version table holds the number of
+migrations that have been run, and SCHEMA_VERSION is the number this code
+needs. A worker only reads that one row when it starts, where db.create_all
+looked up every table of the models on every boot.
+
+`flask db-migrate` runs the missing migrations, for example from a release
+job or an init container before the new workers start. It takes an advisory
+lock so that two of them at once take turns, and runs all of the migrations
+in one transaction so that a failed one changes nothing. With
+DB_AUTO_MIGRATE=true the app runs them itself when it finds the schema
+behind, which suits development and tests.
+
+A migration is a function of a connection appended to MIGRATIONS, and is
+never changed once released. The first one creates the tables as they were
+before any of the others. A database that db.create_all made before the
+schema was versioned may already have any of the later changes, so every
+migration leaves a change that is already there as it is, for example with
+ADD COLUMN IF NOT EXISTS.
+"""
+import logging
+import sys
+import click
+from sqlalchemy.exc import ProgrammingError
+from service.models import db, Shopcart
+
+logger = logging.getLogger("flask.app")
+
+# the key of the advisory lock that migrations hold while they run
+LOCK_KEY = 4_715_202
+# the flask commands that load the app to change the schema it would refuse
+SCHEMA_COMMANDS = ("db-create", "db-migrate")
+
+schema_version = db.Table(
+    "schema_version",
+    db.Column("version", db.Integer, nullable=False),
+)
+
+
+class SchemaError(Exception):
+    """Used when the database schema is older than the code needs"""
+
+
+######################################################################
+# Migrations
+######################################################################
+def execute(connection, *statements):
+    """Runs SQL statements on the connection of a migration"""
+    for statement in statements:
+        connection.execute(db.text(statement))
+
+
+def create_baseline(connection):
+    """Creates the shopcart and item tables as the first release had them"""
+    execute(
+        connection,
+        """
+        CREATE TABLE IF NOT EXISTS shopcart (
+            id SERIAL PRIMARY KEY,
+            user_id VARCHAR(63),
+            creation_date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            last_updated TIMESTAMP WITHOUT TIME ZONE NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS item (
+            id SERIAL PRIMARY KEY,
+            product_name VARCHAR(63),
+            cart_id INTEGER NOT NULL REFERENCES shopcart (id) ON DELETE CASCADE,
+            product_id INTEGER,
+            product_price NUMERIC(10, 2) NOT NULL,
+            quantity INTEGER NOT NULL
+        )
+        """,
+    )
+
+
+def add_quantity_check(connection):
+    """Keeps the quantity of every Item at zero or more"""
+    exists = connection.scalar(
+        db.text("SELECT 1 FROM pg_constraint WHERE conrelid = 'item'::regclass AND conname = :name"),
+        {"name": "item_quantity_not_negative"},
+    )
+    if exists:
+        return
+    # the first release could decrement below zero, which the check refuses
+    execute(
+        connection,
+        "UPDATE item SET quantity = 0 WHERE quantity < 0",
+        "ALTER TABLE item ADD CONSTRAINT item_quantity_not_negative CHECK (quantity >= 0)",
+    )
+
+
+def add_versions(connection):
+    """Adds the version columns that the ETags are made from"""
+    execute(
+        connection,
+        "ALTER TABLE shopcart ADD COLUMN IF NOT EXISTS version INTEGER DEFAULT '1' NOT NULL",
+        "ALTER TABLE item ADD COLUMN IF NOT EXISTS version INTEGER DEFAULT '1' NOT NULL",
+    )
+
+
+def add_shopcart_totals(connection):
+    """Adds the stored totals of the Shopcarts and derives them from their Items"""
+    execute(
+        connection,
+        "ALTER TABLE shopcart ADD COLUMN IF NOT EXISTS total_price NUMERIC(12, 2) DEFAULT '0' NOT NULL",
+        "ALTER TABLE shopcart ADD COLUMN IF NOT EXISTS item_count INTEGER DEFAULT '0' NOT NULL",
+    )
+    connection.execute(Shopcart.recalculate_statement())
+
+
+def add_indexes(connection):
+    """Adds the indexes that the finders of the models use"""
+    execute(
+        connection,
+        "CREATE INDEX IF NOT EXISTS ix_shopcart_user_id ON shopcart (user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_item_cart_id_product_id ON item (cart_id, product_id)",
+        "CREATE INDEX IF NOT EXISTS ix_item_product_id_quantity ON item (product_id, quantity)",
+        "CREATE INDEX IF NOT EXISTS ix_item_quantity ON item (quantity)",
+    )
+
+
+def add_timestamp_defaults(connection):
+    """Takes the timestamps of new Shopcarts from the database clock"""
+    execute(
+        connection,
+        "ALTER TABLE shopcart ALTER COLUMN creation_date SET DEFAULT timezone('UTC', now())",
+        "ALTER TABLE shopcart ALTER COLUMN last_updated SET DEFAULT timezone('UTC', now())",
+    )
+
+
+def create_idempotency_keys(connection):
+    """Creates the table of the Idempotency-Keys"""
+    execute(
+        connection,
+        """
+        CREATE TABLE IF NOT EXISTS idempotency_key (
+            id SERIAL PRIMARY KEY,
+            key VARCHAR(255) NOT NULL,
+            user_id VARCHAR(63) NOT NULL,
+            fingerprint VARCHAR(64) NOT NULL,
+            status INTEGER,
+            headers JSON,
+            body BYTEA,
+            expires_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            CONSTRAINT idempotency_key_key_user_id UNIQUE (key, user_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_idempotency_key_expires_at ON idempotency_key (expires_at)",
+    )
+
+
+# a migration brings the schema to the version of its place in the list
+MIGRATIONS = [
+    create_baseline,
+    add_quantity_check,
+    add_versions,
+    add_shopcart_totals,
+    add_indexes,
+    add_timestamp_defaults,
+    create_idempotency_keys,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+######################################################################
+# Versions
+######################################################################
+def probe(engine):
+    """Returns the version of the schema, or 0 for a database that has never been migrated"""
+    with engine.connect() as connection:
+        try:
+            return connection.scalar(db.select(schema_version.c.version)) or 0
+        except ProgrammingError:
+            # there is no schema_version table yet
+            return 0
+
+
+def migrate(engine, target=SCHEMA_VERSION):
+    """Runs the migrations the schema is missing up to a target version
+
+    Returns:
+        the list of the versions that were migrated to
+    """
+    with engine.begin() as connection:
+        connection.execute(db.text("SELECT pg_advisory_xact_lock(:key)"), {"key": LOCK_KEY})
+        schema_version.create(connection, checkfirst=True)
+        # read again under the lock, in case another migration just finished
+        version = connection.scalar(db.select(schema_version.c.version)) or 0
+        versions = list(range(version + 1, target + 1))
+        for number in versions:
+            logger.info("Migrating the schema to version %d: %s", number, MIGRATIONS[number - 1].__name__)
+            MIGRATIONS[number - 1](connection)
+        if versions:
+            connection.execute(db.delete(schema_version))
+            connection.execute(db.insert(schema_version).values(version=target))
+    return versions
+
+
+def check_schema(app):
+    """Checks at startup that the schema is not behind the code
+
+    The schema is migrated when it is behind and DB_AUTO_MIGRATE is set,
+    or else a SchemaError is raised. A schema that is ahead belongs to a
+    newer release that is rolling out, and must still work with this one.
+    """
+    version = probe(db.engine)
+    if version < SCHEMA_VERSION and app.config["DB_AUTO_MIGRATE"]:
+        migrate(db.engine)
+    elif version < SCHEMA_VERSION:
+        raise SchemaError(f"The schema is at version {version} of {SCHEMA_VERSION}, run flask db-migrate")
+    elif version > SCHEMA_VERSION:
+        logger.warning("The schema is at version %d, ahead of %d", version, SCHEMA_VERSION)
+
+
+def changing_schema():
+    """Returns True when the app is loaded by a flask command that changes the schema"""
+    if click.get_current_context(silent=True) is None:
+        return False
+    # the command has not been picked yet when the flask CLI loads the app
+    return any(command in sys.argv[1:] for command in SCHEMA_COMMANDS)
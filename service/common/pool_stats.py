@@ -0,0 +1,109 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Module: pool_stats
+
+Live statistics of the database connection pool. Every worker process has
+its own pool, so the statistics are served per process at /debug/pool
+along with the pid, which is enough to size DB_POOL_SIZE and
+DB_MAX_OVERFLOW against max_connections on Postgres.
+"""
+import os
+import threading
+from flask import jsonify
+from flask import current_app as app  # Import Flask application
+from sqlalchemy import event
+from service.models.persistent_base import db
+from . import status
+
+_lock = threading.Lock()
+
+# counted since the process started, or since the last reset_counters()
+counters = {
+    "connects": 0,  # new connections opened to the database
+    "checkouts": 0,  # connections handed out by the pool
+    "invalidated": 0,  # connections thrown away, e.g. by a failed pre-ping
+    "high_water": 0,  # most connections checked out at the same time
+    "saturated": 0,  # checkouts that left no connection for the next request
+}
+
+
+def reset_counters():
+    """Sets all of the counters back to zero"""
+    with _lock:
+        for name in counters:
+            counters[name] = 0
+
+
+def pool_limit(pool):
+    """Returns the most connections the pool will hand out, or None if unbounded"""
+    if pool._max_overflow < 0:
+        return None
+    return pool.size() + pool._max_overflow
+
+
+######################################################################
+# Count the pool events
+######################################################################
+@event.listens_for(db.engine, "connect")
+def count_connect(_dbapi_connection, _connection_record):
+    """Counts a new connection to the database"""
+    with _lock:
+        counters["connects"] += 1
+
+
+@event.listens_for(db.engine, "checkout")
+def count_checkout(_dbapi_connection, _connection_record, _connection_proxy):
+    """Counts a checkout and how close it took the pool to its limit"""
+    pool = db.engine.pool
+    checked_out = pool.checkedout()
+    limit = pool_limit(pool)
+    with _lock:
+        counters["checkouts"] += 1
+        counters["high_water"] = max(counters["high_water"], checked_out)
+        if limit is not None and checked_out >= limit:
+            counters["saturated"] += 1
+
+
+@event.listens_for(db.engine, "invalidate")
+def count_invalidate(_dbapi_connection, _connection_record, _exception):
+    """Counts a connection that was thrown away"""
+    with _lock:
+        counters["invalidated"] += 1
+
+
+######################################################################
+# GET POOL STATISTICS
+######################################################################
+@app.route("/debug/pool")
+def pool_statistics():
+    """Returns the state of the connection pool of this worker process"""
+    pool = db.engine.pool
+    with _lock:
+        totals = dict(counters)
+    return (
+        jsonify(
+            pid=os.getpid(),
+            size=pool.size(),
+            max_overflow=pool._max_overflow,
+            timeout=pool.timeout(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+            **totals,
+        ),
+        status.HTTP_200_OK,
+    )
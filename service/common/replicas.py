@@ -0,0 +1,120 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Module: replicas
+
+Read replica routing. When DATABASE_REPLICA_URIS is set, GET requests are
+served from a replica connection that is checked out before the view runs,
+while every other request stays on the primary. A successful write answers
+with an X-Consistency-Token header holding the WAL position (LSN) of the
+primary after the write. A read that sends the token back is only served by
+a replica that has replayed that far, and by the primary until one has.
+"""
+import itertools
+import time
+from flask import g, request
+from flask import current_app as app  # Import Flask application
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from service.models.persistent_base import db, DataValidationError
+
+TOKEN_HEADER = "X-Consistency-Token"
+READ_METHODS = ("GET", "HEAD")
+REPLICA_PREFIX = "replica_"
+
+CURRENT_LSN = text("SELECT pg_current_wal_lsn()::text")
+# a server that is not in recovery is a primary, so it has seen all of its writes
+REPLAYED_LSN = text(
+    "SELECT (CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn()"
+    " ELSE pg_current_wal_lsn() END)::text"
+)
+
+# monotonic time until which a replica that could not be reached is left out
+down_until = {}
+_turns = itertools.count()
+
+
+def parse_lsn(token):
+    """Returns the position of an LSN written like 16/B374D848"""
+    try:
+        high, low = token.split("/")
+        return int(high, 16) << 32 | int(low, 16)
+    except ValueError as error:
+        raise DataValidationError(f"Invalid consistency token: {token}") from error
+
+
+def replica_keys():
+    """Returns the bind keys of the replicas"""
+    return sorted(key for key in db.engines if key and key.startswith(REPLICA_PREFIX))
+
+
+def connect_replica(minimum=None):
+    """
+    Returns a connection to the next replica in turn that can be reached and
+    has replayed at least up to the minimum LSN, or None if there is none
+    """
+    keys = replica_keys()
+    start = next(_turns)
+    for offset in range(len(keys)):
+        key = keys[(start + offset) % len(keys)]
+        if down_until.get(key, 0) > time.monotonic():
+            continue
+        try:
+            conn = db.engines[key].connect()
+        except DBAPIError as error:
+            down_until[key] = time.monotonic() + app.config["DB_REPLICA_RETRY"]
+            app.logger.warning("Leaving out replica %s that cannot be reached: %s", key, error)
+            continue
+        if minimum is None or parse_lsn(conn.scalar(REPLAYED_LSN)) >= minimum:
+            return conn
+        conn.close()
+        app.logger.info("Replica %s has not caught up, reading from the primary", key)
+    return None
+
+
+######################################################################
+# Send the reads to a replica
+######################################################################
+@app.before_request
+def route_reads():
+    """Checks out a replica connection for the session of a read request"""
+    g.replica = None
+    if request.method not in READ_METHODS or not replica_keys():
+        return
+    token = request.headers.get(TOKEN_HEADER)
+    g.replica = connect_replica(parse_lsn(token) if token else None)
+
+
+######################################################################
+# Tell the writers how far the replicas must be to see their changes
+######################################################################
+@app.after_request
+def add_consistency_token(response):
+    """Gives a successful write the LSN of the primary after it"""
+    if request.method in READ_METHODS or response.status_code >= 400 or not replica_keys():
+        return response
+    with db.engine.connect() as conn:
+        response.headers[TOKEN_HEADER] = conn.scalar(CURRENT_LSN)
+    return response
+
+
+@app.teardown_request
+def release_replica(_exception):
+    """Gives the replica connection of a read request back to its pool"""
+    replica = g.pop("replica", None)
+    if replica is not None:
+        db.session.close()
+        replica.close()
@@ -0,0 +1,66 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Module: unit_of_work
+
+Request scoped transactions. When DB_COMMIT_MODE is "request" every request
+runs in a single transaction: the models only flush their changes and the
+transaction is committed once when the request succeeds, or rolled back if
+the request fails. With the default of "call" every model call commits.
+"""
+from flask import g
+from flask import current_app as app  # Import Flask application
+from service.models.persistent_base import db
+
+COMMIT_PER_CALL = "call"
+COMMIT_PER_REQUEST = "request"
+
+
+######################################################################
+# Open the unit of work
+######################################################################
+@app.before_request
+def begin_unit_of_work():
+    """Marks the request as a unit of work when committing per request"""
+    g.unit_of_work = app.config["DB_COMMIT_MODE"] == COMMIT_PER_REQUEST
+
+
+######################################################################
+# Commit or roll back once at the end of the request
+######################################################################
+@app.after_request
+def end_unit_of_work(response):
+    """Commits a successful unit of work and rolls back a failed one"""
+    if not g.get("unit_of_work"):
+        return response
+    g.unit_of_work = False
+    if response.status_code >= 400:
+        db.session.rollback()
+        return response
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        app.logger.error("Error committing the unit of work")
+        raise
+    return response
+
+
+@app.teardown_request
+def abort_unit_of_work(exception):
+    """Rolls back a unit of work that ended with an unhandled exception"""
+    if exception is not None and g.get("unit_of_work"):
+        db.session.rollback()
@@ -13,8 +13,101 @@ DATABASE_URI = os.getenv(
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-# SQLALCHEMY_POOL_SIZE = 2
+
+# Every worker process has its own connection pool, so keep
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) below max_connections on Postgres
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "1", "yes")
+# milliseconds a single statement may run before Postgres cancels it, 0 is no limit
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "0"))
+
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+# options is read by libpq only, so other databases such as SQLite go without it
+if DATABASE_URI.startswith("postgresql") and DB_STATEMENT_TIMEOUT > 0:
+    SQLALCHEMY_ENGINE_OPTIONS["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT}"}
+
+# Optional read replicas, comma separated. GET requests are served from them
+# and everything else from DATABASE_URI. Each replica is a bind of its own
+DATABASE_REPLICA_URIS = [
+    uri.strip() for uri in os.getenv("DATABASE_REPLICA_URIS", "").split(",") if uri.strip()
+]
+SQLALCHEMY_BINDS = {
+    f"replica_{number}": uri for number, uri in enumerate(DATABASE_REPLICA_URIS)
+}
+# seconds a replica that could not be reached is left out before it is tried again
+DB_REPLICA_RETRY = float(os.getenv("DB_REPLICA_RETRY", "30"))
+
+# Commit after every model call ("call") or once per request ("request")
+DB_COMMIT_MODE = os.getenv("DB_COMMIT_MODE", "call")
+
+# migrate the schema at startup when it is behind, instead of refusing to
+# start until flask db-migrate has run. Meant for development and tests
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "false").lower() in ("true", "1", "yes")
+
+# Keyset pagination for collection endpoints
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+# Largest list of items accepted by one POST /shopcarts/<id>/items
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "1000"))
+
+# Number of rows fetched per round trip when streaming with ?stream=true
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+# Record request, SQL and pool metrics for /metrics. Set PROMETHEUS_MULTIPROC_DIR
+# to an empty directory to add up the metrics of all of the gunicorn workers
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("true", "1", "yes")
+
+# Encode JSON responses with orjson when it is installed. The bytes are the
+# same as with Flask's own encoder, only faster on large carts
+FAST_JSON = os.getenv("FAST_JSON", "true").lower() in ("true", "1", "yes")
+
+# Compress the responses with the first of these encodings the client accepts.
+# Bodies under COMPRESS_MIN_SIZE bytes are sent as they are. Brotli at quality 4
+# is faster than gzip at level 6 on the JSON of large carts, and as small
+COMPRESS_ENCODINGS = os.getenv("COMPRESS_ENCODINGS", "br,gzip")
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+
+# Static files built with hashed names and compressed copies by
+# python -m service.common.assets. Served from /assets when they exist
+ASSETS_FOLDER = os.getenv("ASSETS_FOLDER", os.path.join(os.path.dirname(__file__), "assets"))
+
+# A POST sent with an Idempotency-Key header claims the key for IDEMPOTENCY_LEASE
+# seconds while it runs, and its response answers the retries for IDEMPOTENCY_TTL
+IDEMPOTENCY_LEASE = int(os.getenv("IDEMPOTENCY_LEASE", "60"))
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
 LOGGING_LEVEL = logging.INFO
+
+# Write the logs as JSON lines ("json") or as text ("text"), from a queue that a
+# thread empties so that requests never wait on the log stream (LOG_QUEUE)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_QUEUE = os.getenv("LOG_QUEUE", "true").lower() in ("true", "1", "yes")
+# Per route levels and sampling rates by endpoint name, comma separated, for
+# example LOG_ROUTE_LEVELS="list_shopcarts=WARNING,get_item=DEBUG" and
+# LOG_ROUTE_SAMPLING="get_shopcarts=0.1". Warnings are never sampled out
+LOG_ROUTE_LEVELS = {
+    endpoint.strip(): level.strip()
+    for endpoint, level in (
+        pair.split("=", 1) for pair in os.getenv("LOG_ROUTE_LEVELS", "").split(",") if "=" in pair
+    )
+}
+LOG_ROUTE_SAMPLING = {
+    endpoint.strip(): rate.strip()
+    for endpoint, rate in (
+        pair.split("=", 1) for pair in os.getenv("LOG_ROUTE_SAMPLING", "").split(",") if "=" in pair
+    )
+}
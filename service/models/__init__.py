@@ -4,6 +4,7 @@ Models for Account
 All of the models are stored in this package
 """
 
-from .persistent_base import db, DataValidationError
+from .persistent_base import db, DataValidationError, StaleVersionError
 from .shopcart import Shopcart
 from .item import Item
+from .idempotency_key import IdempotencyKey
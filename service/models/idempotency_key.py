@@ -0,0 +1,151 @@
+"""
+Model for Idempotency Keys
+
+Remembers the first response to a POST that was sent with an Idempotency-Key
+header, so that a retry of the POST is answered without running it again
+"""
+
+import logging
+from datetime import timedelta
+from sqlalchemy.dialects import postgresql
+from .persistent_base import db, save_changes, utc_now
+
+logger = logging.getLogger("flask.app")
+
+
+class IdempotencyKey(db.Model):
+    """
+    Class that represents the claim of a user on an Idempotency-Key, and the
+    response that was sent for it
+    """
+
+    ##################################################
+    # Table Schema
+    ##################################################
+
+    # two requests with the same key and user cannot both insert a claim, so
+    # concurrent retries are told apart by the database without a lock
+    __table_args__ = (
+        db.UniqueConstraint("key", "user_id", name="idempotency_key_key_user_id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(255), nullable=False)
+    user_id = db.Column(db.String(63), nullable=False)
+    # digest of the method, path and body the key was first used with
+    fingerprint = db.Column(db.String(64), nullable=False)
+    # the response, which is None while the first request is still running
+    status = db.Column(db.Integer)
+    headers = db.Column(db.JSON)
+    body = db.Column(db.LargeBinary)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey {self.key!r} of {self.user_id!r} id=[{self.id}]>"
+
+    ##################################################
+    # STATEMENTS
+    ##################################################
+
+    @classmethod
+    def claim_statement(cls, key, user_id, fingerprint, lease):
+        """Returns the INSERT that claims a key for a user for lease seconds
+
+        A claim that has expired is taken over. The statement returns the id
+        of the claim, or nothing when the key is held by another request.
+        """
+        insert = postgresql.insert(cls).values(
+            key=key,
+            user_id=user_id,
+            fingerprint=fingerprint,
+            expires_at=utc_now() + timedelta(seconds=lease),
+        )
+        return insert.on_conflict_do_update(
+            constraint="idempotency_key_key_user_id",
+            set_={
+                "fingerprint": insert.excluded.fingerprint,
+                "status": None,
+                "headers": None,
+                "body": None,
+                "expires_at": insert.excluded.expires_at,
+            },
+            where=cls.expires_at < utc_now(),
+        ).returning(cls.id)
+
+    @classmethod
+    def find_statement(cls, key, user_id):
+        """Returns the SELECT of the claim of a user on a key"""
+        return db.select(cls).where(cls.key == key, cls.user_id == user_id)
+
+    @classmethod
+    def store_statement(cls, claim_id, response, ttl):
+        """Returns the UPDATE that keeps a response for ttl seconds
+
+        Args:
+            claim_id (int): the id returned by the claim
+            response (tuple): the status, headers and body of the response
+            ttl (int): the seconds a retry is answered with the response
+        """
+        code, headers, body = response
+        return (
+            db.update(cls)
+            .where(cls.id == claim_id)
+            .values(
+                status=code,
+                headers=headers,
+                body=body,
+                expires_at=utc_now() + timedelta(seconds=ttl),
+            )
+        )
+
+    @classmethod
+    def release_statement(cls, claim_id):
+        """Returns the DELETE that gives up a claim"""
+        return db.delete(cls).where(cls.id == claim_id)
+
+    @classmethod
+    def purge_statement(cls):
+        """Returns the DELETE of the claims that have expired"""
+        return db.delete(cls).where(cls.expires_at < utc_now())
+
+    ##################################################
+    # CLASS METHODS
+    ##################################################
+
+    @classmethod
+    def claim(cls, key, user_id, fingerprint, lease):
+        """Claims a key for a user and commits the claim at once, so that
+        a concurrent retry sees it
+
+        Returns:
+            the id of the claim, or None if another request holds the key
+        """
+        logger.info("Processing claim of idempotency key %r for user %s ...", key, user_id)
+        claim_id = db.session.scalar(cls.claim_statement(key, user_id, fingerprint, lease))
+        db.session.commit()
+        return claim_id
+
+    @classmethod
+    def find_claim(cls, key, user_id):
+        """Returns the claim of a user on a key, or None"""
+        return db.session.scalar(cls.find_statement(key, user_id))
+
+    @classmethod
+    def store(cls, claim_id, response, ttl):
+        """Keeps the response of a claim, committed along with the unit of work if there is one"""
+        db.session.execute(cls.store_statement(claim_id, response, ttl))
+        save_changes()
+
+    @classmethod
+    def release(cls, claim_id):
+        """Gives up a claim, and rolls back what the request had not committed"""
+        db.session.rollback()
+        db.session.execute(cls.release_statement(claim_id))
+        db.session.commit()
+
+    @classmethod
+    def purge(cls):
+        """Deletes the claims that have expired and returns how many there were"""
+        count = db.session.execute(cls.purge_statement()).rowcount
+        db.session.commit()
+        return count
@@ -10,6 +10,9 @@ from .persistent_base import db, PersistentBase, DataValidationError
 
 logger = logging.getLogger("flask.app")
 
+# the keys of serialize(), in the order of the columns of Item.row_columns()
+ROW_FIELDS = ("id", "product_name", "cart_id", "product_id", "product_price", "quantity", "subtotal")
+
 
 # pylint: disable=too-many-instance-attributes
 class Item(db.Model, PersistentBase):
@@ -21,16 +24,46 @@ class Item(db.Model, PersistentBase):
     # Table Schema
     ##################################################
 
+    # the database will never store a negative quantity, and every finder
+    # below has an index: (cart_id, product_id) serves Item.all and lookups
+    # within a cart, (product_id, quantity) serves both product_id finders
+    __table_args__ = (
+        db.CheckConstraint("quantity >= 0", name="item_quantity_not_negative"),
+        db.Index("ix_item_cart_id_product_id", "cart_id", "product_id"),
+        db.Index("ix_item_product_id_quantity", "product_id", "quantity"),
+        db.Index("ix_item_quantity", "quantity"),
+    )
+
+    # cart_id, product_price and quantity keep their old values when changed
+    # so that the stored Shopcart totals can be moved by the difference
     id = db.Column(db.Integer, primary_key=True)
     product_name = db.Column(db.String(63))
-    cart_id = db.Column(
-        db.Integer, db.ForeignKey("shopcart.id", ondelete="CASCADE"), nullable=False
+    cart_id = db.column_property(
+        db.Column(
+            db.Integer,
+            db.ForeignKey("shopcart.id", ondelete="CASCADE"),
+            nullable=False,
+        ),
+        active_history=True,
     )
     product_id = db.Column(db.Integer)
-    product_price = db.Column(
-        "product_price", db.Numeric(precision=10, scale=2), nullable=False, default=0
+    product_price = db.column_property(
+        db.Column(
+            "product_price",
+            db.Numeric(precision=10, scale=2),
+            nullable=False,
+            default=0,
+        ),
+        active_history=True,
+    )
+    quantity = db.column_property(
+        db.Column("quantity", db.Integer, nullable=False, default=0),
+        active_history=True,
     )
-    quantity = db.Column("quantity", db.Integer, nullable=False, default=0)
+    # bumped by every UPDATE of the row and used as its ETag
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version, "eager_defaults": True}
 
     def get_subtotal(self):
         """Return the subtotal."""
@@ -116,3 +149,33 @@ class Item(db.Model, PersistentBase):
         """
         logger.info("Processing items query which have a quantity of: %s ...", quantity)
         return cls.query.filter(cls.quantity == quantity, cls.product_id == product_id)
+
+    ##################################################
+    # PLAIN ROWS
+    ##################################################
+    @classmethod
+    def row_columns(cls):
+        """Returns the columns of serialize(), with the subtotal computed by the database"""
+        return (
+            cls.id,
+            cls.product_name,
+            cls.cart_id,
+            cls.product_id,
+            cls.product_price,
+            cls.quantity,
+            (cls.product_price * cls.quantity).label("subtotal"),
+        )
+
+    @classmethod
+    def rows(cls, query):
+        """Returns a query of one of the finders that selects row_columns() instead of Items"""
+        return query.with_entities(*cls.row_columns())
+
+    @staticmethod
+    def serialize_rows(rows):
+        """
+        Serializes rows of row_columns() into the dictionaries of serialize()
+
+        No Items are built, so the rows never enter the session
+        """
+        return (dict(zip(ROW_FIELDS, row)) for row in rows)
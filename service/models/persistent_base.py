@@ -20,17 +20,52 @@ Persistent Base class for database CRUD functions
 
 import logging
 from abc import abstractmethod
+from flask import g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import func
+from sqlalchemy.orm.exc import StaleDataError
 
 logger = logging.getLogger("flask.app")
 
-db = SQLAlchemy()
+
+class RoutingSession(Session):  # pylint: disable=too-few-public-methods
+    """A session that reads from the replica chosen for the current request"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        """Returns the replica connection of a read request, else the primary"""
+        if bind is None and has_request_context() and g.get("replica"):
+            return g.replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+class StaleVersionError(Exception):
+    """Used when a record was changed by someone else since it was read"""
+
+
+def utc_now():
+    """Returns the current UTC time on the database clock as a SQL expression"""
+    return func.timezone("UTC", func.now())  # pylint: disable=not-callable
+
+
+def save_changes() -> None:
+    """
+    Commits the session, or only flushes it when the current request is a
+    unit of work that will be committed once when the request ends
+    """
+    if has_request_context() and g.get("unit_of_work"):
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
 ######################################################################
 #  P E R S I S T E N T   B A S E   M O D E L
 ######################################################################
@@ -57,7 +92,7 @@ class PersistentBase:
         self.id = None
         try:
             db.session.add(self)
-            db.session.commit()
+            save_changes()
         except Exception as e:
             db.session.rollback()
             logger.error("Error creating record: %s", self)
@@ -71,7 +106,11 @@ class PersistentBase:
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
         try:
-            db.session.commit()
+            save_changes()
+        except StaleDataError as e:
+            db.session.rollback()
+            logger.error("Stale version of record: %s", self)
+            raise StaleVersionError(e) from e
         except Exception as e:
             db.session.rollback()
             logger.error("Error updating record: %s", str(e))
@@ -82,7 +121,11 @@ class PersistentBase:
         logger.info("Deleting %s", self)
         try:
             db.session.delete(self)
-            db.session.commit()
+            save_changes()
+        except StaleDataError as e:
+            db.session.rollback()
+            logger.error("Stale version of record: %s", self)
+            raise StaleVersionError(e) from e
         except Exception as e:
             db.session.rollback()
             logger.error("Error deleting record: %s", self)
@@ -94,3 +137,11 @@ class PersistentBase:
         logger.info("Processing lookup for id %s ...", by_id)
         # pylint: disable=no-member
         return cls.query.session.get(cls, by_id)
+
+    @classmethod
+    def find_version(cls, by_id):
+        """Returns only the version of a record, or None if it does not exist"""
+        logger.info("Processing version lookup for id %s ...", by_id)
+        return db.session.execute(
+            db.select(cls.version).where(cls.id == by_id)
+        ).scalar_one_or_none()
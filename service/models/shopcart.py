@@ -5,13 +5,30 @@ All of the models are stored in this module
 """
 
 import logging
-from datetime import datetime
-from .persistent_base import db, PersistentBase, DataValidationError
-from .item import Item
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import delete, event, func, inspect, select, update
+from sqlalchemy.orm import joinedload, load_only, object_session, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from .persistent_base import (
+    db,
+    PersistentBase,
+    DataValidationError,
+    save_changes,
+    utc_now,
+)
+from .item import Item, ROW_FIELDS as ITEM_FIELDS
 
 logger = logging.getLogger("flask.app")
 
+CENTS = Decimal("0.01")
 
+# the keys of serialize() without the items, in the order of Shopcart.row_columns()
+ROW_FIELDS = ("id", "user_id", "creation_date", "last_updated", "total_price", "item_count")
+# every key of serialize(), any of which can be left out but the id
+FIELDS = ROW_FIELDS + ("items",)
+
+
+# pylint: disable=too-many-public-methods
 class Shopcart(db.Model, PersistentBase):
     """
     Class that represents a Shopcart
@@ -21,18 +38,42 @@ class Shopcart(db.Model, PersistentBase):
     # Table Schema
     ##################################################
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.String(63))
-    creation_date = db.Column(db.DateTime, default=datetime.utcnow(), nullable=False)
+    user_id = db.Column(db.String(63), index=True)
+    # timestamps come from the database clock when each row is written
+    creation_date = db.Column(db.DateTime, server_default=utc_now(), nullable=False)
     last_updated = db.Column(
         db.DateTime,
-        default=datetime.utcnow(),
-        onupdate=datetime.utcnow(),
+        server_default=utc_now(),
+        onupdate=utc_now(),
+        nullable=False,
+    )
+    # Totals are stored with the Shopcart and moved by every change to its
+    # Items, so they can be read without loading any Items
+    total_price = db.Column(
+        db.Numeric(precision=12, scale=2),
         nullable=False,
+        default=0,
+        server_default="0",
     )
-    items = db.relationship("Item", backref="shopcart", passive_deletes=True)
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # bumped by every change to the Shopcart or to any of its Items and used
+    # as its ETag, so a client can tell if its copy is current without the Items
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    # Items are lazy loaded by default, the finders below choose an eager
+    # loading strategy so that serializing many Shopcarts is not N+1 queries
+    items = db.relationship(
+        "Item", backref="shopcart", passive_deletes=True, lazy="select"
+    )
+
+    # the version check makes every UPDATE and DELETE of a stale Shopcart fail,
+    # and the new version and timestamps come back with RETURNING
+    __mapper_args__ = {"version_id_col": version, "eager_defaults": True}
 
     def get_total_price(self):
         """Returning the total price."""
+        if self.total_price is not None:
+            return self.total_price
+        # the stored total is only maintained once the Shopcart is saved
         total_price = 0
         for item in self.items:
             total_price += item.get_subtotal()
@@ -41,19 +82,20 @@ class Shopcart(db.Model, PersistentBase):
     def __repr__(self):
         return f"<Shopcart of a user with an id: {self.user_id}, exists under id:{self.id}>"
 
-    def serialize(self):
-        """Serializes a Shopcart into a dictionary"""
-        shopcart = {
-            "id": self.id,
-            "user_id": self.user_id,
-            "creation_date": self.creation_date,
-            "last_updated": self.last_updated,
-            "total_price": self.get_total_price(),
-            "items": [],
-        }
-        for item in self.items:
-            shopcart["items"].append(item.serialize())
+    def serialize(self, fields=FIELDS):
+        """Serializes a Shopcart into a dictionary
 
+        Args:
+            fields (tuple): the keys to serialize, the Items are only read if "items" is one of them
+        """
+        shopcart = {}
+        for field in fields:
+            if field == "items":
+                shopcart["items"] = [item.serialize() for item in self.items]
+            elif field == "total_price":
+                shopcart["total_price"] = self.get_total_price()
+            else:
+                shopcart[field] = getattr(self, field)
         return shopcart
 
     def deserialize(self, data):
@@ -88,12 +130,41 @@ class Shopcart(db.Model, PersistentBase):
     # CLASS METHODS
     ##################################################
 
+    @classmethod
+    def eager_query(cls):
+        """Returns a query for Shopcarts that loads all of their items in one extra SELECT"""
+        return cls.query.options(selectinload(cls.items))
+
     @classmethod
     def all(cls):
         """Returns all of the records in the database"""
         logger.info("Processing all records")
         # pylint: disable=no-member
-        return cls.query.all()
+        return cls.eager_query().all()
+
+    @classmethod
+    def load_options(cls, fields=FIELDS):
+        """Returns the loader options for the columns of the given keys of serialize()
+
+        The Items are joined in the same query if "items" is one of the keys
+        and not loaded at all otherwise
+        """
+        options = [load_only(*cls.row_columns(fields), cls.version)]
+        if "items" in fields:
+            options.append(joinedload(cls.items))
+        return options
+
+    @classmethod
+    def find_fields(cls, by_id, fields=FIELDS):
+        """Finds a Shopcart by it's ID and loads only the columns of the given keys of serialize()"""
+        logger.info("Processing lookup of %s for id %s ...", ",".join(fields), by_id)
+        return db.session.get(cls, by_id, options=cls.load_options(fields))
+
+    @classmethod
+    def find_user_id(cls, by_id):
+        """Returns only the user_id of a Shopcart, or None if it does not exist"""
+        logger.info("Processing user lookup for id %s ...", by_id)
+        return db.session.scalar(db.select(cls.user_id).where(cls.id == by_id))
 
     @classmethod
     def find_by_user_id(cls, user_id):
@@ -103,4 +174,427 @@ class Shopcart(db.Model, PersistentBase):
             user_id (string): the user_id of the user to whom Shopcart you want to match belongs to
         """
         logger.info("Processing carts query for the user with id: %s ...", user_id)
-        return cls.query.filter(cls.user_id == str(user_id))
+        return cls.eager_query().filter(cls.user_id == str(user_id))
+
+    ##################################################
+    # PLAIN ROWS
+    ##################################################
+    @classmethod
+    def row_columns(cls, fields=ROW_FIELDS):
+        """Returns the columns of the given keys of serialize(), leaving out the items"""
+        return tuple(getattr(cls, field) for field in fields if field != "items")
+
+    @classmethod
+    def rows_statement(cls, user_id=None, after=None, limit=None, fields=FIELDS):
+        """
+        Returns a SELECT of the row_columns() of Shopcarts in id order
+
+        If "items" is one of the fields, the Shopcarts are joined to the
+        row_columns() of their Items. Every Item is then a row that repeats
+        the columns of its Shopcart, and a Shopcart without Items is a single
+        row with NULL Item columns. Only the Shopcarts of user_id with an id
+        greater than after are selected, and limit counts Shopcarts
+        """
+        shopcarts = select(*cls.row_columns(fields))
+        if user_id:
+            shopcarts = shopcarts.where(cls.user_id == str(user_id))
+        if after is not None:
+            shopcarts = shopcarts.where(cls.id > after)
+        if "items" not in fields:
+            return shopcarts.order_by(cls.id).limit(limit)
+        if limit is not None:
+            shopcarts = shopcarts.order_by(cls.id).limit(limit)
+        shopcarts = shopcarts.subquery()
+        return (
+            select(shopcarts, *Item.row_columns())
+            .outerjoin(Item, Item.cart_id == shopcarts.c.id)
+            .order_by(shopcarts.c.id, Item.id)
+        )
+
+    @staticmethod
+    def serialize_rows(rows, fields=FIELDS):
+        """
+        Serializes the rows of rows_statement() into the dictionaries of serialize()
+
+        Yields each Shopcart once its last row has been read, so the rows can
+        be streamed. No Shopcarts or Items are built along the way
+        """
+        keys = tuple(field for field in fields if field != "items")
+        if "items" not in fields:
+            return (dict(zip(keys, row)) for row in rows)
+        return _group_items(rows, keys)
+
+    @classmethod
+    def find_rows(cls, user_id=None, after=None, limit=None, fields=FIELDS) -> list:
+        """Returns the serialized Shopcarts of rows_statement() without loading them into the session"""
+        logger.info("Processing rows of %s carts after id: %s ...", limit, after)
+        statement = cls.rows_statement(user_id, after, limit, fields)
+        return list(cls.serialize_rows(db.session.execute(statement), fields))
+
+    @classmethod
+    def adjust_totals(cls, cart_id, price_delta, count_delta=0):
+        """Returns an UPDATE that moves the stored totals of a Shopcart
+
+        Args:
+            cart_id (int): the id of the Shopcart to update
+            price_delta (Decimal): the amount to add to the total_price
+            count_delta (int): the number to add to the item_count
+        """
+        return (
+            update(cls.__table__)
+            .where(cls.id == cart_id)
+            .values(
+                total_price=cls.total_price + price_delta,
+                item_count=cls.item_count + count_delta,
+                version=cls.version + 1,
+            )
+            .returning(cls.total_price, cls.item_count, cls.version)
+        )
+
+    @classmethod
+    def insert_items(cls, cart_id, items):
+        """Returns the statements that add many Items to a Shopcart
+
+        Args:
+            cart_id (int): the id of the Shopcart to add the Items to
+            items (list): deserialized Items that have not been saved yet
+
+        Returns:
+            a multi-row INSERT of the Items that returns them in order, its
+            parameters, and the UPDATE that moves the totals of the Shopcart
+
+        Raises:
+            DataValidationError: when the price or quantity of an Item is not a number
+        """
+        rows = [
+            {
+                "cart_id": cart_id,
+                "product_name": item.product_name,
+                "product_id": item.product_id,
+                "product_price": item.product_price,
+                "quantity": item.quantity,
+            }
+            for item in items
+        ]
+        try:
+            price_delta = sum(_subtotal(row["product_price"], row["quantity"]) for row in rows)
+        except (ArithmeticError, TypeError, ValueError) as error:
+            raise DataValidationError(
+                "Invalid Item: product_price and quantity must be numbers"
+            ) from error
+        return (
+            db.insert(Item).returning(Item, sort_by_parameter_order=True),
+            rows,
+            cls.adjust_totals(cart_id, price_delta, len(rows)),
+        )
+
+    @classmethod
+    def add_items(cls, cart_id, items):
+        """Adds many Items to a Shopcart with one multi-row INSERT
+
+        The Items are inserted and the totals of the Shopcart are moved in the
+        same transaction, so a list of any length costs two statements.
+
+        Args:
+            cart_id (int): the id of the Shopcart to add the Items to
+            items (list): deserialized Items that have not been saved yet
+
+        Returns:
+            the created Items in the order they were given
+        """
+        logger.info("Processing bulk insert of %d items into cart id: %s ...", len(items), cart_id)
+        insert, rows, totals = cls.insert_items(cart_id, items)
+        try:
+            created = db.session.scalars(insert, rows).all()
+            db.session.execute(totals)
+            _expire_cached(cart_id)
+            # RETURNING loaded the Items in full, so keep the commit from
+            # expiring them and reloading them one by one when serialized
+            for item in created:
+                db.session.expunge(item)
+            save_changes()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error adding items to cart: %s", str(e))
+            raise DataValidationError(e) from e
+        return created
+
+    @classmethod
+    def clear_statements(cls, cart_id, versions=None):
+        """Returns the statements that remove every Item from a Shopcart
+
+        The first resets the totals of the Shopcart and returns its id if it
+        exists, and is at one of the versions when they are given. The second
+        deletes all of its Items
+        """
+        reset = update(cls).where(cls.id == cart_id)
+        if versions is not None:
+            reset = reset.where(cls.version.in_(versions))
+        reset = (
+            reset
+            .values(
+                total_price=0,
+                item_count=0,
+                version=cls.version + 1,
+                last_updated=utc_now(),
+            )
+            .returning(cls.id)
+        )
+        return reset, delete(Item).where(Item.cart_id == cart_id)
+
+    @classmethod
+    def clear_items(cls, cart_id, versions=None):
+        """Removes every Item from a Shopcart with one DELETE
+
+        The stored totals are reset and last_updated is bumped in the same
+        transaction, so clearing costs the same for any number of Items.
+
+        Args:
+            cart_id (int): the id of the Shopcart to clear
+            versions (list): the versions the Shopcart may be at, from If-Match
+
+        Returns:
+            True if the Shopcart exists and was cleared, False otherwise
+        """
+        logger.info("Processing clear of all items in cart id: %s ...", cart_id)
+        try:
+            # updating the cart first locks it against items being added meanwhile
+            reset, remove = cls.clear_statements(cart_id, versions)
+            found = db.session.execute(reset).first()
+            if found:
+                db.session.execute(remove)
+            _expire_cached(cart_id)
+            save_changes()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error clearing cart: %s", str(e))
+            raise DataValidationError(e) from e
+        return found is not None
+
+    @classmethod
+    def adjust_item_quantity(cls, cart_id, item_id, step, versions=None):
+        """Moves the quantity of an Item in a Shopcart by step in one statement
+
+        The Item is updated in place with quantity = quantity + step, which
+        cannot lose a concurrent update, and the totals of the Shopcart are
+        moved in the same statement. The update is skipped if it would take
+        the quantity below zero.
+
+        Args:
+            cart_id (int): the id of the Shopcart that holds the Item
+            item_id (int): the id of the Item to change
+            step (int): the amount to add to the quantity, negative to remove
+            versions (list): the versions the Item may be at, from If-Match
+
+        Returns:
+            the updated Item, or None if the Item is not in the Shopcart, is
+            at another version or the quantity would drop below zero
+        """
+        logger.info("Processing quantity change of %s for item id: %s ...", step, item_id)
+        try:
+            item = db.session.execute(
+                cls.quantity_statement(cart_id, item_id, step, versions)
+            ).scalar_one_or_none()
+            _expire_cached(cart_id)
+            save_changes()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error changing quantity of item: %s", str(e))
+            raise DataValidationError(e) from e
+        return item
+
+    @classmethod
+    def quantity_statement(cls, cart_id, item_id, step, versions=None):
+        """Returns the statement that moves the quantity of an Item and the Shopcart totals
+
+        It selects the updated Item, or nothing if the Item is not in the
+        Shopcart, is not at one of the versions when they are given, or the
+        quantity would drop below zero
+        """
+        changed = update(Item.__table__).where(
+            Item.id == item_id,
+            Item.cart_id == cart_id,
+            Item.quantity + step >= 0,
+        )
+        if versions is not None:
+            changed = changed.where(Item.version.in_(versions))
+        changed = (
+            changed
+            .values(quantity=Item.quantity + step, version=Item.version + 1)
+            .returning(*Item.__table__.c)
+            .cte("changed")
+        )
+        statement = (
+            update(cls.__table__)
+            .where(cls.id == changed.c.cart_id)
+            .values(
+                total_price=cls.total_price + changed.c.product_price * step,
+                version=cls.version + 1,
+                last_updated=utc_now(),
+            )
+            .returning(*changed.c)
+        )
+        return (
+            db.select(Item)
+            .from_statement(statement)
+            .execution_options(populate_existing=True)
+        )
+
+    @classmethod
+    def find_total_drift(cls):
+        """Returns the Shopcarts whose stored totals do not match their Items
+
+        Each row holds the id, the stored total_price and item_count, and the
+        total_price and item_count derived from the Items
+        """
+        logger.info("Processing drift check of the stored Shopcart totals ...")
+        derived_total, derived_count = cls._derived_totals()
+        return db.session.execute(
+            db.select(
+                cls.id,
+                cls.total_price,
+                cls.item_count,
+                derived_total.label("derived_total"),
+                derived_count.label("derived_count"),
+            )
+            .where(
+                (cls.total_price != derived_total) | (cls.item_count != derived_count)
+            )
+            .order_by(cls.id)
+        ).all()
+
+    @classmethod
+    def recalculate_totals(cls):
+        """Re-derives the stored totals of every Shopcart from its Items
+
+        Returns the number of Shopcarts that had drifted and were corrected
+        """
+        logger.info("Processing recalculation of the stored Shopcart totals ...")
+        try:
+            result = db.session.execute(cls.recalculate_statement())
+            save_changes()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error recalculating totals: %s", str(e))
+            raise DataValidationError(e) from e
+        return result.rowcount
+
+    @classmethod
+    def recalculate_statement(cls):
+        """Returns the UPDATE that re-derives the totals of the Shopcarts that have drifted"""
+        derived_total, derived_count = cls._derived_totals()
+        return (
+            update(cls.__table__)
+            .where(
+                (cls.total_price != derived_total)
+                | (cls.item_count != derived_count)
+            )
+            .values(
+                total_price=derived_total,
+                item_count=derived_count,
+                version=cls.version + 1,
+            )
+        )
+
+    @classmethod
+    def _derived_totals(cls):
+        """Returns scalar subqueries that derive the totals of a Shopcart from its Items"""
+        derived_total = (
+            db.select(func.coalesce(func.sum(Item.product_price * Item.quantity), 0))
+            .where(Item.cart_id == cls.id)
+            .scalar_subquery()
+        )
+        derived_count = (
+            db.select(func.count(Item.id))  # pylint: disable=not-callable
+            .where(Item.cart_id == cls.id)
+            .scalar_subquery()
+        )
+        return derived_total, derived_count
+
+
+######################################################################
+#  S T O R E D   T O T A L S
+######################################################################
+def _subtotal(product_price, quantity):
+    """Returns the subtotal of an Item rounded the way the database stores it"""
+    price = Decimal(str(product_price or 0)).quantize(CENTS, rounding=ROUND_HALF_UP)
+    return price * int(quantity or 0)
+
+
+def _group_items(rows, keys):
+    """Yields a Shopcart with the given keys and its Items for each run of rows with the same id"""
+    width = len(keys)
+    shopcart = {}
+    for row in rows:
+        if shopcart.get("id") != row[0]:
+            if shopcart:
+                yield shopcart
+            shopcart = dict(zip(keys, row), items=[])
+        if row[width] is not None:
+            shopcart["items"].append(dict(zip(ITEM_FIELDS, row[width:])))
+    if shopcart:
+        yield shopcart
+
+
+def _committed(item, name):
+    """Returns the value of an Item attribute as it was before the flush"""
+    history = inspect(item).attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    return history.unchanged[0] if history.unchanged else getattr(item, name)
+
+
+def _adjust_totals(connection, item, cart_id, price_delta, count_delta):
+    """Moves the stored totals of a Shopcart in the same transaction as the flush"""
+    if cart_id is None:
+        return
+    row = connection.execute(
+        Shopcart.adjust_totals(cart_id, price_delta, count_delta)
+    ).first()
+    # keep a Shopcart that is already in the session in step with the database
+    session = object_session(item)
+    shopcart = session.identity_map.get(session.identity_key(Shopcart, cart_id))
+    if row and shopcart is not None:
+        set_committed_value(shopcart, "total_price", row.total_price)
+        set_committed_value(shopcart, "item_count", row.item_count)
+        set_committed_value(shopcart, "version", row.version)
+
+
+def _expire_cached(cart_id):
+    """Expires a Shopcart in the session whose row was changed without the ORM"""
+    session = db.session()
+    shopcart = session.identity_map.get(session.identity_key(Shopcart, cart_id))
+    if shopcart is not None:
+        session.expire(shopcart)
+
+
+@event.listens_for(Item, "after_insert")
+def _item_inserted(_mapper, connection, item):
+    """Adds a new Item to the totals of its Shopcart"""
+    subtotal = _subtotal(item.product_price, item.quantity)
+    _adjust_totals(connection, item, item.cart_id, subtotal, 1)
+
+
+@event.listens_for(Item, "after_update")
+def _item_updated(_mapper, connection, item):
+    """Moves the totals of the Shopcart(s) by the change to an Item"""
+    if not object_session(item).is_modified(item):
+        return
+    old_cart_id = _committed(item, "cart_id")
+    old_subtotal = _subtotal(
+        _committed(item, "product_price"), _committed(item, "quantity")
+    )
+    new_subtotal = _subtotal(item.product_price, item.quantity)
+    if old_cart_id == item.cart_id:
+        _adjust_totals(connection, item, item.cart_id, new_subtotal - old_subtotal, 0)
+    else:
+        _adjust_totals(connection, item, old_cart_id, -old_subtotal, -1)
+        _adjust_totals(connection, item, item.cart_id, new_subtotal, 1)
+
+
+@event.listens_for(Item, "before_delete")
+def _item_deleted(_mapper, connection, item):
+    """Takes an Item that is about to be deleted out of the totals of its Shopcart"""
+    cart_id = _committed(item, "cart_id")
+    subtotal = _subtotal(_committed(item, "product_price"), _committed(item, "quantity"))
+    _adjust_totals(connection, item, cart_id, -subtotal, -1)
@@ -20,10 +20,17 @@ Shopcart Store Service
 This service implements a REST API that allows you to Create, Read, Update
 and Delete Shopcarts from the inventory of shopcarts in the ShopcartShop
 """
-from flask import jsonify, request, url_for, abort
+import os
+from functools import partial
+from flask import jsonify, request, url_for, abort, stream_with_context, send_from_directory
 from flask import current_app as app  # Import Flask application
-from service.common import status  # HTTP Status Codes
-from service.models import Shopcart, Item
+from service.common import fieldsets, status  # HTTP Status Codes
+from service.common import assets
+from service.common.json_provider import COMPACT
+from service.common.idempotency import idempotent
+from service.common.cursors import encode_cursor, decode_cursor
+from service.models import db, Shopcart, Item
+from service.models.shopcart import FIELDS
 
 
 ######################################################################
@@ -33,7 +40,23 @@ from service.models import Shopcart, Item
 def index():
     """Root URL response"""
     app.logger.info("Request for the index page to be returned.")
-    return app.send_static_file("index.html")
+    if not os.path.isfile(os.path.join(app.config["ASSETS_FOLDER"], assets.INDEX)):
+        return app.send_static_file("index.html")
+    return send_asset(assets.INDEX, immutable=False)
+
+
+@app.route("/assets/<path:file_name>")
+def get_asset(file_name):
+    """Returns a built static file, compressed ahead of time when the client accepts it"""
+    return send_asset(file_name)
+
+
+def send_asset(file_name, immutable=True):
+    """Sends the copy of a built file in the encoding the client prefers"""
+    folder = app.config["ASSETS_FOLDER"]
+    name, encoding = assets.locate(folder, file_name, request.headers.get("Accept-Encoding"))
+    response = send_from_directory(folder, name, mimetype=assets.mimetype(file_name))
+    return assets.tag(response, encoding, immutable)
 
 
 ######################################################################
@@ -50,6 +73,20 @@ def health():
     )
 
 
+######################################################################
+# THE USERS THAT OWN THE IDEMPOTENCY KEYS
+######################################################################
+def shopcart_owner():
+    """Returns the user of the Shopcart being created, who owns its Idempotency-Key"""
+    data = request.get_json(silent=True)
+    return data.get("user_id") if isinstance(data, dict) else None
+
+
+def item_owner(shopcart_id):
+    """Returns the user of a Shopcart, who owns the Idempotency-Keys of the Items added to it"""
+    return Shopcart.find_user_id(shopcart_id)
+
+
 ######################################################################
 #  R E S T   A P I   E N D P O I N T S
 ######################################################################
@@ -59,6 +96,7 @@ def health():
 # CREATE A NEW SHOPCART
 ######################################################################
 @app.route("/shopcarts", methods=["POST"])
+@idempotent(shopcart_owner)
 def create_shopcarts():
     """
     Creates a Shopcart
@@ -89,16 +127,24 @@ def get_shopcarts(shopcart_id):
     This endpoint will return a Shopcart based on it's id
     """
     app.logger.info("Request for shopcart with id: %s", shopcart_id)
+    fields = requested_fields()
 
-    shopcart = Shopcart.find(shopcart_id)
+    # answer a client that already has this version without loading the items
+    response = not_modified(Shopcart, shopcart_id, fields)
+    if response:
+        return response
+
+    # the items are only loaded when they are asked for
+    shopcart = Shopcart.find_fields(shopcart_id, fields)
     if not shopcart:
         error(
             status.HTTP_404_NOT_FOUND,
             f"Shopcart with id '{shopcart_id}' was not found.",
         )
 
-    app.logger.info("Returning shopcart for the user with an id: %s", shopcart.user_id)
-    return jsonify(shopcart.serialize()), status.HTTP_200_OK
+    app.logger.info("Returning shopcart with id: %s", shopcart_id)
+    response = with_etag(jsonify(shopcart.serialize(fields)), shopcart.version, fields)
+    return response, status.HTTP_200_OK
 
 
 ######################################################################
@@ -114,6 +160,7 @@ def delete_shopcarts(shopcart_id):
     app.logger.info("Request to delete shopcart with id: %d", shopcart_id)
 
     shopcart = Shopcart.find(shopcart_id)
+    check_if_match(shopcart.version if shopcart else None)
     if shopcart:
         shopcart.delete()
 
@@ -137,6 +184,7 @@ def delete_items(shopcart_id, item_id):
 
     # See if the item exists and delete it if it does
     item = Item.find(item_id)
+    check_if_match(item.version if item else None)
     if item:
         item.delete()
     return "", status.HTTP_204_NO_CONTENT
@@ -150,20 +198,55 @@ def list_shopcarts():
     """Returns all Shopcarts"""
     app.logger.info("Request for shopcart list")
 
-    shopcarts = []
-
     # See if any query filters were passed in
     user_id = request.args.get("user_id")
-    if user_id:
-        shopcarts = Shopcart.find_by_user_id(user_id)
-    else:
-        shopcarts = Shopcart.all()
+    fields = requested_fields()
+    if "limit" in request.args or "after" in request.args:
+        return list_shopcarts_page(user_id, fields)
+
+    if is_streaming():
+        return stream_json(
+            Shopcart.rows_statement(user_id, fields=fields),
+            partial(Shopcart.serialize_rows, fields=fields),
+        )
 
-    results = [shopcart.serialize() for shopcart in shopcarts]
+    # the Shopcarts are built from plain rows and never enter the session
+    results = Shopcart.find_rows(user_id, fields=fields)
     app.logger.info("Returning %d shopcarts", len(results))
     return jsonify(results), status.HTTP_200_OK
 
 
+def list_shopcarts_page(user_id, fields):
+    """
+    Returns one page of Shopcarts
+
+    The page is selected with the ?limit= and ?after= query parameters, and
+    the cursor for the next page is returned in a Link header
+    """
+    limit = get_page_size()
+    after = get_cursor()
+
+    # Fetch one extra row so we know if there is another page without a COUNT
+    shopcarts = Shopcart.find_rows(user_id, after=after, limit=limit + 1, fields=fields)
+    results = shopcarts[:limit]
+
+    headers = {}
+    if len(shopcarts) > limit:
+        next_url = url_for(
+            "list_shopcarts",
+            user_id=user_id,
+            limit=limit,
+            after=encode_cursor(shopcarts[limit - 1]["id"]),
+            include=request.args.get("include"),
+            fields=request.args.get("fields"),
+            _external=True,
+        )
+        headers["Link"] = f'<{next_url}>; rel="next"'
+
+    app.logger.info("Returning page of %d shopcarts", len(results))
+    return jsonify(results), status.HTTP_200_OK, headers
+
+
 ######################################################################
 # UPDATE AN EXISTING SHOPCART
 ######################################################################
@@ -184,23 +267,27 @@ def update_shopcarts(shopcart_id):
             f"Shopcart with id: '{shopcart_id}' was not found.",
         )
 
+    check_if_match(shopcart.version)
     shopcart.deserialize(request.get_json())
     shopcart.id = shopcart_id
     shopcart.update()
 
     app.logger.info("Shopcart with ID: %d updated.", shopcart.id)
-    return jsonify(shopcart.serialize()), status.HTTP_200_OK
+    response = with_etag(jsonify(shopcart.serialize()), shopcart.version)
+    return response, status.HTTP_200_OK
 
 
 ######################################################################
 # ADD AN ITEM TO A SHOPCART
 ######################################################################
 @app.route("/shopcarts/<int:shopcart_id>/items", methods=["POST"])
+@idempotent(item_owner)
 def create_item(shopcart_id):
     """
     Create an Item on an Shopcart
 
-    This endpoint will add an item to an shopcart
+    This endpoint will add an item to an shopcart. If the body is a list of
+    items they are all added with a single multi-row INSERT
     """
     app.logger.info("Request to create an Item for Shopcart with id: %s", shopcart_id)
     check_content_type("application/json")
@@ -213,13 +300,20 @@ def create_item(shopcart_id):
             f"Shopcart with id '{shopcart_id}' was not found.",
         )
 
-    # Create an item from the json data
-    item = Item()
-    item.deserialize(request.get_json())
-
-    # Append the item to the shopcart
-    shopcart.items.append(item)
-    shopcart.update()
+    # Create the items from the json data
+    data = request.get_json()
+    if isinstance(data, list):
+        if not 0 < len(data) <= app.config["MAX_BATCH_SIZE"]:
+            error(
+                status.HTTP_400_BAD_REQUEST,
+                f"A batch must hold between 1 and {app.config['MAX_BATCH_SIZE']} items",
+            )
+        items = Shopcart.add_items(shopcart_id, [Item().deserialize(row) for row in data])
+        app.logger.info("Added %d items to Shopcart with id: %s", len(items), shopcart_id)
+        return jsonify([item.serialize() for item in items]), status.HTTP_201_CREATED
+
+    item = Item().deserialize(data)
+    item = Shopcart.add_items(shopcart_id, [item])[0]
 
     # Prepare a message to return
     message = item.serialize()
@@ -241,6 +335,10 @@ def get_item(shopcart_id, item_id):
         "Request to retrieve Item with id: %d for Shopcart id: %d", item_id, shopcart_id
     )
 
+    response = not_modified(Item, item_id)
+    if response:
+        return response
+
     # See if the item exists and abort if it doesn't
     item = Item.find(item_id)
     if not item:
@@ -249,7 +347,7 @@ def get_item(shopcart_id, item_id):
             f"Item with id '{item_id}' was not found.",
         )
 
-    return jsonify(item.serialize()), status.HTTP_200_OK
+    return with_etag(jsonify(item.serialize()), item.version), status.HTTP_200_OK
 
 
 ######################################################################
@@ -283,13 +381,14 @@ def update_shopcarts_item(shopcart_id, item_id):
             f"Item with id: '{item_id}' was not found in shopcart with id: '{shopcart_id}'",
         )
 
+    check_if_match(item.version)
     item.deserialize(request.get_json())
     item.update()
 
     app.logger.info(
         "Item with id %d in shopcart with id %d updated.", item_id, shopcart_id
     )
-    return jsonify(item.serialize()), status.HTTP_200_OK
+    return with_etag(jsonify(item.serialize()), item.version), status.HTTP_200_OK
 
 
 ######################################################################
@@ -326,8 +425,12 @@ def list_items(shopcart_id):
         app.logger.info("Requesting all the items")
         filtered_items = Item.all(int(shopcart_id))
 
-    # Get the items for the shopcart
-    results = [item.serialize() for item in filtered_items]
+    filtered_items = Item.rows(filtered_items)
+    if is_streaming():
+        return stream_json(filtered_items.order_by(Item.id).statement, Item.serialize_rows)
+
+    # Get the items for the shopcart as plain rows with the subtotals from the database
+    results = list(Item.serialize_rows(filtered_items))
 
     return jsonify(results), status.HTTP_200_OK
 
@@ -344,21 +447,18 @@ def clear_shopcart(shopcart_id):
     """
     app.logger.info("Request to clear all Items in Shopcart id: %s", shopcart_id)
 
-    # Find the shopcart
-    shopcart = Shopcart.find(shopcart_id)
-
-    # If shopcart does not exist, return a 404 Not Found error
-    if not shopcart:
+    # Delete all items in the shopcart, or return a 404 Not Found error if
+    # the shopcart does not exist
+    if not Shopcart.clear_items(shopcart_id, if_match_versions()):
+        # a Shopcart that exists was not at the version of If-Match
+        check_if_match(Shopcart.find_version(shopcart_id))
         error(
             status.HTTP_404_NOT_FOUND,
             f"Shopcart with id '{shopcart_id}' was not found.",
         )
 
-    # Delete all items in the shopcart
-    for item in shopcart.items:
-        item.delete()
-
-    return shopcart.serialize(), status.HTTP_204_NO_CONTENT
+    app.logger.info("Shopcart with ID: %d cleared.", shopcart_id)
+    return "", status.HTTP_204_NO_CONTENT
 
 
 @app.route(
@@ -368,7 +468,8 @@ def increment_item_quantity(shopcart_id, item_id):
     """
     Increment the quantity of an item in a Shopcart
 
-    This endpoint will increment the quantity of an item in a Shopcart based the body that is posted
+    This endpoint will increment the quantity of an item in a Shopcart by one,
+    or by the amount given with ?step=
     """
 
     app.logger.info(
@@ -377,30 +478,7 @@ def increment_item_quantity(shopcart_id, item_id):
         shopcart_id,
     )
 
-    shopcart = Shopcart.find(shopcart_id)
-    if not shopcart:
-        error(
-            status.HTTP_404_NOT_FOUND,
-            f"Shopcart with id: '{shopcart_id}' was not found.",
-        )
-
-    item = Item.find(item_id)
-
-    if not item:
-        error(
-            status.HTTP_404_NOT_FOUND,
-            f"Item with id: '{item_id}' was not found in shopcart with id: '{shopcart_id}'",
-        )
-
-    item.quantity += 1
-
-    item.update()
-
-    app.logger.info(
-        "Item with id %d in shopcart with id %d updated.", item_id, shopcart_id
-    )
-
-    return jsonify(item.serialize()), status.HTTP_200_OK
+    return adjust_item_quantity(shopcart_id, item_id, get_step())
 
 
 ######################################################################
@@ -415,7 +493,8 @@ def decrement_item_quantity(shopcart_id, item_id):
     """
     Decrement the quantity of an item in a Shopcart
 
-    This endpoint will decrement the quantity of an item in a Shopcart based the body that is posted
+    This endpoint will decrement the quantity of an item in a Shopcart by one,
+    or by the amount given with ?step=. The quantity will not go below zero
     """
 
     app.logger.info(
@@ -424,25 +503,27 @@ def decrement_item_quantity(shopcart_id, item_id):
         shopcart_id,
     )
 
-    shopcart = Shopcart.find(shopcart_id)
-    if not shopcart:
-        error(
-            status.HTTP_404_NOT_FOUND,
-            f"Shopcart with id: '{shopcart_id}' was not found.",
-        )
+    return adjust_item_quantity(shopcart_id, item_id, -get_step())
 
-    item = Item.find(item_id)
 
+def adjust_item_quantity(shopcart_id, item_id, step):
+    """Changes the quantity of an item with a single UPDATE and returns it"""
+    item = Shopcart.adjust_item_quantity(shopcart_id, item_id, step, if_match_versions())
     if not item:
+        # only the failure path pays for a second query to find out why
+        item = Item.find(item_id)
+        found = item is not None and item.cart_id == shopcart_id
+        check_if_match(item.version if found else None)
+        if not found:
+            error(
+                status.HTTP_404_NOT_FOUND,
+                f"Item with id: '{item_id}' was not found in shopcart with id: '{shopcart_id}'",
+            )
         error(
-            status.HTTP_404_NOT_FOUND,
-            f"Item with id: '{item_id}' was not found in shopcart with id: '{shopcart_id}'",
+            status.HTTP_409_CONFLICT,
+            f"Quantity of item with id: '{item_id}' cannot go below zero",
         )
 
-    item.quantity -= 1
-
-    item.update()
-
     app.logger.info(
         "Item with id %d in shopcart with id %d updated.", item_id, shopcart_id
     )
@@ -477,6 +558,146 @@ def check_content_type(content_type):
     )
 
 
+######################################################################
+# Reads the page size for a paginated request
+######################################################################
+def get_page_size():
+    """Returns the ?limit= query parameter bounded by the configured maximum"""
+    limit = request.args.get("limit", app.config["DEFAULT_PAGE_SIZE"])
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= app.config["MAX_PAGE_SIZE"]:
+        error(
+            status.HTTP_400_BAD_REQUEST,
+            f"limit must be an integer between 1 and {app.config['MAX_PAGE_SIZE']}",
+        )
+    return limit
+
+
+######################################################################
+# Reads the step size for a quantity change
+######################################################################
+def get_step():
+    """Returns the ?step= query parameter as a positive integer"""
+    step = request.args.get("step", "1")
+    try:
+        step = int(step)
+    except ValueError:
+        step = 0
+    if step < 1:
+        error(status.HTTP_400_BAD_REQUEST, "step must be a positive integer")
+    return step
+
+
+######################################################################
+# Streams a collection as a JSON array
+######################################################################
+def is_streaming():
+    """Returns True if the client asked for a streamed response with ?stream=true"""
+    return request.args.get("stream", "").lower() in ("true", "1", "yes")
+
+
+def stream_json(statement, serialize):
+    """
+    Streams the results of a statement as a JSON array
+
+    Rows are fetched from a server side cursor in batches of STREAM_BATCH_SIZE,
+    turned into dictionaries by serialize and written out one element at a
+    time, so memory stays bounded no matter how many rows the query returns
+    """
+    batch_size = app.config["STREAM_BATCH_SIZE"]
+    # the same compact JSON that jsonify writes, so the bytes match too
+    dumps = partial(app.json.dumps, separators=COMPACT)
+
+    def generate():
+        rows = db.session.execute(statement.execution_options(yield_per=batch_size))
+        yield "["
+        for count, row in enumerate(serialize(rows)):
+            yield ("," if count else "") + dumps(row)
+        yield "]\n"
+
+    app.logger.info("Streaming results in batches of %d", batch_size)
+    return app.response_class(
+        stream_with_context(generate()), mimetype="application/json"
+    )
+
+
+######################################################################
+# Conditional requests with ETags
+######################################################################
+def not_modified(model, by_id, fields=FIELDS):
+    """
+    Returns a 304 Not Modified response if the If-None-Match header holds the
+    ETag of the current version of a record in the representation of the
+    given fields, or None if the record must be sent in full
+
+    Only the version column is read, so an unchanged record costs one query
+    and no body
+    """
+    if not request.if_none_match:
+        return None
+    version = model.find_version(by_id)
+    if version is None or not request.if_none_match.contains_weak(fieldsets.etag(version, fields)):
+        return None
+    app.logger.info("%s with id: %s was not modified", model.__name__, by_id)
+    response = app.response_class(status=status.HTTP_304_NOT_MODIFIED)
+    return with_etag(response, version, fields)
+
+
+def check_if_match(version):
+    """
+    Aborts with 412 Precondition Failed if the If-Match header does not hold
+    the current version of a record, given as None when it does not exist
+
+    The ETag of any representation of the current version matches. A change
+    made by someone else after this check is caught by the version check of
+    the UPDATE or DELETE itself
+    """
+    if not request.if_match:
+        return
+    if version is None or not fieldsets.version_matches(request.if_match, version):
+        error(
+            status.HTTP_412_PRECONDITION_FAILED,
+            f"The resource is no longer at version {request.if_match.to_header()}",
+        )
+
+
+def if_match_versions():
+    """Returns the versions the If-Match header accepts, or None for any"""
+    return fieldsets.matched_versions(request.if_match)
+
+
+def with_etag(response, version, fields=FIELDS):
+    """Tags a response with the version of its record and asks clients to revalidate it"""
+    response.set_etag(fieldsets.etag(version, fields))
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+######################################################################
+# Reads the fields a request asked for
+######################################################################
+def requested_fields():
+    """Returns the keys of a Shopcart selected by ?include= and ?fields="""
+    return fieldsets.requested_fields(request.args.get("include"), request.args.get("fields"))
+
+
+######################################################################
+# Reads the cursor of a paginated request
+######################################################################
+def get_cursor():
+    """Returns the id decoded from the ?after= query parameter, if there is one"""
+    if "after" not in request.args:
+        return None
+    after = decode_cursor(request.args["after"])
+    if after is None:
+        error(status.HTTP_400_BAD_REQUEST, f"Invalid cursor '{request.args['after']}'")
+    return after
+
+
 ######################################################################
 # Logs error messages before aborting
 ######################################################################
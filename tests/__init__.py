@@ -0,0 +1,7 @@
+"""
+Test cases package
+"""
+import os
+
+# the test database is created by the app when the tests first load it
+os.environ.setdefault("DB_AUTO_MIGRATE", "true")
@@ -0,0 +1,84 @@
+"""
+Query budgets for the routes
+
+Counts the SQL statements every request sends to the database and fails the
+test that made the request when an endpoint sends more than its budget, so a
+route that slips into one query per row is caught by the suite.
+"""
+
+from contextvars import ContextVar
+from flask import signals as flask_signals
+from sqlalchemy import event
+
+
+def _coroutine(function):
+    """Wraps a function in a coroutine function"""
+
+    async def wrapper(*args, **kwargs):
+        return function(*args, **kwargs)
+
+    return wrapper
+
+
+class QueryBudget:
+    """
+    Checks the statements of every request against the budget of its endpoint
+
+    Use it as a context manager around the requests of a test, for example
+    with TestCase.enterContext(). Endpoints without a budget are not checked
+    """
+
+    def __init__(self, budgets, engine, request, signals=flask_signals):
+        self.budgets = budgets
+        self.engine = engine
+        self.request = request
+        self.signals = signals
+        self.overruns = []
+        # the statements of the request being handled in the current thread or task
+        self.statements = ContextVar(f"statements_{id(self)}", default=None)
+        self.receivers = (self._start, self._check)
+        if signals is not flask_signals:
+            # Quart runs plain receivers in a thread of their own, where the
+            # statements of the request cannot be seen
+            self.receivers = tuple(_coroutine(receiver) for receiver in self.receivers)
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        start, check = self.receivers
+        # the request context is still alive when it is torn down, also
+        # after a streamed response has been sent
+        self.signals.request_started.connect(start)
+        self.signals.request_tearing_down.connect(check)
+        return self
+
+    def __exit__(self, *_exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+        start, check = self.receivers
+        self.signals.request_started.disconnect(start)
+        self.signals.request_tearing_down.disconnect(check)
+        if self.overruns:
+            raise AssertionError("Query budget exceeded\n" + "\n\n".join(self.overruns))
+
+    def _record(self, _conn, _cursor, statement, *_args):
+        """Adds a statement to the request that sent it"""
+        statements = self.statements.get()
+        if statements is not None:
+            statements.append(statement)
+
+    def _start(self, _sender, **_kwargs):
+        """Starts counting the statements of a request"""
+        self.statements.set([])
+
+    def _check(self, _sender, **_kwargs):
+        """Notes a request that sent more statements than its endpoint may"""
+        statements = self.statements.get()
+        self.statements.set(None)
+        # blueprint endpoints are prefixed with the name of the blueprint
+        endpoint = (self.request.endpoint or "").rsplit(".", 1)[-1]
+        budget = self.budgets.get(endpoint)
+        if statements is None or budget is None or len(statements) <= budget:
+            return
+        self.overruns.append(
+            f"{self.request.method} {self.request.path} ran {len(statements)} statements "
+            f"for a budget of {budget}:\n" + "\n".join(f"  {sql}" for sql in statements)
+        )
@@ -7,7 +7,7 @@ from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
 # pylint: disable=unused-import
 from wsgi import app  # noqa: F401
-from service.common.cli_commands import db_create  # noqa: E402
+from service.common.cli_commands import db_create, db_migrate, db_totals, idempotency_purge  # noqa: E402
 
 
 class TestFlaskCLI(TestCase):
@@ -23,3 +23,47 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch('service.common.cli_commands.migrations')
+    def test_db_migrate(self, migrations_mock):
+        """It should call the db-migrate command"""
+        migrations_mock.migrate.return_value = [2, 3]
+        result = self.runner.invoke(db_migrate)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Migrated the schema to version 3", result.output)
+
+        migrations_mock.migrate.return_value = []
+        migrations_mock.probe.return_value = 3
+        result = self.runner.invoke(db_migrate)
+        self.assertIn("up to date at version 3", result.output)
+
+    @patch('service.common.cli_commands.Shopcart')
+    def test_db_totals(self, shopcart_mock):
+        """It should call the db-totals command"""
+        shopcart_mock.find_total_drift.return_value = []
+        result = self.runner.invoke(db_totals)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("correct", result.output)
+        shopcart_mock.recalculate_totals.assert_not_called()
+
+    @patch('service.common.cli_commands.Shopcart')
+    def test_db_totals_with_drift(self, shopcart_mock):
+        """It should report drifted totals and fix them with --fix"""
+        row = MagicMock(id=1, total_price=5, item_count=1, derived_total=7, derived_count=2)
+        shopcart_mock.find_total_drift.return_value = [row]
+        shopcart_mock.recalculate_totals.return_value = 1
+        result = self.runner.invoke(db_totals)
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("Shopcart 1", result.output)
+
+        result = self.runner.invoke(db_totals, ["--fix"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Corrected the totals of 1 shopcarts", result.output)
+
+    @patch('service.common.cli_commands.IdempotencyKey')
+    def test_idempotency_purge(self, key_mock):
+        """It should delete the expired idempotency keys"""
+        key_mock.purge.return_value = 3
+        result = self.runner.invoke(idempotency_purge)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Deleted 3 expired idempotency keys", result.output)
@@ -0,0 +1,103 @@
+"""
+Test cases for the gunicorn configuration
+"""
+
+import os
+import importlib.util
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+from wsgi import app
+from service.common import pool_stats
+from service.models import db
+
+CONF_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py")
+
+
+def load_conf(**env):
+    """Loads gunicorn.conf.py with the given environment variables"""
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", CONF_FILE)
+    conf = importlib.util.module_from_spec(spec)
+    with patch.dict(os.environ, env):
+        spec.loader.exec_module(conf)
+    return conf
+
+
+######################################################################
+#  G U N I C O R N   C O N F I G U R A T I O N   T E S T   C A S E S
+######################################################################
+class TestGunicornConf(TestCase):
+    """Test Cases for gunicorn.conf.py"""
+
+    def test_defaults(self):
+        """It should size the workers from the number of CPUs"""
+        conf = load_conf()
+        self.assertEqual(conf.worker_class, "gthread")
+        self.assertEqual(conf.workers, os.cpu_count() * 2 + 1)
+        self.assertEqual(conf.threads, 4)
+        self.assertTrue(conf.preload_app)
+
+    def test_environment(self):
+        """It should read every setting from the environment"""
+        conf = load_conf(
+            GUNICORN_WORKER_CLASS="sync",
+            GUNICORN_WORKERS="3",
+            GUNICORN_BIND="127.0.0.1:9000",
+            GUNICORN_PRELOAD="false",
+        )
+        self.assertEqual(conf.worker_class, "sync")
+        self.assertEqual(conf.workers, 3)
+        self.assertEqual(conf.threads, 1)
+        self.assertEqual(conf.bind, "127.0.0.1:9000")
+        self.assertFalse(conf.preload_app)
+
+    @patch("gc.freeze")
+    def test_when_ready(self, freeze_mock):
+        """It should freeze the preloaded objects before forking"""
+        load_conf().when_ready(MagicMock())
+        freeze_mock.assert_called_once()
+        freeze_mock.reset_mock()
+        load_conf(GUNICORN_GC_FREEZE="false").when_ready(MagicMock())
+        freeze_mock.assert_not_called()
+
+    def test_post_fork(self):
+        """It should give a forked worker a connection pool of its own"""
+        server = MagicMock()
+        server.app.wsgi.return_value = app
+        with app.app_context():
+            pool = db.engine.pool
+        pool_stats.counters["checkouts"] = 10
+        load_conf().post_fork(server, MagicMock())
+        with app.app_context():
+            self.assertIsNot(db.engine.pool, pool)
+        self.assertEqual(pool_stats.counters["checkouts"], 0)
+
+    def test_post_fork_without_preload(self):
+        """It should leave the pool alone when the app was not preloaded"""
+        server = MagicMock()
+        load_conf(GUNICORN_PRELOAD="false").post_fork(server, MagicMock())
+        server.app.wsgi.assert_not_called()
+
+    def test_metrics_dir(self):
+        """It should clear the metrics files and forget the workers that exit"""
+        with tempfile.TemporaryDirectory() as path:
+            old = os.path.join(path, "counter_1.db")
+            dead = os.path.join(path, "gauge_livesum_42.db")
+            conf = load_conf(PROMETHEUS_MULTIPROC_DIR=path)
+            open(old, "wb").close()  # pylint: disable=consider-using-with
+            conf.on_starting(MagicMock())
+            self.assertFalse(os.path.exists(old))
+
+            open(dead, "wb").close()  # pylint: disable=consider-using-with
+            conf.child_exit(MagicMock(), MagicMock(pid=42))
+            self.assertFalse(os.path.exists(dead))
+
+    def test_without_metrics_dir(self):
+        """It should leave the metrics alone without PROMETHEUS_MULTIPROC_DIR"""
+        server = MagicMock()
+        with patch.dict(os.environ):
+            os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+            conf = load_conf()
+        conf.on_starting(server)
+        conf.child_exit(server, MagicMock(pid=42))
+        server.log.info.assert_not_called()
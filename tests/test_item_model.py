@@ -140,6 +140,23 @@ class TestItems(TestCase):
         self.assertNotEqual(Item.find_by_quantity(quantity).count(), 0)
         self.assertEqual(items.count(), 2)
 
+    def test_serialize_rows(self):
+        """It should Serialize Items from plain rows with the subtotal from the database"""
+        shopcart = ShopcartFactory()
+        shopcart.create()
+        for _ in range(3):
+            ItemFactory(shopcart=shopcart).create()
+        cart_id = shopcart.id
+        db.session.remove()
+        expected = sorted((item.serialize() for item in Item.all(cart_id)), key=lambda item: item["id"])
+        db.session.remove()
+
+        rows = list(Item.serialize_rows(Item.rows(Item.all(cart_id).order_by(Item.id))))
+        self.assertEqual(rows, expected)
+        for row in rows:
+            self.assertEqual(str(row["subtotal"]), str(row["product_price"] * row["quantity"]))
+        self.assertEqual(len(db.session.identity_map), 0)
+
 
 ######################################################################
 #  T E S T   I T E M S   E X C E P T I O N   H A N D L E R S
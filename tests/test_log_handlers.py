@@ -0,0 +1,175 @@
+"""
+Test cases for the logging setup
+"""
+
+import io
+import json
+import logging
+import sys
+from unittest import TestCase
+from unittest.mock import patch
+from flask import Flask
+from quart import Quart
+from service import config
+from service.common import log_handlers
+from tests import test_asgi_routes
+
+LOGGER = "tests.server"
+
+
+######################################################################
+#  F O R M A T T E R   T E S T   C A S E S
+######################################################################
+class TestFormatting(TestCase):
+    """Test Cases for formatting and queueing records"""
+
+    def _record(self, exc_info=None):
+        """Returns a record with arguments to merge"""
+        return logging.LogRecord("flask.app", logging.INFO, __file__, 1, "cart %s", ("7",), exc_info)
+
+    def _raised(self):
+        """Returns the exc_info of a raised error"""
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            return sys.exc_info()
+
+    def test_json(self):
+        """It should write a record as a line of JSON"""
+        record = self._record()
+        record.endpoint, record.method, record.path = "get_shopcarts", "GET", "/shopcarts/7"
+        entry = json.loads(log_handlers.JSONFormatter().format(record))
+        self.assertEqual(entry["message"], "cart 7")
+        self.assertEqual(entry["level"], "INFO")
+        self.assertEqual(entry["logger"], "flask.app")
+        self.assertEqual(entry["module"], "test_log_handlers")
+        self.assertEqual(entry["endpoint"], "get_shopcarts")
+        self.assertEqual(entry["path"], "/shopcarts/7")
+        self.assertTrue(entry["time"].endswith("+00:00"))
+        self.assertNotIn("exception", entry)
+
+    def test_exception(self):
+        """It should keep the traceback of a record through the queue"""
+        record = self._record(self._raised())
+        entry = json.loads(log_handlers.JSONFormatter().format(record))
+        self.assertIn("ValueError: broken", entry["exception"])
+
+        queued = log_handlers.RecordQueueHandler(None).prepare(record)
+        self.assertEqual((queued.msg, queued.args, queued.exc_info), ("cart 7", None, None))
+        self.assertIn("ValueError: broken", json.loads(log_handlers.JSONFormatter().format(queued))["exception"])
+
+    def test_route_levels(self):
+        """It should turn level names into levels"""
+        levels = log_handlers.route_levels({"hot": "warning", "debugged": "DEBUG"})
+        self.assertEqual(levels, {"hot": logging.WARNING, "debugged": logging.DEBUG})
+        with self.assertRaisesRegex(log_handlers.LogConfigError, "'VERBOSE' of hot is not a log level"):
+            log_handlers.route_levels({"hot": "VERBOSE"})
+
+    def test_route_sampling(self):
+        """It should turn sampling rates into numbers between 0 and 1"""
+        self.assertEqual(log_handlers.route_sampling({"hot": "0.1", "cold": 1}), {"hot": 0.1, "cold": 1.0})
+        for rate in ("ten percent", "1.5", "-0.1"):
+            with self.assertRaisesRegex(log_handlers.LogConfigError, "of hot is not a rate"):
+                log_handlers.route_sampling({"hot": rate})
+
+
+######################################################################
+#  S E T U P   T E S T   C A S E S
+######################################################################
+class TestInitLogging(TestCase):
+    """Test Cases for init_logging"""
+
+    def setUp(self):
+        """Gives the server logger a handler that writes to a buffer"""
+        self.stream = io.StringIO()
+        server = logging.getLogger(LOGGER)
+        server.handlers = [logging.StreamHandler(self.stream)]
+        server.setLevel(logging.INFO)
+        self.addCleanup(setattr, server, "handlers", [])
+
+    def _app(self, app_class=Flask, **settings):
+        """Returns an app with a route and the logging set up"""
+        app = app_class(__name__)
+        app.config.from_object(config)
+        app.config.update(settings)
+        for endpoint in ("hot", "debugged", "sampled", "other"):
+            app.add_url_rule(f"/{endpoint}", endpoint, lambda: "", methods=["GET", "POST"])
+        log_handlers.init_logging(app, LOGGER)
+        self.addCleanup(log_handlers.stop_logging, app)
+        return app
+
+    def _lines(self, app):
+        """Stops the listener and returns the JSON lines written so far"""
+        log_handlers.stop_logging(app)
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_queued(self):
+        """It should write the records from a queue as JSON with their request"""
+        app = self._app()
+        self.assertIsInstance(app.logger.handlers[0], log_handlers.RecordQueueHandler)
+        with app.test_request_context("/other?page=2", method="POST"):
+            app.logger.info("created %d", 1)
+        lines = self._lines(app)
+        self.assertEqual(lines[0]["message"], "Logging handler established")
+        self.assertNotIn("endpoint", lines[0])
+        self.assertEqual(lines[1]["message"], "created 1")
+        self.assertEqual((lines[1]["endpoint"], lines[1]["method"], lines[1]["path"]), ("other", "POST", "/other"))
+
+    def test_not_queued(self):
+        """It should write to the handlers of the server directly as text"""
+        app = self._app(LOG_QUEUE=False, LOG_FORMAT="text")
+        self.assertEqual(app.logger.handlers, logging.getLogger(LOGGER).handlers)
+        app.logger.warning("direct")
+        self.assertRegex(self.stream.getvalue(), r"\[WARNING\] \[test_log_handlers\] direct")
+
+    def test_levels(self):
+        """It should hold every route to its own level"""
+        app = self._app(LOG_ROUTE_LEVELS={"hot": "WARNING", "debugged": "DEBUG"})
+        self.assertEqual(app.logger.level, logging.DEBUG)
+        for endpoint in ("hot", "debugged", "other"):
+            with app.test_request_context(f"/{endpoint}"):
+                app.logger.debug("debug %s", endpoint)
+                app.logger.info("info %s", endpoint)
+                app.logger.warning("warning %s", endpoint)
+        app.logger.debug("debug outside")
+        messages = [line["message"] for line in self._lines(app)[1:]]
+        self.assertEqual(
+            messages,
+            ["warning hot", "debug debugged", "info debugged", "warning debugged", "info other", "warning other"],
+        )
+
+    def test_sampling(self):
+        """It should keep the records of a share of the requests, and every warning"""
+        app = self._app(LOG_ROUTE_SAMPLING={"sampled": "0.5"})
+        for chance in (0.2, 0.7):
+            with app.test_request_context("/sampled"), patch.object(log_handlers.random, "random", return_value=chance):
+                app.logger.info("first %s", chance)
+                app.logger.info("second %s", chance)
+                app.logger.error("error %s", chance)
+        messages = [line["message"] for line in self._lines(app)[1:]]
+        self.assertEqual(messages, ["first 0.2", "second 0.2", "error 0.2", "error 0.7"])
+
+    def test_quart(self):
+        """It should read the request of a Quart app"""
+        app = self._app(Quart)
+
+        async def log():
+            async with app.test_request_context("/hot", method="GET"):
+                app.logger.info("async")
+
+        test_asgi_routes.run(log())
+        self.assertEqual(self._lines(app)[1]["endpoint"], "hot")
+
+    def test_restart(self):
+        """It should start a new listener on a new queue in a forked worker"""
+        app = self._app()
+        listener = app.extensions["log_listener"]
+        log_handlers.restart_logging(app)
+        self.assertIsNot(app.extensions["log_listener"], listener)
+        self.assertIs(app.logger.handlers[0].queue, app.extensions["log_listener"].queue)
+        listener.stop()
+        app.logger.info("after the fork")
+        self.assertEqual(self._lines(app)[-1]["message"], "after the fork")
+
+        log_handlers.restart_logging(app)
+        self.assertNotIn("log_listener", app.extensions)
@@ -4,12 +4,19 @@ TestShopcarts API Service Test Suite
 
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
 from unittest import TestCase
+from unittest.mock import patch
+from flask import request
+from sqlalchemy import event
 from wsgi import app
 from service.common import status
 from service.models import Shopcart
 from service.models.persistent_base import db
 from .factories import ShopcartFactory, ItemFactory
+from .query_budget import QueryBudget
 
 
 DATABASE_URI = os.getenv(
@@ -17,6 +24,26 @@ DATABASE_URI = os.getenv(
 )
 BASE_URL = "/shopcarts"
 
+# the most SQL statements each endpoint may send for a request, whatever the
+# number of shopcarts or items it touches
+QUERY_BUDGETS = {
+    "index": 0,
+    "health": 0,
+    "create_shopcarts": 3,
+    "get_shopcarts": 2,
+    "delete_shopcarts": 2,
+    "delete_items": 3,
+    "list_shopcarts": 1,
+    "update_shopcarts": 4,
+    "create_item": 3,
+    "get_item": 2,
+    "update_shopcarts_item": 5,
+    "list_items": 2,
+    "clear_shopcart": 2,
+    "increment_item_quantity": 2,
+    "decrement_item_quantity": 2,
+}
+
 
 ######################################################################
 #  T E S T   C A S E S
@@ -43,14 +70,27 @@ class TestShopcartService(TestCase):
 
     def setUp(self):
         """Runs before each test"""
-        self.client = app.test_client()
+        self.client = self._new_client()
         db.session.query(Shopcart).delete()  # clean up the last tests
         db.session.commit()
+        self.enterContext(self._query_budget())
 
     def tearDown(self):
         """This runs after each test"""
         db.session.remove()
 
+    def _new_client(self):
+        """Returns a client for the app under test"""
+        return app.test_client()
+
+    def _query_budget(self):
+        """Returns the query budget the requests of every test must keep to"""
+        return QueryBudget(QUERY_BUDGETS, db.engine, request)
+
+    def _config(self):
+        """Returns the configuration of the app under test"""
+        return app.config
+
     def _create_shopcarts(self, count):
         """Factory method to create shopcarts in bulk"""
         shopcarts = []
@@ -67,6 +107,20 @@ class TestShopcartService(TestCase):
             shopcarts.append(test_shopcart)
         return shopcarts
 
+    @contextmanager
+    def _count_queries(self):
+        """Collects the SQL statements sent to the database inside the block"""
+        statements = []
+
+        def before_cursor_execute(_conn, _cursor, statement, *_args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
     ######################################################################
     #  P L A C E   T E S T   C A S E S   H E R E
     ######################################################################
@@ -107,6 +161,99 @@ class TestShopcartService(TestCase):
         data = response.get_json()
         self.assertEqual(data["user_id"], test_shopcart.user_id)
 
+    def test_get_shopcart_not_modified(self):
+        """It should answer a Shopcart that did not change with 304 Not Modified"""
+        test_shopcart = self._create_shopcarts(1)[0]
+        response = self.client.get(f"{BASE_URL}/{test_shopcart.id}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response.headers["ETag"]
+        self.assertIn("private", response.headers["Cache-Control"])
+        self.assertIn("no-cache", response.headers["Cache-Control"])
+
+        # an unchanged shopcart costs one query and no body
+        with self._count_queries() as statements:
+            response = self.client.get(
+                f"{BASE_URL}/{test_shopcart.id}", headers={"If-None-Match": etag}
+            )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(response.headers["ETag"], etag)
+        self.assertEqual(len(statements), 1, "\n".join(statements))
+
+        # changing an item changes the version of the shopcart
+        item = ItemFactory()
+        response = self.client.post(
+            f"{BASE_URL}/{test_shopcart.id}/items", json=item.serialize()
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.get(
+            f"{BASE_URL}/{test_shopcart.id}", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertEqual(len(response.get_json()["items"]), 1)
+
+    def test_get_shopcart_not_modified_not_found(self):
+        """It should not answer 304 for a Shopcart that does not exist"""
+        response = self.client.get(f"{BASE_URL}/0", headers={"If-None-Match": '"1"'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_shopcart_fields(self):
+        """It should Get only the fields of a Shopcart that were asked for"""
+        shopcart = self._create_shopcarts(1)[0]
+        location = f"{BASE_URL}/{shopcart.id}"
+        items = [item.serialize() for item in ItemFactory.build_batch(2, cart_id=shopcart.id)]
+        self.client.post(f"{location}/items", json=items)
+        full = self.client.get(location)
+
+        tags = {full.headers["ETag"]}
+        for query, keys in [
+            ("include=summary", "creation_date id item_count last_updated total_price user_id"),
+            ("include=none", "creation_date id last_updated user_id"),
+            ("fields=user_id,total_price", "id total_price user_id"),
+            ("include=summary&fields=items,item_count", "id item_count"),
+        ]:
+            with self._count_queries() as statements:
+                response = self.client.get(f"{location}?{query}")
+            data = response.get_json()
+            self.assertEqual(data, {key: full.get_json()[key] for key in keys.split()}, query)
+            # the items are not read at all
+            self.assertNotRegex("\n".join(statements), "(FROM|JOIN) item")
+            tags.add(response.headers["ETag"])
+        self.assertEqual(len(tags), 5)
+
+    def test_get_shopcart_fields_etag(self):
+        """It should give every representation of a Shopcart an ETag of its own"""
+        shopcart = self._create_shopcarts(1)[0]
+        location = f"{BASE_URL}/{shopcart.id}"
+        etag = self.client.get(location).headers["ETag"]
+        summary_etag = self.client.get(f"{location}?include=none").headers["ETag"]
+        self.assertNotEqual(summary_etag, etag)
+
+        # the ETag of the full Shopcart does not validate the other representation
+        response = self.client.get(f"{location}?include=none", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(f"{location}?include=none", headers={"If-None-Match": summary_etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.headers["ETag"], summary_etag)
+
+        # any representation of the current version is good for If-Match
+        response = self.client.put(
+            location, json={"user_id": "renamed", "items": []}, headers={"If-Match": summary_etag}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.delete(location, headers={"If-Match": summary_etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_get_shopcart_bad_fields(self):
+        """It should not Get a Shopcart with an unknown include or field"""
+        response = self.client.get(f"{BASE_URL}/0?include=everything")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("everything", response.get_json()["message"])
+        response = self.client.get(f"{BASE_URL}?fields=id,colour,size")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("colour, size", response.get_json()["message"])
+
     def test_update_shopcart(self):
         """It should Update an existing Shopcart"""
         # create a shopcart to update
@@ -128,6 +275,50 @@ class TestShopcartService(TestCase):
         updated_shopcart = response.get_json()
         self.assertEqual(updated_shopcart["user_id"], "123")
 
+    def test_update_shopcart_if_match(self):
+        """It should only Update a Shopcart at the version given in If-Match"""
+        test_shopcart = self._create_shopcarts(1)[0]
+        location = f"{BASE_URL}/{test_shopcart.id}"
+        response = self.client.get(location)
+        etag = response.headers["ETag"]
+        data = response.get_json()
+
+        data["user_id"] = "first"
+        response = self.client.put(location, json=data, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+        # a second editor still holding the old version is refused
+        data["user_id"] = "second"
+        response = self.client.put(location, json=data, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(response.get_json()["error"], "Precondition Failed")
+        self.assertEqual(self.client.get(location).get_json()["user_id"], "first")
+
+        # clearing checks the version in the UPDATE of the shopcart
+        response = self.client.delete(f"{location}/clear", headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        etag = self.client.get(location).headers["ETag"]
+        response = self.client.delete(f"{location}/clear", headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        response = self.client.delete(location, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.delete(location, headers={"If-Match": "*"})
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.delete(location, headers={"If-Match": "*"})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_update_shopcart_changed_meanwhile(self):
+        """It should refuse an Update when the Shopcart changes after it was read"""
+        test_shopcart = self._create_shopcarts(1)[0]
+        # the request reads the Shopcart, then another writer changes it
+        shopcart = Shopcart.find(test_shopcart.id)
+        with db.engine.begin() as conn:
+            conn.execute(Shopcart.adjust_totals(shopcart.id, 0))
+        response = self.client.put(f"{BASE_URL}/{shopcart.id}", json={"user_id": "late", "items": []})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
     def test_delete_shopcart(self):
         """It should Delete a Shopcart"""
         test_shopcart = self._create_shopcarts(1)[0]
@@ -154,16 +345,153 @@ class TestShopcartService(TestCase):
         data = resp.get_json()
         self.assertNotEqual(len(data), 0)
 
+    def test_get_shopcart_list_by_page(self):
+        """It should Get a list of Shopcarts one page at a time"""
+        shopcarts = self._create_shopcarts(5)
+
+        response = self.client.get(f"{BASE_URL}?limit=2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [shopcart["id"] for shopcart in response.get_json()]
+        # follow the Link header until there are no more pages
+        while "Link" in response.headers:
+            next_url = response.headers["Link"].split(";")[0].strip("<>")
+            response = self.client.get(next_url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.get_json()), 2)
+            ids += [shopcart["id"] for shopcart in response.get_json()]
+
+        self.assertEqual(ids, sorted(shopcart.id for shopcart in shopcarts))
+
+    def test_get_shopcart_list_by_page_and_user_id(self):
+        """It should Get a page of Shopcarts for a single user"""
+        for user_id in ["101", "202", "101", "101"]:
+            response = self.client.post(BASE_URL, json={"user_id": user_id, "items": []})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.get(f"{BASE_URL}?user_id=101&limit=2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.get_json()), 2)
+        self.assertIn("user_id=101", response.headers["Link"])
+
+        next_url = response.headers["Link"].split(";")[0].strip("<>")
+        response = self.client.get(next_url)
+        data = response.get_json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]["user_id"], "101")
+        self.assertNotIn("Link", response.headers)
+
+    def test_query_budget_exceeded(self):
+        """It should fail a request that runs more statements than its budget"""
+        shopcart = self._create_shopcarts(1)[0]
+        budget = self._query_budget()
+        budget.budgets = {"list_items": 1}
+        with self.assertRaises(AssertionError) as context:
+            with budget:
+                self.client.get(f"{BASE_URL}/{shopcart.id}/items")
+        message = str(context.exception)
+        self.assertIn(f"GET /shopcarts/{shopcart.id}/items ran 2 statements for a budget of 1", message)
+        self.assertIn("FROM shopcart", message)
+        self.assertIn("FROM item", message)
+
+    def test_get_shopcart_list_query_count(self):
+        """It should List Shopcarts with the same number of queries for any number of carts"""
+        for count in [2, 6]:
+            for shopcart in self._create_shopcarts(count):
+                for item in ItemFactory.create_batch(3):
+                    resp = self.client.post(
+                        f"{BASE_URL}/{shopcart.id}/items", json=item.serialize()
+                    )
+                    self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+            db.session.remove()
+            with self._count_queries() as statements:
+                response = self.client.get(BASE_URL)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.get_json()), 2 if count == 2 else 8)
+            # one query that joins the carts to all of their items
+            self.assertEqual(len(statements), 1, statements)
+
+        db.session.remove()
+        shopcart_id = response.get_json()[0]["id"]
+        with self._count_queries() as statements:
+            response = self.client.get(f"{BASE_URL}/{shopcart_id}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.get_json()["items"]), 3)
+        self.assertEqual(len(statements), 1, statements)
+
+    def test_stream_shopcart_list(self):
+        """It should Stream a list of Shopcarts"""
+        self._create_shopcarts(3)
+        expected = self.client.get(BASE_URL).get_json()
+
+        response = self.client.get(f"{BASE_URL}?stream=true")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.content_type, "application/json")
+        data = response.get_json()
+        self.assertEqual(data, sorted(expected, key=lambda shopcart: shopcart["id"]))
+
+        user_id = data[0]["user_id"]
+        response = self.client.get(f"{BASE_URL}?stream=true&user_id={user_id}")
+        data = response.get_json()
+        self.assertNotEqual(len(data), 0)
+        self.assertTrue(all(shopcart["user_id"] == user_id for shopcart in data))
+
+        db.session.query(Shopcart).delete()
+        db.session.commit()
+        response = self.client.get(f"{BASE_URL}?stream=true")
+        self.assertEqual(response.get_json(), [])
+
+    def test_list_shopcarts_fields(self):
+        """It should List only the fields of the Shopcarts that were asked for"""
+        shopcarts = self._create_shopcarts(3)
+        items = [item.serialize() for item in ItemFactory.build_batch(2, cart_id=shopcarts[0].id)]
+        self.client.post(f"{BASE_URL}/{shopcarts[0].id}/items", json=items)
+        full = self.client.get(BASE_URL).get_json()
+        summary = [{key: value for key, value in shopcart.items() if key != "items"} for shopcart in full]
+
+        for query in ["include=summary", "include=summary&stream=true"]:
+            with self._count_queries() as statements:
+                response = self.client.get(f"{BASE_URL}?{query}")
+            self.assertEqual(response.get_json(), summary)
+            self.assertNotIn("JOIN item", "\n".join(statements))
+
+        # the next page keeps the fields
+        response = self.client.get(f"{BASE_URL}?fields=items&limit=2")
+        response = self.client.get(response.headers["Link"].split(";")[0].strip("<>"))
+        self.assertEqual(response.get_json(), [{"id": full[2]["id"], "items": []}])
+
+    def test_stream_shopcarts_over_batches(self):
+        """It should Stream Shopcarts whose Items take more than one batch"""
+        shopcarts = self._create_shopcarts(3)
+        for shopcart in shopcarts[1:]:
+            items = [item.serialize() for item in ItemFactory.build_batch(3, cart_id=shopcart.id)]
+            resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=items)
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        listed = self.client.get(BASE_URL)
+        expected = listed.get_json()
+
+        with patch.dict(self._config(), STREAM_BATCH_SIZE=2):
+            response = self.client.get(f"{BASE_URL}?stream=true")
+        self.assertEqual(response.get_json(), expected)
+        # the same compact JSON as the response that is not streamed
+        self.assertEqual(response.data, listed.data)
+        self.assertEqual([len(shopcart["items"]) for shopcart in expected], [0, 3, 3])
+
+    def test_get_shopcart_list_bad_page(self):
+        """It should not Get a page of Shopcarts with a bad limit or cursor"""
+        response = self.client.get(f"{BASE_URL}?limit=0")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(f"{BASE_URL}?limit=ten")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(f"{BASE_URL}?after=not-a-cursor")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_add_item(self):
         """It should Add an item to a shopcart"""
         shopcart = self._create_shopcarts(1)[0]
         item = ItemFactory()
         item.cart_id = None
-        resp = self.client.post(
-            f"{BASE_URL}/{shopcart.id}/items",
-            json=item.serialize(),
-            content_type="application/json",
-        )
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize(), content_type="application/json")
         self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
         data = resp.get_json()
         logging.debug(data)
@@ -172,6 +500,61 @@ class TestShopcartService(TestCase):
         self.assertEqual(data["quantity"], item.quantity)
         self.assertEqual(data["product_price"], str(item.product_price))
 
+    def test_add_item_batch(self):
+        """It should Add a list of items to a shopcart with one INSERT"""
+        shopcart = self._create_shopcarts(1)[0]
+        items = ItemFactory.create_batch(25)
+        with self._count_queries() as statements:
+            resp = self.client.post(
+                f"{BASE_URL}/{shopcart.id}/items",
+                json=[item.serialize() for item in items],
+            )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        inserts = [sql for sql in statements if sql.startswith("INSERT INTO item")]
+        self.assertEqual(len(inserts), 1)
+
+        data = resp.get_json()
+        self.assertEqual(len(data), 25)
+        for created, item in zip(data, items):
+            self.assertIsNotNone(created["id"])
+            self.assertEqual(created["cart_id"], shopcart.id)
+            self.assertEqual(created["product_name"], item.product_name)
+            self.assertEqual(created["quantity"], item.quantity)
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        data = resp.get_json()
+        self.assertEqual(data["item_count"], 25)
+        self.assertEqual(
+            Decimal(data["total_price"]),
+            sum(Decimal(item["subtotal"]) for item in data["items"]),
+        )
+
+    def test_add_item_batch_bad_data(self):
+        """It should not Add a list of items that is empty or has a bad item"""
+        shopcart = self._create_shopcarts(1)[0]
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=[])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        good = ItemFactory().serialize()
+        bad = ItemFactory().serialize()
+        del bad["quantity"]
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=[good, bad])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        negative = ItemFactory(quantity=-1).serialize()
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=[good, negative])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        for field in ("product_price", "quantity"):
+            resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json={**good, field: "abc"})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+            resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=[good, {**good, field: "abc"}])
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # nothing from a rejected batch is saved
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items")
+        self.assertEqual(resp.get_json(), [])
+
     def test_shopcart_not_found(self):
         """It should not find a shopcart"""
         item = ItemFactory()
@@ -213,6 +596,63 @@ class TestShopcartService(TestCase):
         self.assertEqual(data["quantity"], item.quantity)
         self.assertEqual(data["product_price"], str(item.product_price))
 
+    def test_update_item_if_match(self):
+        """It should only Update an Item at the version given in If-Match"""
+        shopcart = self._create_shopcarts(1)[0]
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=ItemFactory().serialize())
+        data = resp.get_json()
+        location = f"{BASE_URL}/{shopcart.id}/items/{data['id']}"
+        etag = self.client.get(location).headers["ETag"]
+
+        data["quantity"] = 5
+        resp = self.client.put(location, json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["quantity"], 5)
+
+        data["quantity"] = 7
+        resp = self.client.put(location, json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.client.delete(location, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        # so do the quantity changes, in their single UPDATE
+        for action in ("increment", "decrement"):
+            resp = self.client.put(f"{location}/{action}", headers={"If-Match": etag})
+            self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        etag = self.client.get(location).headers["ETag"]
+        resp = self.client.put(f"{location}/increment", headers={"If-Match": etag})
+        self.assertEqual(resp.get_json()["quantity"], 6)
+        etag = self.client.get(location).headers["ETag"]
+        resp = self.client.delete(location, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_get_item_not_modified(self):
+        """It should answer an Item that did not change with 304 Not Modified"""
+        shopcart = self._create_shopcarts(1)[0]
+        resp = self.client.post(
+            f"{BASE_URL}/{shopcart.id}/items", json=ItemFactory().serialize()
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        item_id = resp.get_json()["id"]
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items/{item_id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        etag = resp.headers["ETag"]
+
+        resp = self.client.get(
+            f"{BASE_URL}/{shopcart.id}/items/{item_id}",
+            headers={"If-None-Match": etag},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # a new quantity is a new version
+        resp = self.client.put(f"{BASE_URL}/{shopcart.id}/items/{item_id}/increment")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.get(
+            f"{BASE_URL}/{shopcart.id}/items/{item_id}",
+            headers={"If-None-Match": etag},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
     def test_update_shopcart_item(self):
         """It should Update an existing item in a Shopcart"""
         # create a shopcart with an item to update
@@ -336,6 +776,22 @@ class TestShopcartService(TestCase):
         data = resp.get_json()
         self.assertNotEqual(len(data), 0)
 
+    def test_stream_item_list(self):
+        """It should Stream a list of items in a shopcart"""
+        shopcart = self._create_shopcarts(1)[0]
+        for item in ItemFactory.create_batch(4):
+            resp = self.client.post(
+                f"{BASE_URL}/{shopcart.id}/items", json=item.serialize()
+            )
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        expected = self.client.get(f"{BASE_URL}/{shopcart.id}/items").get_json()
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items?stream=true")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.is_streamed)
+        data = resp.get_json()
+        self.assertEqual(data, sorted(expected, key=lambda item: item["id"]))
+
     def test_clear_shopcart(self):
         """Test clearing all items in a shopcart"""
         # Create a shopcart with items
@@ -360,12 +816,37 @@ class TestShopcartService(TestCase):
         self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(resp.data, b"")
 
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        data = resp.get_json()
+        self.assertEqual(data["items"], [])
+        self.assertEqual(data["item_count"], 0)
+        self.assertEqual(data["total_price"], "0.00")
+
         resp = self.client.delete(
             f"{BASE_URL}/0/clear",
             content_type="application/json",
         )
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_clear_shopcart_query_count(self):
+        """It should clear a shopcart of any size with the same statements"""
+        shopcart = self._create_shopcarts(1)[0]
+        resp = self.client.post(
+            f"{BASE_URL}/{shopcart.id}/items",
+            json=[item.serialize() for item in ItemFactory.create_batch(50)],
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+        with self._count_queries() as statements:
+            resp = self.client.delete(f"{BASE_URL}/{shopcart.id}/clear")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        deletes = [sql for sql in statements if sql.startswith("DELETE")]
+        self.assertEqual(len(deletes), 1)
+        self.assertEqual(len(statements), 2, statements)
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}/items")
+        self.assertEqual(resp.get_json(), [])
+
     def test_increment_quantity_by_one(self):
         """It should increment quantity by one"""
         # add four items to the shopcart
@@ -374,30 +855,22 @@ class TestShopcartService(TestCase):
         item = ItemFactory()
         # let's commit the newly created item to the DB
         initial_quantity = item.quantity
-        resp = self.client.post(
-            f"{BASE_URL}/{shopcart.id}/items", json=item.serialize()
-        )
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize())
         self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
 
         data = resp.json
         item_id = data["id"]
 
-        resp = self.client.put(
-            f"{BASE_URL}/{shopcart.id}/items/{item_id}/increment", json=item.serialize()
-        )
+        resp = self.client.put(f"{BASE_URL}/{shopcart.id}/items/{item_id}/increment", json=item.serialize())
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         data = resp.json
         new_quantity = data["quantity"]
         self.assertEqual(new_quantity, initial_quantity + 1)
 
-        resp = self.client.put(
-            f"{BASE_URL}/0/items/{item.id}/increment", json=item.serialize()
-        )
+        resp = self.client.put(f"{BASE_URL}/0/items/{item.id}/increment", json=item.serialize())
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
-        resp = self.client.put(
-            f"{BASE_URL}/{shopcart.id}/items/0/increment", json=item.serialize()
-        )
+        resp = self.client.put(f"{BASE_URL}/{shopcart.id}/items/0/increment", json=item.serialize())
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
     def test_decrement_quantity_by_one(self):
@@ -408,32 +881,74 @@ class TestShopcartService(TestCase):
         item = ItemFactory()
         # let's commit the newly created item to the DB
         initial_quantity = item.quantity
-        resp = self.client.post(
-            f"{BASE_URL}/{shopcart.id}/items", json=item.serialize()
-        )
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize())
         self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
 
         data = resp.json
         item_id = data["id"]
 
-        resp = self.client.put(
-            f"{BASE_URL}/{shopcart.id}/items/{item_id}/decrement", json=item.serialize()
-        )
+        resp = self.client.put(f"{BASE_URL}/{shopcart.id}/items/{item_id}/decrement", json=item.serialize())
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         data = resp.json
         new_quantity = data["quantity"]
         self.assertEqual(new_quantity, initial_quantity - 1)
 
-        resp = self.client.put(
-            f"{BASE_URL}/0/items/{item.id}/decrement", json=item.serialize()
-        )
+        resp = self.client.put(f"{BASE_URL}/0/items/{item.id}/decrement", json=item.serialize())
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
-        resp = self.client.put(
-            f"{BASE_URL}/{shopcart.id}/items/0/decrement", json=item.serialize()
-        )
+        resp = self.client.put(f"{BASE_URL}/{shopcart.id}/items/0/decrement", json=item.serialize())
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_change_quantity_by_step(self):
+        """It should change the quantity by a step and never below zero"""
+        shopcart = self._create_shopcarts(1)[0]
+        item = ItemFactory(quantity=2, product_price=Decimal("1.50"))
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        item_url = f"{BASE_URL}/{shopcart.id}/items/{resp.get_json()['id']}"
+
+        resp = self.client.put(f"{item_url}/increment?step=5")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["quantity"], 7)
+        self.assertEqual(resp.get_json()["subtotal"], "10.50")
+
+        resp = self.client.put(f"{item_url}/decrement?step=7")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["quantity"], 0)
+
+        resp = self.client.put(f"{item_url}/decrement")
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.client.get(item_url)
+        self.assertEqual(resp.get_json()["quantity"], 0)
+
+        for step in ["0", "-1", "two", "%C2%B2"]:  # the last is "²", a digit int() refuses
+            resp = self.client.put(f"{item_url}/increment?step={step}")
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        self.assertEqual(resp.get_json()["total_price"], "0.00")
+
+    def test_concurrent_increments(self):
+        """It should not lose any concurrent increments"""
+        shopcart = self._create_shopcarts(1)[0]
+        item = ItemFactory(quantity=1, product_price=Decimal("2.00"))
+        resp = self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        item_url = f"{BASE_URL}/{shopcart.id}/items/{resp.get_json()['id']}"
+
+        def increment(_):
+            client = self._new_client()
+            return [client.put(f"{item_url}/increment").status_code for _ in range(5)]
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            codes = sum(executor.map(increment, range(4)), [])
+        self.assertEqual(codes, [status.HTTP_200_OK] * 20)
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart.id}")
+        data = resp.get_json()
+        self.assertEqual(data["items"][0]["quantity"], 21)
+        self.assertEqual(data["total_price"], "42.00")
+
 
 ######################################################################
 #  T E S T   S A D   P A T H S
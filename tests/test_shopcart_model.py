@@ -8,7 +8,7 @@ from decimal import Decimal
 from unittest import TestCase
 from unittest.mock import patch
 from wsgi import app
-from service.models import DataValidationError, db, Shopcart
+from service.models import DataValidationError, StaleVersionError, db, Shopcart, Item
 from .factories import ShopcartFactory, ItemFactory
 
 DATABASE_URI = os.getenv(
@@ -179,6 +179,123 @@ class TestShopcarts(TestCase):
         self.assertEqual(len(shopcart.items), 1)
         self.assertEqual(shopcart.get_total_price(), Decimal("20.0"))
 
+    def test_stored_totals_follow_items(self):
+        """It should keep the stored totals in step with every Item change"""
+        shopcart = ShopcartFactory()
+        shopcart.create()
+        self.assertEqual(shopcart.total_price, 0)
+        self.assertEqual(shopcart.item_count, 0)
+
+        first = ItemFactory(shopcart=shopcart, product_price="2.50", quantity=2)
+        first.create()
+        second = ItemFactory(shopcart=shopcart, product_price=10, quantity=1)
+        second.create()
+        self.assertEqual(shopcart.total_price, Decimal("15.00"))
+        self.assertEqual(shopcart.item_count, 2)
+
+        first.quantity = 4
+        first.update()
+        self.assertEqual(shopcart.total_price, Decimal("20.00"))
+
+        # moving an Item takes it out of one Shopcart and into the other
+        other = ShopcartFactory()
+        other.create()
+        second.cart_id = other.id
+        second.update()
+        self.assertEqual(shopcart.total_price, Decimal("10.00"))
+        self.assertEqual(shopcart.item_count, 1)
+        self.assertEqual(other.total_price, Decimal("10.00"))
+        self.assertEqual(other.item_count, 1)
+
+        first.delete()
+        self.assertEqual(shopcart.total_price, 0)
+        self.assertEqual(shopcart.item_count, 0)
+        self.assertEqual(Shopcart.find_total_drift(), [])
+
+    def test_version_follows_changes(self):
+        """It should move the version of a Shopcart with every change to it or its Items"""
+        shopcart = ShopcartFactory()
+        shopcart.create()
+        self.assertEqual(Shopcart.find_version(shopcart.id), 1)
+        self.assertIsNone(Shopcart.find_version(0))
+
+        shopcart.user_id = "changed"
+        shopcart.update()
+        self.assertEqual(Shopcart.find_version(shopcart.id), 2)
+
+        item = ItemFactory(shopcart=shopcart)
+        item.create()
+        self.assertEqual(item.version, 1)
+        self.assertEqual(Shopcart.find_version(shopcart.id), 3)
+
+        # a change that leaves the totals alone still changes the Shopcart
+        item.product_name = "renamed"
+        item.update()
+        self.assertEqual(Item.find_version(item.id), 2)
+        self.assertEqual(Shopcart.find_version(shopcart.id), 4)
+
+        # setting a value it already holds is not a change
+        item.quantity = item.quantity
+        item.update()
+        self.assertEqual(Shopcart.find_version(shopcart.id), 4)
+
+        Shopcart.adjust_item_quantity(shopcart.id, item.id, 1)
+        self.assertEqual(Item.find_version(item.id), 3)
+        self.assertEqual(Shopcart.find_version(shopcart.id), 5)
+
+        Shopcart.clear_items(shopcart.id)
+        self.assertEqual(shopcart.version, 6)
+
+    def test_update_stale_version(self):
+        """It should not Update or Delete a Shopcart changed since it was read"""
+        shopcart = ShopcartFactory()
+        shopcart.create()
+        created = shopcart.last_updated
+        shopcart.user_id = "changed"
+        shopcart.update()
+        self.assertGreater(shopcart.last_updated, created)
+        self.assertEqual(shopcart.creation_date, created)
+
+        # another writer moves the version on behind the session's back
+        shopcart = Shopcart.find(shopcart.id)
+        with db.engine.begin() as conn:
+            conn.execute(
+                db.update(Shopcart)
+                .where(Shopcart.id == shopcart.id)
+                .values(version=Shopcart.version + 1)
+            )
+        shopcart.user_id = "stale"
+        self.assertRaises(StaleVersionError, shopcart.update)
+        shopcart = Shopcart.find(shopcart.id)
+        self.assertEqual(shopcart.user_id, "changed")
+        with db.engine.begin() as conn:
+            conn.execute(
+                db.update(Shopcart)
+                .where(Shopcart.id == shopcart.id)
+                .values(version=Shopcart.version + 1)
+            )
+        self.assertRaises(StaleVersionError, shopcart.delete)
+
+    def test_find_and_fix_total_drift(self):
+        """It should find Shopcarts whose stored totals drifted and fix them"""
+        shopcart = ShopcartFactory()
+        shopcart.create()
+        ItemFactory(shopcart=shopcart, product_price=3, quantity=3).create()
+        db.session.execute(
+            db.update(Shopcart).where(Shopcart.id == shopcart.id).values(total_price=1)
+        )
+        db.session.commit()
+
+        drift = Shopcart.find_total_drift()
+        self.assertEqual(len(drift), 1)
+        self.assertEqual(drift[0].id, shopcart.id)
+        self.assertEqual(drift[0].derived_total, Decimal("9.00"))
+        self.assertEqual(drift[0].derived_count, 1)
+
+        self.assertEqual(Shopcart.recalculate_totals(), 1)
+        self.assertEqual(Shopcart.find_total_drift(), [])
+        self.assertEqual(Shopcart.find(shopcart.id).total_price, Decimal("9.00"))
+
     def test_find_by_user_id(self):
         """It should Find a Shopcart by total price"""
         shopcarts = ShopcartFactory.create_batch(10)
@@ -191,6 +308,32 @@ class TestShopcarts(TestCase):
         for shopcart in found:
             self.assertEqual(shopcart.user_id, user_id)
 
+    def test_find_rows(self):
+        """It should Serialize Shopcarts from plain rows like serialize() does"""
+        shopcarts = ShopcartFactory.create_batch(4)
+        for shopcart in shopcarts:
+            shopcart.create()
+        for shopcart in shopcarts[1:3]:
+            Shopcart.add_items(shopcart.id, ItemFactory.build_batch(3, cart_id=shopcart.id))
+        db.session.remove()
+        expected = sorted((shopcart.serialize() for shopcart in Shopcart.all()), key=lambda cart: cart["id"])
+        for shopcart in expected:
+            shopcart["items"].sort(key=lambda item: item["id"])
+        db.session.remove()
+
+        rows = Shopcart.find_rows()
+        self.assertEqual(rows, expected)
+        self.assertEqual([len(shopcart["items"]) for shopcart in rows], [0, 3, 3, 0])
+        self.assertEqual(len(db.session.identity_map), 0)
+
+        ids = [shopcart["id"] for shopcart in expected]
+        self.assertEqual(Shopcart.find_rows(limit=2), expected[:2])
+        self.assertEqual(Shopcart.find_rows(after=ids[1], limit=1), expected[2:3])
+        self.assertEqual(Shopcart.find_rows(after=ids[-1]), [])
+        user_id = expected[0]["user_id"]
+        found = Shopcart.find_rows(user_id)
+        self.assertEqual(found, [shopcart for shopcart in expected if shopcart["user_id"] == user_id])
+
 
 ######################################################################
 #  T E S T   S H O P C A R T S   E X C E P T I O N   H A N D L E R S
@@ -236,6 +379,24 @@ class TestShopcartExceptionHandlers(TestCase):
         shopcart = ShopcartFactory()
         self.assertRaises(DataValidationError, shopcart.update)
 
+    @patch("service.models.db.session.commit")
+    def test_adjust_item_quantity_exception(self, exception_mock):
+        """It should catch an adjust item quantity exception"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, Shopcart.adjust_item_quantity, 0, 0, 1)
+
+    @patch("service.models.db.session.commit")
+    def test_clear_items_exception(self, exception_mock):
+        """It should catch a clear items exception"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, Shopcart.clear_items, 0)
+
+    @patch("service.models.db.session.commit")
+    def test_recalculate_totals_exception(self, exception_mock):
+        """It should catch a recalculate totals exception"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, Shopcart.recalculate_totals)
+
     @patch("service.models.db.session.commit")
     def test_delete_exception(self, exception_mock):
         """It should catch a delete exception"""